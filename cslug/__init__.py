@@ -2,7 +2,18 @@
 from . import c_parse
 from ._headers import Header
 from ._types_file import Types
-from ._cslug import CSlug
-from ._pointers import ptr, nc_ptr, PointerType
+from ._template import Template
+from ._cslug import CSlug, include_dir
+from ._pointers import ptr, nc_ptr, ptrs, PointerType, adopt
+from ._pointers import strided_ptr, StridedBuffer
+from ._parallel import parallel, CHUNK_LENGTH
+from ._processes import ProcessPool, RemoteFunction
+from ._mapped import MappedFile
+from ._arena import Arena
+from ._soa import StructOfArrays
+from ._struct import dtype
+from ._callbacks import Callback
+from ._batch import Batch
+from ._aio import AsyncDll, AsyncFunction
 from .misc import anchor
 from ._cc import cc, cc_version
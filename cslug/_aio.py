@@ -0,0 +1,176 @@
+"""
+Call C functions from asyncio code without blocking the event loop.
+"""
+
+import os
+import asyncio
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _default_executor():
+    """Get the thread pool shared by every `AsyncDll` which wasn't given its
+    own, creating it if needed."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(os.cpu_count() or 1,
+                                           thread_name_prefix="cslug-aio")
+        return _executor
+
+
+class AsyncDll(object):
+    """An asynchronous view of a slug's library.
+
+    Calling C from a coroutine blocks the event loop for as long as the call
+    takes, even though the GIL is released. Functions accessed via this view
+    instead return awaitables which run the call in a thread pool::
+
+        async def handle(request):
+            values = array.array("d", request.values)
+            total = await slug.aio.sum(values, len(values))
+
+    Use `CSlug.aio` for the default view of a slug or create one directly to
+    configure the thread pool or concurrency limit. Any other attribute of the
+    library (constants, structs, enums...) is passed through unchanged. Python
+    wrappers around functions may be accessed as attributes of asynchronous
+    functions (e.g. ``await slug.aio.scale.vectorized(values, 2)``).
+
+    Every buffer argument (including the buffer behind any `ptr()`) is held,
+    and therefore can't be freed or resized, until the C function returns -
+    even if the awaiting task is cancelled in the meantime. Cancelling a task
+    doesn't interrupt C code already running.
+
+    .. versionadded:: 1.1.0
+
+    """
+    def __init__(self, slug, limit=None, executor=None):
+        """
+
+        Args:
+            slug (cslug.CSlug):
+                The slug whose functions should be made asynchronous.
+            limit (int):
+                The most calls into this slug allowed to run at once. Further
+                calls wait (asynchronously) for a free slot. Defaults to
+                unlimited, although calls can't exceed the size of the
+                thread pool anyway.
+            executor (concurrent.futures.Executor):
+                The thread pool to run calls in. Defaults to a pool, shared
+                with all other slugs, with one thread per CPU.
+
+        """
+        self._slug = slug
+        self.limit = limit
+        self._executor = executor
+        # asyncio.Semaphore() is tied to an event loop so keep one per loop.
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _wrap(self, getattr(self._slug.dll, name), name)
+
+    async def run(self, function, *args):
+        """Await :py:`function(*args)`, called in the thread pool, subject to
+        this view's concurrency limit.
+
+        Use this for anything not available as an attribute.
+
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._executor or _default_executor()
+        if self.limit is None:
+            return await loop.run_in_executor(executor, _call, function, args,
+                                              _hold(args))
+
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.limit)
+        await semaphore.acquire()
+        try:
+            future = executor.submit(_call, function, args, _hold(args))
+        except BaseException:
+            semaphore.release()
+            raise
+        # Free up the slot when the C call finishes rather than when the
+        # awaiting task does, which may be earlier if the task is cancelled.
+        future.add_done_callback(
+            lambda _: _call_soon_threadsafe(loop, semaphore.release))
+        return await asyncio.wrap_future(future, loop=loop)
+
+    def __repr__(self):
+        return f"<AsyncDll of {self._slug.name.name}>"
+
+
+def _wrap(view, function, name):
+    """Wrap any functions in an `AsyncFunction` but leave anything else
+    (including classes) alone."""
+    if callable(function) and not isinstance(function, type):
+        return AsyncFunction(view, function, name)
+    return function
+
+
+class AsyncFunction(object):
+    """A C function (or a Python wrapper for one) which, when called, returns
+    an awaitable for its result. See `AsyncDll`.
+
+    .. versionadded:: 1.1.0
+
+    """
+    def __init__(self, view, function, name):
+        self._view = view
+        self.function = function
+        self.__name__ = name
+
+    function: callable
+    """The synchronous function."""
+
+    def __call__(self, *args):
+        return self._view.run(self.function, *args)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _wrap(self._view, getattr(self.function, name),
+                     f"{self.__name__}.{name}")
+
+    def __repr__(self):
+        return f"<AsyncFunction {self.__name__}>"
+
+
+def _hold(args):
+    """Lock every buffer argument in place until released."""
+    # A ptr() holds its buffer until it's deleted so keeping a reference to it
+    # is enough. Raw buffers however are only held by ctypes during the call
+    # itself, leaving them free to be resized or freed whilst the call is
+    # waiting in the queue.
+    views = []
+    for arg in args:
+        try:
+            views.append(memoryview(arg))
+        except TypeError:
+            pass
+    return views
+
+
+def _call(function, args, views):
+    """Call a function (in a worker thread) then release its arguments'
+    buffers."""
+    try:
+        return function(*args)
+    finally:
+        for view in views:
+            view.release()
+
+
+def _call_soon_threadsafe(loop, callback):
+    try:
+        loop.call_soon_threadsafe(callback)
+    except RuntimeError:  # pragma: no cover
+        # The event loop has since been closed.
+        pass
@@ -0,0 +1,164 @@
+"""
+A preallocated memory pool for short-lived buffers.
+"""
+
+import array
+import ctypes
+
+from cslug._pointers import ptr
+
+
+class Arena(object):
+    """A large, preallocated block of memory to hand out scratch and output
+    buffers from.
+
+    Creating an `array.array` for every call to a C function which needs
+    somewhere to write its output costs an allocation and a Python object every
+    time. An arena instead carves buffers out of one block it allocated up
+    front and frees them all at once with `reset`, which is just resetting an
+    offset::
+
+        arena = Arena(1 << 20)
+        for batch in batches:
+            out = arena.array("d", len(batch))
+            slug.dll.process(batch, len(batch), out)
+            ...
+            arena.reset()
+
+    Alternatively, use the arena as a context manager to free everything
+    allocated inside the ``with`` block on leaving it. These may be nested::
+
+        for batch in batches:
+            with arena:
+                out = arena.array("d", len(batch))
+                ...
+
+    Buffers are `memoryview`\\ s so they may be passed to any function taking
+    an array of the right type or to `ptr()`. They are not zeroed unless
+    requested. The arena does not grow - exceeding its size raises a
+    `MemoryError`. Use `high_water` to find out how large an arena a workload
+    really needs.
+
+    .. warning::
+
+        Resetting does not invalidate buffers already handed out. They will
+        silently alias whatever is allocated next.
+
+    .. versionadded:: 1.1.0
+
+    """
+    def __init__(self, size, alignment=16):
+        """
+
+        Args:
+            size (int):
+                The total capacity in bytes.
+            alignment (int):
+                The default alignment, in bytes, of each buffer. Must be a
+                power of 2.
+
+        """
+        _check_alignment(alignment)
+        self.size = size
+        self.alignment = alignment
+        # Over-allocate so that the usable block can start at an address which
+        # is a multiple of the alignment.
+        self._memory = bytearray(size + alignment)
+        address = ptr(self._memory)
+        start = -int(address) % alignment
+        self._address = int(address) + start
+        address._release()
+        self._view = memoryview(self._memory)[start:start + size]
+        self.used = 0
+        self.high_water = 0
+        self._marks = []
+        self._typed_views = {}
+
+    used: int
+    """The number of bytes currently allocated, including alignment padding.
+    """
+
+    high_water: int
+    """The most bytes that have ever been allocated at once."""
+
+    def array(self, typecode, length, zero=False, alignment=None):
+        """Allocate a buffer.
+
+        Args:
+            typecode (str):
+                An `array` type code for the buffer's items.
+            length (int):
+                The number of items.
+            zero (bool):
+                Fill the buffer with zeros. Otherwise its contents are
+                whatever was last written there.
+            alignment (int):
+                Override the arena's default alignment.
+        Returns:
+            memoryview: A flat writable buffer.
+        Raises:
+            MemoryError: If there isn't enough space left in the arena.
+
+        """
+        try:
+            (view, itemsize) = self._typed_views[typecode]
+        except KeyError:
+            view = self._typed_view(typecode)
+            itemsize = view.itemsize
+        if alignment is None:
+            alignment = self.alignment
+        else:
+            _check_alignment(alignment)
+        if itemsize > alignment:
+            # Items should always be at least naturally aligned.
+            alignment = itemsize
+        # Align the absolute address rather than the offset into the block
+        # since the block's start is only aligned to self.alignment.
+        address = self._address + self.used
+        start = -(-address // alignment) * alignment - self._address
+        stop = start + length * itemsize
+        if stop > self.size:
+            raise MemoryError(
+                f"Allocating {length * itemsize} bytes would exceed this "
+                f"arena's size of {self.size} bytes ({self.used} are already "
+                f"in use).")
+        self.used = stop
+        if stop > self.high_water:
+            self.high_water = stop
+        if start % itemsize:
+            # Only possible if itemsize > self.alignment. The typed view's
+            # items don't line up with this buffer so cast a fresh one.
+            out = self._view[start:stop].cast(typecode)
+        else:
+            out = view[start // itemsize:stop // itemsize]
+        if zero:
+            ctypes.memset(self._address + start, 0, stop - start)
+        return out
+
+    def _typed_view(self, typecode):
+        """Get the whole block, cast to items of type **typecode**."""
+        itemsize = array.array(typecode).itemsize
+        view = self._view[:self.size // itemsize * itemsize].cast(typecode)
+        self._typed_views[typecode] = (view, itemsize)
+        return view
+
+    def reset(self):
+        """Free everything allocated so far."""
+        self.used = 0
+        # Any enclosing with blocks' allocations were freed too.
+        self._marks = [0] * len(self._marks)
+
+    def __enter__(self):
+        self._marks.append(self.used)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.used = self._marks.pop()
+
+    def __repr__(self):
+        return f"<Arena {self.used}/{self.size} bytes used>"
+
+
+def _check_alignment(alignment):
+    if alignment < 1 or alignment & (alignment - 1):
+        raise ValueError(f"Alignment must be a power of 2, not {alignment}.")
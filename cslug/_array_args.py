@@ -0,0 +1,96 @@
+"""
+Python friendly wrappers for C functions which take arrays and their lengths
+and/or write their outputs to pointer parameters.
+"""
+
+import ctypes
+
+from cslug._pointers import _as_typed_buffer, _buffer_length
+
+
+class ArrayFunction(object):
+    """A wrapper around a C function which hides its array lengths and output
+    parameters.
+
+    For a C function such as::
+
+        void range_of(double * values, int len_values, double * out_min,
+                      double * out_max);
+
+    the wrapper takes only the non-length and non-output parameters::
+
+        >>> slug.dll.range_of.wrapped([6, 9, 3, 13.5])
+        (3.0, 13.5)
+
+    Each array is converted to a C-contiguous buffer of the right type (without
+    copying if it is one already) and its length is passed automatically. Each
+    output is allocated, passed by reference then read back. The function's
+    return value, if it has one, followed by its outputs are returned as a
+    tuple. A single output is returned on its own rather than as a 1-tuple.
+
+    Which parameters count as array lengths or outputs is decided purely by
+    naming convention (see `cslug.c_parse.parse_array_parameters`), applied to
+    every function without any opt-in:
+
+    * An integer parameter named ``len_x`` or ``x_len``, where ``x`` is a
+      pointer to a number parameter, is always taken to be the length of
+      ``x``.
+    * A non-:c:`const` pointer to a number named ``out`` or ``out_*``, which
+      has no length parameter, is always taken to be a single output.
+
+    Rename parameters which match but mean something else or call the
+    unwrapped function instead.
+
+    Outputs are zero initialised. Arrays may be empty, in which case a length
+    of 0 is passed. Whatever the C function leaves in its outputs is returned
+    so, if it doesn't handle a length of 0 (e.g. it reads the first item
+    unconditionally), then its outputs are undefined.
+
+    """
+    def __init__(self, function, lengths, outputs):
+        self.function = function
+        self.__name__ = function.__name__
+        argtypes = function.argtypes
+        self._lengths = lengths
+        self._outputs = outputs
+        self._output_types = [argtypes[i]._item_type for i in outputs]
+        self._array_codes = [
+            argtypes[i]._item_type._type_ for (_, i) in lengths
+        ]
+        hidden = set(outputs).union(i for (i, _) in lengths)
+        self._inputs = [i for i in range(len(argtypes)) if i not in hidden]
+        self._has_return = function.restype is not None
+
+    def __call__(self, *args):
+        if len(args) != len(self._inputs):
+            raise TypeError(f"{self.__name__}() takes {len(self._inputs)} "
+                            f"arguments ({len(args)} given)")
+        c_args = [None] * (len(self._inputs) + len(self._lengths) +
+                           len(self._outputs))
+        for (i, arg) in zip(self._inputs, args):
+            c_args[i] = arg
+
+        for ((length, array), code) in zip(self._lengths, self._array_codes):
+            buffer = _as_typed_buffer(c_args[array], code)
+            if buffer is None:
+                raise TypeError(f"Argument {self._inputs.index(array) + 1} of "
+                                f"{self.__name__}() should be an array, not "
+                                f"{c_args[array]!r}.")
+            c_args[array] = buffer
+            c_args[length] = _buffer_length(buffer)
+
+        outputs = [type() for type in self._output_types]
+        for (i, output) in zip(self._outputs, outputs):
+            c_args[i] = ctypes.byref(output)
+
+        result = self.function(*c_args)
+
+        outputs = [i.value for i in outputs]
+        if self._has_return:
+            outputs.insert(0, result)
+        if len(outputs) < 2:
+            return outputs[0] if outputs else None
+        return tuple(outputs)
+
+    def __repr__(self):
+        return f"<ArrayFunction {self.__name__}>"
@@ -0,0 +1,132 @@
+"""
+Call back into Python once per block of items rather than once per item.
+"""
+
+import ctypes
+import array
+
+_BlockCallback = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_ssize_t)
+
+
+class Batch(ctypes.Structure):
+    """A buffer which C fills with items and which is passed to a Python
+    callback a block at a time.
+
+    Calling Python from C costs a GIL acquisition and the conversion of every
+    argument to a Python object - insignificant once but crippling if done
+    for every item of a large array. A batch lets C collect items into a
+    buffer and call Python only when that buffer is full.
+
+    Use the :c:`cslug_batch` type and its helpers from :c:`<cslug.h>` (always
+    on the include path) in your C code:
+
+    .. code-block:: C
+
+        #include <cslug.h>
+
+        void find_negatives(double * values, size_t length,
+                            cslug_batch * out) {
+            for (size_t i = 0; i < length; i++)
+                if (values[i] < 0)
+                    *(double *) cslug_batch_next(out) = values[i];
+            cslug_batch_flush(out);
+        }
+
+    :c:`cslug_batch_next()` returns the address to write the next item to,
+    first passing the buffer to Python if it's full. Alternatively,
+    :c:`cslug_batch_push(batch, &item)` copies an item in. Always call
+    :c:`cslug_batch_flush()` at the end to deliver the last, partially filled
+    block.
+
+    .. code-block:: python
+
+        >>> negatives = []
+        >>> with Batch(negatives.extend, "d") as batch:
+        ...     slug.dll.find_negatives(values, len(values), batch)
+
+    The callback receives a `memoryview` of the buffer. The buffer is reused
+    for the next block so copy anything you want to keep. Exceptions can't
+    propagate through C. Instead, any raised by the callback are stored, any
+    further blocks are discarded, and the exception is raised by the next
+    call to `flush` or on leaving the ``with`` block.
+
+    .. versionadded:: 1.1.0
+
+    """
+    _fields_ = [
+        ("_callback", _BlockCallback),
+        ("_items", ctypes.c_void_p),
+        ("itemsize", ctypes.c_ssize_t),
+        ("block_size", ctypes.c_ssize_t),
+        ("count", ctypes.c_ssize_t),
+    ]
+
+    def __init__(self, callback, item="B", block_size=1024):
+        """
+
+        Args:
+            callback (callable):
+                A function to receive each block.
+            item (str or type):
+                Either an `array` type code or a `ctypes` type (such as a
+                struct) for the items.
+            block_size (int):
+                The number of items to buffer before calling **callback**.
+
+        """
+        if block_size < 1:
+            raise ValueError(f"The block size must be positive, "
+                             f"not {block_size}.")
+        if isinstance(item, str):
+            buffer = array.array(item,
+                                 bytes(block_size * array.array(item).itemsize))
+            address = buffer.buffer_info()[0]
+        else:
+            buffer = (item * block_size)()
+            address = ctypes.addressof(buffer)
+        self.callback = callback
+        self.error = None
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        super().__init__(_BlockCallback(self._deliver), address,
+                         self._view.itemsize, block_size, 0)
+
+    callback: callable
+    error: BaseException
+    """The exception, if any, raised by **callback** which has yet to be
+    reraised."""
+
+    def _deliver(self, items, count):
+        if self.error is not None:
+            return
+        try:
+            self.callback(self._view[:count])
+        except BaseException as ex:
+            self.error = ex
+
+    @property
+    def _as_parameter_(self):
+        # Always pass by reference.
+        return ctypes.byref(self)
+
+    def flush(self):
+        """Pass any items C didn't flush itself to the callback then reraise
+        any exception raised by the callback."""
+        if self.count:
+            self._deliver(None, self.count)
+            self.count = 0
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.flush()
+
+    def __repr__(self):
+        return f"<Batch of {self.count}/{self.block_size} " \
+               f"'{self._view.format}' items for {self.callback!r}>"
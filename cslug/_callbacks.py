@@ -0,0 +1,108 @@
+"""
+Function pointer types which accept Python functions.
+"""
+
+import ctypes
+import types
+import weakref
+
+
+class Callback(object):
+    """Base class for the function pointer types of a slug.
+
+    For every function pointer type declared with a :c:`typedef` such as::
+
+        typedef int (*comparator)(const void * a, const void * b);
+
+        void sort(int * values, size_t length, comparator cmp) { ... }
+
+    ``slug.dll.comparator`` is a `ctypes.CFUNCTYPE` style class inheriting
+    from this one. Function pointer parameters declared without a
+    :c:`typedef` such as :c:`int (*cmp)(const void *, const void *)` get an
+    anonymous type which is available only from their function's
+    ``argtypes``.
+
+    A function with a function pointer parameter may be passed any Python
+    callable directly::
+
+        def compare(a, b):
+            ...
+
+        slug.dll.sort(values, len(values), compare)
+
+    Making a C function pointer out of a Python callable is slow so it is done
+    only once per callable (see `wrap`). The C function pointer lives for as
+    long as the callable does so C code may safely keep hold of it beyond the
+    call it was passed to - so long as the callable isn't deleted.
+
+    .. versionadded:: 1.1.0
+
+    """
+    _thunks = None
+
+    @classmethod
+    def wrap(cls, function):
+        """Get a C function pointer which calls **function**.
+
+        The pointer is cached and returned again for the same **function**
+        (or bound method of the same object) for as long as **function**
+        exists. Callables which can't be weakly referenced, such as builtin
+        functions, are wrapped fresh every time and it's up to you to keep the
+        output alive for as long as C needs it.
+
+        """
+        if isinstance(function, cls):
+            return function
+        if isinstance(function, types.MethodType):
+            # Bound methods are created anew each time they're accessed. Key
+            # them by the object they're bound to instead.
+            (owner, key) = (function.__self__, function.__func__)
+            reference = weakref.WeakMethod
+        else:
+            (owner, key) = (function, None)
+            reference = weakref.ref
+        try:
+            return cls._thunks[owner][key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Not weakly referenceable or not hashable.
+            return cls(function)
+
+        # The pointer mustn't reference the callable or the cache would keep
+        # the callable alive forever.
+        function = reference(function)
+        thunk = cls(lambda *args: function()(*args))
+        cls._thunks.setdefault(owner, {})[key] = thunk
+        return thunk
+
+    @classmethod
+    def from_param(cls, obj):
+        if obj is not None and not isinstance(obj, ctypes._CFuncPtr) \
+                and callable(obj):
+            obj = cls.wrap(obj)
+        return type(cls).from_param(cls, obj)
+
+
+def make_callback(name, restype, argtypes):
+    """Create a `Callback` subclass for C functions with the given `ctypes`
+    return and argument types."""
+    base = ctypes.CFUNCTYPE(restype, *argtypes)
+    return type(
+        name, (base, Callback), {
+            "_argtypes_":
+                base._argtypes_,
+            "_restype_":
+                base._restype_,
+            "_flags_":
+                base._flags_,
+            "_thunks":
+                weakref.WeakKeyDictionary(),
+            "__doc__":
+                "A function pointer type returning {} and taking ({}).".format(
+                    _name(restype), ", ".join(map(_name, argtypes))),
+        })
+
+
+def _name(type):
+    return "void" if type is None else type.__name__
@@ -7,6 +7,9 @@
 
 from cslug import exceptions
 
+# cslug's own C headers. Always on the include path.
+INCLUDE_DIR = Path(__file__).with_name("include")
+
 
 def which(name):
     """Locate an executable in ``PATH``.
@@ -149,6 +152,19 @@ def _parse_cc_version(stdout: bytes, cmd: list):
             f"{indent(stdout.decode(errors='replace'), '    ')}") from None
 
 
+def env_flags():
+    """Get any custom compiler flags from the ``CFLAGS`` or ``CC_FLAGS``
+    environment variables.
+
+    Returns:
+        list[str]: The flags, split on whitespace.
+
+    """
+    flags = re.findall(r"[^\s]+", os.environ.get("CFLAGS", ""))
+    flags += re.findall(r"[^\s]+", os.environ.get("CC_FLAGS", ""))
+    return flags
+
+
 def mmacosx_version_min():  # pragma: Darwin
     """Get a value to be used for the ``-mmacosx-version-min`` compiler option.
     """
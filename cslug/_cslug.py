@@ -8,10 +8,16 @@
 import collections
 import weakref
 import tempfile
+import hashlib
+from glob import escape as glob_escape
 
-from cslug import misc, exceptions, c_parse, Types
+from cslug import misc, exceptions, c_parse, Types, _vectorize, _soa
+from cslug._parallel import parallel as _parallel
+from cslug._aio import AsyncDll
 from cslug._headers import Header
 from cslug._cc import cc, cc_version, mmacosx_version_min, macos_architecture
+from cslug._cc import env_flags as _env_flags
+from cslug._cc import INCLUDE_DIR
 from cslug._stdlib import dlclose
 
 # Choose an appropriate DLL suffix. Asides from keeping files from different OSs
@@ -28,6 +34,19 @@
 # require this flag.
 DEFAULT_LINKS = ["m"] if OS == "Linux" else []
 
+
+def include_dir():
+    """Get the folder containing |cslug|'s C header :c:`<cslug.h>`.
+
+    This folder is automatically added to the include path of every `CSlug` so
+    you only need this if compiling with something else.
+
+    .. versionadded:: 1.1.0
+
+    """
+    return str(INCLUDE_DIR)
+
+
 # The *export all functions* option for each compiler.
 EXPORT_SYMBOLS = {
     "tcc": "-rdynamic",
@@ -41,7 +60,9 @@
 class CSlug(object):
     """Compiles and loads C code in a relatively safe and streamlined manner.
     """
-    def __init__(self, path, *sources, headers=(), links=(), flags=()):
+    def __init__(self, path, *sources, headers=(), links=(), flags=(),
+                 preprocess=False, vectorize=(), templates=(), hold_gil=(),
+                 soa=()):
         """
 
         Args:
@@ -58,6 +79,19 @@ def __init__(self, path, *sources, headers=(), links=(), flags=()):
                 Additional flags to be passed directly to the C compiler. Can
                 also be configured using the ``CFLAGS`` or ``CC_FLAGS``
                 environment variable. Inspect using `compile_command`.
+            preprocess (bool):
+                Scan the C preprocessor's output rather than the raw source code
+                for type information. See `Types` for details.
+            vectorize (str or list[str]):
+                Names of scalar functions to generate and compile element-wise
+                loops for.
+            templates (cslug.Template or list[cslug.Template]):
+                Sources to compile once per type. See `Template`.
+            hold_gil (bool or str or list[str]):
+                Names of functions which should not release the GIL whilst
+                running, True for all functions or False for none.
+            soa (str or list[str]):
+                Names of structs to generate struct-of-arrays companions for.
 
         .. versionchanged:: 0.3.0
 
@@ -67,6 +101,39 @@ def __init__(self, path, *sources, headers=(), links=(), flags=()):
 
             Add ``CFLAGS`` alias for ``CC_FLAGS``.
 
+        .. versionchanged:: 1.1.0
+
+            Add **preprocess**, **vectorize**, **templates**, **hold_gil**
+            and **soa** parameters.
+
+        Calling a C function from Python costs around a microsecond, which
+        dwarfs the cost of a simple function such as :c:`double f(double x)`
+        itself. Listing such a function in **vectorize** compiles a loop around
+        it into the library, exposed as ``slug.dll.f.vectorized``, so that a
+        whole array is processed in one foreign call::
+
+            >>> slug = CSlug("slug.c", vectorize="f")
+            >>> slug.dll.f.vectorized(array.array("d", [1, 2, 3]))
+
+        Vectorized functions must take one or more numeric arguments and return
+        a number. See :ref:`Vectorizing scalar functions` for details.
+
+        By default, like any `ctypes.CDLL`, every function call releases the
+        `GIL <https://docs.python.org/3/glossary.html#term-GIL>`_ on entry and
+        reacquires it on exit so that other Python threads may run in the
+        meantime. For functions taking only a few nanoseconds, such as
+        accessors or hash mixers, that handover costs more than the function
+        itself and causes contention if other threads are running. Functions
+        listed in **hold_gil** are instead loaded with `ctypes.PyDLL`
+        semantics and keep the GIL for the (hopefully short) duration of the
+        call, as do their ``vectorized`` and ``wrapped`` versions. Never use
+        this for a function which may run for a long time or which calls back
+        into Python from another thread.
+
+        Structs listed in **soa** get a structure-of-arrays companion, exposed
+        as ``slug.dll.Struct.SoA``, with transposition to and from an array of
+        structs compiled into the library. See `StructOfArrays`.
+
         """
         path, *sources = misc.flatten(sources, initial=misc.flatten(path))
         path = misc.as_path_or_buffer(path)
@@ -89,9 +156,18 @@ def __init__(self, path, *sources, headers=(), links=(), flags=()):
                 raise TypeError(
                     "The `headers` argument must be of `cslug.Header()` type, "
                     "not {}.".format(type(h)))
-        self.types_map = Types(path.with_suffix(".json"), *self.sources)
         self._dll = None
+        if hold_gil is True:
+            self.hold_gil = True
+        else:
+            self.hold_gil = misc.flatten(hold_gil or ())
+        self._specializations = {}
+        self._aio = None
+        self.macros = {}
         self.flags = [str(i) for i in misc.flatten(flags)]
+        self.types_map = Types(
+            path.with_suffix(".json"), *self.sources, preprocess=preprocess,
+            flags=self.flags, vectorize=vectorize, templates=templates, soa=soa)
 
     def compile(self):
         """Recompile C code only.
@@ -113,10 +189,22 @@ def compile(self):
         """
         self.close()
 
+        # Generate vectorized wrappers, struct-of-arrays layouts and template
+        # instantiations. Each of these must be its own compilation unit,
+        # which rules out piping them in with any pseudo files.
+        generated = []
+        for source in self._generated_sources():
+            file = tempfile.NamedTemporaryFile("w", encoding="utf-8",
+                                               delete=False, suffix=".c")
+            file.write(source)
+            file.close()
+            generated.append(file)
+
         # This would be a simple subprocess.run() if it weren't for having
         # multiple stdins to pipe in. That being said, I'm pretty certain that
         # this doesn't work anyway (see comments below).
-        command, buffers, temporary_files = self.compile_command()
+        command, buffers, temporary_files = \
+            self.compile_command(_generated=generated)
 
         # gcc 10.2 (the only compiler to support both Windows and unicode)
         # expects utf-8 input - irregardless of codepage.
@@ -225,7 +313,7 @@ def dll(self):
             # Load the types.
             self.types_map.init_from_json()
             # Set the types from self.types_map to the dll.
-            self.types_map.apply(dll)
+            self.types_map.apply(dll, hold_gil=self._hold_gil_names())
             # Cache the dll.
             self._dll = dll
 
@@ -242,9 +330,12 @@ def make(self):
 
         1. `close` any open handles.
         2. Rebuild each `Header` in ``headers`` using `Header.make`.
-        3. Recompile the shared library using :meth`compile`.
-        4. Rescan C source code for type information and write it to a json
+        3. Rescan C source code for type information and write it to a json
            file.
+        4. Recompile the shared library using :meth`compile`.
+        5. Delete the libraries of any specializations created using
+           `specialize`, whether by this process or by an earlier one, so
+           that they are rebuilt on next use.
 
         The C library is loaded back into Python on next access of `dll`.
 
@@ -252,11 +343,141 @@ def make(self):
         self.close()
         for header in self.headers:
             header.make()
-        ok = self.compile()
+        # Scan first so that compile() can generate code from the types found.
         self.types_map.make()
+        ok = self.compile()
         self._check_printfs()
+        for slug in self._specializations.values():
+            slug.close()
+        # Specializations are only memoized per process so look for any left
+        # over by other processes on disk too.
+        pattern = re.compile(
+            re.escape(self.name.stem) + r"-[0-9a-f]{12}(" +
+            "|".join(map(re.escape, [SUFFIX, ".json", ".i-cache"])) + ")")
+        for path in self.name.parent.glob(glob_escape(self.name.stem) + "-*"):
+            if pattern.fullmatch(path.name):
+                os.remove(path)
         return ok
 
+    def specialize(self, **macros):
+        """Get a copy of this slug compiled with some macros :c:`#define`\\ d.
+
+        Args:
+            macros:
+                Macro names and the values to define them to.
+        Returns:
+            CSlug: A `CSlug` whose library is specific to **macros**.
+
+        Compilers generate much faster code for loops whose bounds or strides
+        are compile time constants. Give such constants a default in your
+        source code (so that this unspecialized slug still compiles) which
+        the value passed here overrides::
+
+            #ifndef N
+            #define N 3
+            #endif
+
+            double dot(double * a, double * b) {
+                double out = 0;
+                for (int i = 0; i < N; i++) out += a[i] * b[i];
+                return out;
+            }
+
+        Then get a version for whichever value(s) you need::
+
+            >>> slug.specialize(N=3).dll.dot(a, b)
+
+        Each distinct set of **macros** gets its own library, built (if it
+        isn't already) on first use and named after a hash of **macros**. The
+        `CSlug` for each set is memoized so that repeating a request is only
+        a dictionary lookup. Note that, like with `dll`, an existing library
+        is reused without checking if the source code has changed since. Use
+        `make` on this (the unspecialized) slug to invalidate all
+        specializations, including those built by other processes.
+
+        .. versionadded:: 1.1.0
+
+        """
+        # Values end up as text on the command line so N=3 and N="3" are the
+        # same specialization.
+        key = tuple(sorted((k, str(v)) for (k, v) in macros.items()))
+        try:
+            return self._specializations[key]
+        except KeyError:
+            pass
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+        path = self.name.with_name(self.name.stem + "-" + digest)
+        slug = type(self)(
+            path, *self.sources, headers=self.headers, links=self.links,
+            flags=self.flags + [f"-D{k}={v}" for (k, v) in key],
+            preprocess=self.types_map.preprocess,
+            vectorize=self.types_map.vectorize,
+            templates=self.types_map.template_sources,
+            soa=self.types_map.soa,
+            hold_gil=self.hold_gil)  # yapf: disable
+        slug.macros = macros
+        self._specializations[key] = slug
+        return slug
+
+    def parallel(self, func, *args, **kwargs):
+        """Run a function over chunks of buffers using several threads.
+
+        Args:
+            func (str or callable):
+                A function or the name of a function in `dll`.
+            *args:
+            **kwargs:
+                Passed to `cslug.parallel`.
+
+        Equivalent to :py:`cslug.parallel(self.dll.func, *args, **kwargs)`.
+        See `cslug.parallel` for details.
+
+        .. versionadded:: 1.1.0
+
+        """
+        if isinstance(func, str):
+            func = getattr(self.dll, func)
+        return _parallel(func, *args, **kwargs)
+
+    @property
+    def aio(self):
+        """An asynchronous view of `dll` whose functions return awaitables.
+
+        Returns:
+            cslug.AsyncDll:
+
+        ::
+
+            total = await slug.aio.sum(values, len(values))
+
+        Calls run in a thread pool shared by all slugs. To limit how many
+        calls into this slug may run at once or to use a different thread
+        pool, replace this attribute with your own `cslug.AsyncDll`::
+
+            slug.aio = AsyncDll(slug, limit=4)
+
+        .. versionadded:: 1.1.0
+
+        """
+        if self._aio is None:
+            self._aio = AsyncDll(self)
+        return self._aio
+
+    @aio.setter
+    def aio(self, view):
+        self._aio = view
+
+    def _hold_gil_names(self):
+        """Get the names of the functions which shouldn't release the GIL."""
+        functions = self.types_map.functions
+        if self.hold_gil is True:
+            return set(functions)
+        for name in self.hold_gil:
+            if name not in functions:
+                raise ValueError(f"Can't hold the GIL for '{name}' because no "
+                                 f"function of that name was found.")
+        return set(self.hold_gil)
+
     def __del__(self):
         # Release the DLL on deletion of this object on Windows so that make()
         # can be called without tripping permission errors.
@@ -269,10 +490,13 @@ def __del__(self):
             except:
                 pass
 
-    def compile_command(self, _cc=None, _cc_version=None):
+    def compile_command(self, _cc=None, _cc_version=None, _generated=()):
         """Get the compile command invoked by `compile`.
 
         I hope to eventually make this function configurable.
+
+        Generated code (see **vectorize**, **soa** and **templates**) is only
+        written out by `compile` so isn't included here.
         """
         _cc = cc(_cc)
         cc_name, version = _cc_version or cc_version(_cc)
@@ -329,10 +553,8 @@ def compile_command(self, _cc=None, _cc_version=None):
         # Super noisy build warnings.
         warning_flags = "-Wall -Wextra".split()
 
-        # Custom flags from the CFLAGS/CC_FLAGS environment variables. Delimited
-        # with whitespace.
-        env_flags = re.findall(r"[^\s]+", os.environ.get("CFLAGS", ""))
-        env_flags += re.findall(r"[^\s]+", os.environ.get("CC_FLAGS", ""))
+        # Custom flags from the CFLAGS/CC_FLAGS environment variables.
+        env_flags = _env_flags()
 
         # Compile all .c files into 1 combined library.
         # Note that you don't pass header files to compilers.
@@ -340,9 +562,12 @@ def compile_command(self, _cc=None, _cc_version=None):
                       if i.suffix != ".h"]  # yapf: disable
         buffers = [i for i in self.sources if not isinstance(i, Path)]
 
+        # Source files generated by compile().
+        temporary_files = list(_generated)
+        true_files += [i.name for i in temporary_files]
+
         # For the compilers that do not support piped source code, convert all
         # pseudo files to temporary files.
-        temporary_files = []
         if cc_name in ("pcc", "pgcc") or (OS == "Darwin"
                                           and arch == "universal2"):
             for buffer in buffers:
@@ -359,9 +584,33 @@ def compile_command(self, _cc=None, _cc_version=None):
 
         link_flags = ["-l" + i for i in self.links]
 
+        include_flags = ["-I", include_dir()]
+
         return ([_cc] + output + flags + warning_flags + self.flags +
-                env_flags + true_files + stdin_flags + link_flags, buffers,
-                temporary_files)
+                env_flags + include_flags + true_files + stdin_flags +
+                link_flags, buffers, temporary_files)
+
+    def _generated_sources(self):
+        """Generate the C code of any vectorized wrappers, struct-of-arrays
+        layouts and template instantiations."""
+        generated = []
+        if self.types_map.vectorize or self.types_map.soa:
+            # Reuse the types found by make() if it's been called.
+            if getattr(self.types_map, "types", None) is None:
+                self.types_map.init_from_source()
+            types = self.types_map.types
+        if self.types_map.vectorize:
+            generated.append(
+                _vectorize.c_source(types["functions"],
+                                    self.types_map.vectorize))
+        if self.types_map.soa:
+            generated.append(_soa.c_source(types["structs"],
+                                           self.types_map.soa))
+        for template in self.types_map.template_sources:
+            names = template.function_names()
+            generated.extend(
+                template.c_source(type, names) for type in template.types)
+        return generated
 
     def _check_printfs(self):
         return any(check_printfs(*misc.read(i)) for i in self.sources)
@@ -0,0 +1,182 @@
+"""
+Pass memory-mapped files to C without reading them into memory first.
+"""
+
+import os
+import mmap
+import array
+
+from cslug._pointers import ptr
+
+_MODES = {"r": mmap.ACCESS_READ, "c": mmap.ACCESS_COPY}
+
+
+class MappedFile(object):
+    """A binary file, memory-mapped as an array, for passing to C in windows.
+
+    Reading a large file into `bytes` before passing it to C doubles the memory
+    required and copies everything once. Mapping it instead lets the operating
+    system page the file in on demand::
+
+        with MappedFile("data.bin", "d") as file:
+            total = sum(slug.dll.sum(window, len(window))
+                        for window in file.windows(1 << 20))
+
+    Each window is a `memoryview` of the mapping which may be passed to any
+    function taking an array of the right type or to `ptr()`. A `ptr()` to a
+    window holds a reference to the mapping so that, even after `close`, the
+    file stays mapped until every pointer and window into it has been deleted.
+
+    Windows always start at a multiple of the item size from the start of the
+    file. Since the mapping itself is page aligned, every item is correctly
+    aligned for its C type.
+
+    .. versionadded:: 1.1.0
+
+    """
+    def __init__(self, path, typecode="B", mode="r", offset=0):
+        """
+
+        Args:
+            path (str or os.PathLike):
+                The file to map.
+            typecode (str):
+                An `array` type code for the file's contents. Use
+                `cslug.misc.array_typecode` to get the type code for a C type.
+            mode (str):
+                Either ``"r"`` to map read-only or ``"c"`` to map
+                copy-on-write, meaning that the mapping is writable but writes
+                are never written back to the file.
+            offset (int):
+                Skip this many bytes (such as a header) at the start of the
+                file. Must be a multiple of the item size.
+
+        Any trailing bytes which don't make a whole item are ignored.
+
+        """
+        if mode not in _MODES:
+            raise ValueError(f"Invalid mode '{mode}'. Choose from 'r' "
+                             f"(read-only) or 'c' (copy-on-write).")
+        self.path = path
+        self.typecode = typecode
+        self.mode = mode
+        self.itemsize = array.array(typecode).itemsize
+        if offset % self.itemsize:
+            raise ValueError(f"An offset of {offset} bytes would misalign "
+                             f"items of size {self.itemsize}.")
+        self.offset = offset
+
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=_MODES[mode])
+                buffer = self._mmap
+            else:
+                # Empty files can't be mapped.
+                self._mmap = None
+                buffer = bytearray() if mode == "c" else bytes()
+        stop = offset + max(size - offset, 0) // self.itemsize * self.itemsize
+        self.view = memoryview(buffer)[offset:stop].cast(typecode)
+        self._advise("MADV_SEQUENTIAL")
+
+    view: memoryview
+    """The whole file (minus **offset**) as a flat array."""
+
+    def __len__(self):
+        """The number of items in the file."""
+        return len(self.view)
+
+    def ptr(self, start=0, stop=None):
+        """Get a `ptr()` to items **start** to **stop**."""
+        return ptr(self.view[start:stop])
+
+    def window(self, start, stop):
+        """Get items **start** to **stop** as a `memoryview`.
+
+        The operating system is advised that these pages will be needed soon
+        so that it can start reading them in.
+
+        """
+        window = self.view[start:stop]
+        (start, stop, _) = slice(start, stop).indices(len(self.view))
+        self._advise("MADV_WILLNEED", start, stop)
+        return window
+
+    def windows(self, length, overlap=0):
+        """Iterate over the file in windows of **length** items.
+
+        Args:
+            length (int):
+                The number of items per window. The last window may be shorter.
+            overlap (int):
+                How many items each window should share with the previous one.
+                Useful for kernels such as moving averages which need to see
+                a little before their start.
+        Returns:
+            Iterator[memoryview]:
+
+        Each window's pages are requested from the operating system in advance
+        and, in read-only mode, each window's pages are released once the next
+        window is requested.
+
+        """
+        if not 0 <= overlap < length:
+            raise ValueError("The overlap must be less than the window length "
+                             "and not negative.")
+        start = 0
+        previous = None
+        while start < len(self.view) or start == 0:
+            stop = min(start + length, len(self.view))
+            window = self.window(start, stop)
+            if previous is not None and self.mode == "r":
+                # Pages of a read-only file mapping can always be reread from
+                # the file should they be needed again.
+                self._advise("MADV_DONTNEED", previous, start)
+            yield window
+            if stop == len(self.view):
+                break
+            previous = start
+            start = stop - overlap
+
+    def _advise(self, option, start=0, stop=None):
+        """Call `mmap.mmap.madvise` on items **start** to **stop** if both the
+        platform and Python support it."""
+        option = getattr(mmap, option, None)
+        if self._mmap is None or option is None \
+                or not hasattr(self._mmap, "madvise"):
+            return  # pragma: no cover
+        if stop is None:
+            stop = len(self.view)
+        # madvise() requires a page aligned start.
+        start = self.offset + start * self.itemsize
+        stop = self.offset + stop * self.itemsize
+        aligned = start - start % mmap.PAGESIZE
+        if stop > aligned:
+            self._mmap.madvise(option, aligned, stop - aligned)
+
+    def close(self):
+        """Stop using the mapping.
+
+        The file is unmapped once every view and `ptr()` into it has been
+        deleted.
+
+        """
+        self.view.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Windows or pointers into the mapping still exist. Leave them
+                # to unmap it on deletion.
+                pass
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f"<MappedFile {os.fspath(self.path)!r} of {len(self)} " \
+               f"'{self.typecode}' items>"
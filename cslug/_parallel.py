@@ -0,0 +1,183 @@
+"""
+Run C functions over chunks of buffers on several threads at once.
+"""
+
+import os
+import ctypes
+import itertools
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from cslug._pointers import ptrs
+
+# Chunk boundaries are rounded to multiples of this many bytes so that no two
+# threads ever write to the same cache line.
+CACHE_LINE = 64
+
+
+class _ChunkLength(object):
+    """A placeholder argument for `parallel` meaning *the number of items in
+    this chunk*."""
+    def __repr__(self):
+        return "cslug.CHUNK_LENGTH"
+
+
+CHUNK_LENGTH = _ChunkLength()
+
+
+def parallel(func, *args, chunks=None, reduce=None, length=None, pin=False):
+    """Call **func** on chunks of its buffer arguments from several threads.
+
+    Args:
+        func (callable):
+            A function from a `CSlug.dll` or any of the Python wrappers |cslug|
+            provides for them (e.g. ``func.vectorized`` or ``func.wrapped``).
+        *args:
+            Arguments for **func**. Buffers are split into chunks and any
+            `CHUNK_LENGTH` is replaced with the number of items in a chunk.
+        chunks (int):
+            How many chunks to split into. Defaults to the number of threads
+            in the thread pool which is the number of usable CPUs.
+        reduce (callable):
+            A function to combine the list of each chunk's return value into
+            one. Without it, that list is returned.
+        length (int):
+            The number of items to split over. Only buffers of this length are
+            split - any others are passed whole to every chunk. Defaults to the
+            length of the first buffer argument.
+        pin (bool):
+            Pin each thread to its own CPU (on platforms which support
+            `os.sched_setaffinity`).
+    Returns:
+        The output of **reduce** or a list of each chunk's return value.
+
+    Calling into C through `ctypes` releases the GIL so running a kernel over
+    independent parts of a large buffer from several threads scales almost
+    linearly with the number of CPUs::
+
+        total = cslug.parallel(slug.dll.sum, values, cslug.CHUNK_LENGTH,
+                               reduce=sum)
+
+    Raw C functions receive each chunk as a pointer into the original buffer
+    whereas Python wrappers receive a `memoryview` slice of it. Either way,
+    nothing is copied. Chunk boundaries are aligned to multiples of
+    :py:`CACHE_LINE` bytes.
+
+    Threads are taken from a thread pool shared by all calls so the cost of
+    starting them is only paid once. The C function must be thread safe and
+    must only write to its own chunk's part of any output buffers.
+
+    .. versionadded:: 1.1.0
+
+    """
+    # Find buffer arguments and their sizes.
+    views = {}
+    for (i, arg) in enumerate(args):
+        try:
+            view = memoryview(arg)
+        except TypeError:
+            continue
+        if view.ndim == 0:
+            continue
+        if not view.c_contiguous:
+            raise ValueError(f"Argument {i} is not C-contiguous.")
+        views[i] = view
+    if length is None:
+        if not views:
+            raise TypeError("parallel() requires at least one buffer argument "
+                            "to split.")
+        length = _count(next(iter(views.values())))
+    views = {i: view for (i, view) in views.items() if _count(view) == length}
+
+    # Choose chunk boundaries.
+    pool = _pool(pin)
+    chunks = max(1, min(chunks or len(_cpus()), length))
+    itemsize = min((i.itemsize for i in views.values()), default=CACHE_LINE)
+    align = max(1, CACHE_LINE // itemsize)
+    step = -(-length // chunks)
+    step = -(-step // align) * align
+    if length:
+        bounds = [(i, min(i + step, length)) for i in range(0, length, step)]
+    else:
+        # Still call the function once so that there's something to reduce.
+        bounds = [(0, 0)]
+
+    raw = isinstance(func, ctypes._CFuncPtr)
+    with ptrs(*(args[i] for i in views)) if raw \
+            else contextlib.nullcontext() as pointers:
+        if raw:
+            pointers = dict(zip(views, pointers))
+        else:
+            flat = {i: _flatten(view) for (i, view) in views.items()}
+
+        jobs = []
+        try:
+            for (start, stop) in bounds:
+                chunk_args = list(args)
+                for (i, view) in views.items():
+                    if raw:
+                        chunk_args[i] = pointers[i] + start * view.itemsize
+                    else:
+                        chunk_args[i] = flat[i][start:stop]
+                for (i, arg) in enumerate(chunk_args):
+                    if arg is CHUNK_LENGTH:
+                        chunk_args[i] = stop - start
+                jobs.append(pool.submit(func, *chunk_args))
+        finally:
+            # Never release the buffers whilst any chunk may still be using
+            # them, even if another chunk has already failed.
+            wait(jobs)
+        results = [job.result() for job in jobs]
+
+    return reduce(results) if reduce is not None else results
+
+
+def _count(view):
+    """Count the items in a buffer, treating multidimensional ones as flat."""
+    return view.nbytes // view.itemsize if view.itemsize else 0
+
+
+def _flatten(view):
+    """Reshape a buffer to 1D, keeping its item type if possible."""
+    if view.ndim == 1:
+        return view
+    try:
+        return view.cast("B").cast(view.format)
+    except (TypeError, ValueError):
+        if view.itemsize == 1:
+            return view.cast("B")
+        raise ValueError(
+            f"Can't split a multidimensional buffer with format "
+            f"'{view.format}' into chunks. Pass a 1D buffer instead.") from None
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _cpus():
+    """The CPUs this process is allowed to use."""
+    if hasattr(os, "sched_getaffinity"):  # pragma: no branch
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))  # pragma: no cover
+
+
+def _pool(pin):
+    """Get the shared thread pool, creating it if needed."""
+    pin = pin and hasattr(os, "sched_setaffinity")
+    with _pools_lock:
+        if pin not in _pools:
+            cpus = _cpus()
+            if pin:
+                counter = itertools.count()
+
+                def initializer():
+                    # On Linux, a pid of 0 means the calling thread.
+                    os.sched_setaffinity(0, {cpus[next(counter) % len(cpus)]})
+            else:
+                initializer = None
+            _pools[pin] = ThreadPoolExecutor(
+                len(cpus), thread_name_prefix="cslug-parallel",
+                initializer=initializer)
+        return _pools[pin]
@@ -5,7 +5,13 @@
 
 """
 
+import sys
 import ctypes
+import functools
+import array
+import weakref
+
+from cslug.misc import flatten as _flatten
 
 
 def ptr(bytes_like):
@@ -70,7 +76,93 @@ def nc_ptr(bytes_like):
 
     """
     # Yeah, that 0x18 is a hard-coded int flag. It's name is PyBUF_STRIDES.
-    return PointerType(bytes_like, 0x18)
+    return _py_buffer_pointer(bytes_like, 0x18)
+
+
+def strided_ptr(bytes_like):
+    """Describe a possibly non-contiguous buffer with its shape and strides.
+
+    Returns:
+        StridedBuffer: A `ctypes.Structure` equivalent to :c:`cslug_strided`.
+
+    `nc_ptr()` gives C a pointer to the start of a non-contiguous buffer but C
+    then has no way of knowing where the rest of it is. This function instead
+    returns a descriptor containing the data pointer, the number of dimensions,
+    the item size and the shape and strides reported by the buffer protocol -
+    all from one call to :c:`PyObject_GetBuffer()`. Nothing is copied.
+
+    Use the :c:`cslug_strided` type from the header :c:`<cslug.h>` (always on
+    the include path) in your C code and pass the descriptor by pointer:
+
+    .. code-block:: C
+
+        #include <cslug.h>
+
+        double sum(cslug_strided * array) {
+            // For 2D arrays of doubles.
+            double out = 0;
+            for (ptrdiff_t i = 0; i < array->shape[0]; i++)
+                for (ptrdiff_t j = 0; j < array->shape[1]; j++) {
+                    ptrdiff_t index[2] = {i, j};
+                    out += *(double *) cslug_strided_at(array, index);
+                }
+            return out;
+        }
+
+    .. code-block:: python
+
+        >>> slug.dll.sum(strided_ptr(numpy_array.T[::2]))
+
+    The descriptor holds the buffer until it is deleted.
+
+    .. versionadded:: 1.1.0
+
+    """
+    pointer = _py_buffer_pointer(bytes_like, 0x18)
+    view = _Py_buffer.from_buffer(pointer._py_buffer)
+    out = StridedBuffer(pointer, view.ndim, view.itemsize, view.shape,
+                        view.strides)
+    out._pointer = pointer
+    return out
+
+
+class StridedBuffer(ctypes.Structure):
+    """A C-compatible description of a strided buffer. Get one using
+    `strided_ptr()`."""
+    _fields_ = [
+        ("data", ctypes.c_void_p),
+        ("ndim", ctypes.c_ssize_t),
+        ("itemsize", ctypes.c_ssize_t),
+        ("shape", ctypes.POINTER(ctypes.c_ssize_t)),
+        ("strides", ctypes.POINTER(ctypes.c_ssize_t)),
+    ]
+
+    @property
+    def _as_parameter_(self):
+        # Always pass by reference.
+        return ctypes.byref(self)
+
+    def __repr__(self):
+        shape = tuple(self.shape[:self.ndim])
+        strides = tuple(self.strides[:self.ndim])
+        return f"StridedBuffer(data={self.data}, shape={shape}, " \
+               f"strides={strides}, itemsize={self.itemsize})"
+
+
+# The layout of a Py_buffer, as far as is needed. This part has been stable
+# since Python 3.3.
+class _Py_buffer(ctypes.Structure):
+    _fields_ = [
+        ("buf", ctypes.c_void_p),
+        ("obj", ctypes.c_void_p),
+        ("len", ctypes.c_ssize_t),
+        ("itemsize", ctypes.c_ssize_t),
+        ("readonly", ctypes.c_int),
+        ("ndim", ctypes.c_int),
+        ("format", ctypes.c_char_p),
+        ("shape", ctypes.POINTER(ctypes.c_ssize_t)),
+        ("strides", ctypes.POINTER(ctypes.c_ssize_t)),
+    ]
 
 
 # Py_buffer is a structure and its definition, short of copy/pasting from a
@@ -79,6 +171,16 @@ def nc_ptr(bytes_like):
 # versions. Assume a max of 120 bytes to be safe.
 Py_buffer = ctypes.ARRAY(ctypes.c_void_p, 120 // ctypes.sizeof(ctypes.c_void_p))
 
+# The buffer protocol's C API. Looking these up on ctypes.pythonapi is cheap
+# but not free.
+_PyObject_GetBuffer = ctypes.pythonapi.PyObject_GetBuffer
+_PyBuffer_Release = ctypes.pythonapi.PyBuffer_Release
+
+# Released Py_buffers, kept for reuse to avoid allocating a new one for every
+# pointer.
+_free_py_buffers = []
+_MAX_FREE_PY_BUFFERS = 256
+
 
 class PointerType(int):
     """A raw pointer which inc-refs the buffer it points to.
@@ -88,26 +190,299 @@ class PointerType(int):
     """
     @staticmethod
     def __new__(cls, bytes_like, flags):
+        if not flags and type(bytes_like) is not bytes:
+            # For writable, contiguous, non-empty buffers, ctypes's
+            # from_buffer() can lock the buffer and get its address without
+            # any calls to C via ctypes.pythonapi, which are slow. The buffer
+            # is released when the anchor is deleted.
+            view = memoryview(bytes_like)
+            if not view.readonly and view.c_contiguous and view.nbytes:
+                anchor = _from_buffer(view)
+                self = int.__new__(cls, _addressof(anchor))
+                self._anchor = anchor
+                return self
+        return _py_buffer_pointer(bytes_like, flags)
+
+    def _release(self):
+        """Release the buffer. The pointer must not be used afterwards."""
+        self._anchor = None
+
+    def __repr__(self):
+        return "<Void Pointer %s>" % super().__repr__()
+
+
+_from_buffer = ctypes.c_char.from_buffer
+_addressof = ctypes.addressof
 
-        obj = ctypes.py_object(bytes_like)
-        # Allocate a Py_buffer.
-        _py_buffer = Py_buffer()
-        # And populate it.
-        ctypes.pythonapi.PyObject_GetBuffer(obj, _py_buffer, flags)
-        # The pointer is the 1st item. The rest of the structure is size, shape,
-        # strides and writability flags. These can be accessed easier elsewhere.
-        address = _py_buffer[0]
 
-        self = super().__new__(cls, address)
-        self._py_buffer = _py_buffer
-        return self
+class _PyBufferPointer(PointerType):
+    """A pointer which holds its buffer using the C-API's Py_buffer.
 
-    def __del__(self):
+    Used for anything `ctypes.c_char.from_buffer()` can't handle i.e. read only,
+    non-contiguous or empty buffers. Create using `_py_buffer_pointer()`.
+    """
+    def _release(self):
         # PyObject_GetBuffer() inc-refs the buffer to prevent dangling pointers
         # but leads to memory leaks unless we remember to call the following
         # after we're finished with the pointer to safely allow the buffer to be
         # deleted.
-        ctypes.pythonapi.PyBuffer_Release(self._py_buffer)
+        _py_buffer = self._py_buffer
+        if _py_buffer is None:
+            return
+        self._py_buffer = None
+        _PyBuffer_Release(_py_buffer)
+        if len(_free_py_buffers) < _MAX_FREE_PY_BUFFERS:
+            _free_py_buffers.append(_py_buffer)
 
-    def __repr__(self):
-        return "<Void Pointer %s>" % super().__repr__()
+    __del__ = _release
+
+
+def _py_buffer_pointer(bytes_like, flags):
+    # Allocate a Py_buffer, reusing an old one if possible.
+    try:
+        _py_buffer = _free_py_buffers.pop()
+    except IndexError:
+        _py_buffer = Py_buffer()
+    # And populate it.
+    try:
+        _PyObject_GetBuffer(ctypes.py_object(bytes_like), _py_buffer, flags)
+    except BaseException:
+        _free_py_buffers.append(_py_buffer)
+        raise
+    # The pointer is the 1st item. The rest of the structure is size, shape,
+    # strides and writability flags. These can be accessed easier elsewhere.
+    self = int.__new__(_PyBufferPointer, _py_buffer[0])
+    self._py_buffer = _py_buffer
+    return self
+
+
+class ptrs(object):
+    """Get pointers to several buffers at once, releasing them all on leaving
+    a ``with`` block.
+
+    .. code-block:: python
+
+        with ptrs(a, b, out) as (a_ptr, b_ptr, out_ptr):
+            slug.dll.add(a_ptr, b_ptr, out_ptr, len(out))
+
+    Each buffer is converted using `ptr()` so the same C-contiguity
+    requirements apply. Unlike with `ptr()`, the buffers are released
+    deterministically on exiting the ``with`` block rather than whenever the
+    pointers are garbage collected. The pointers must not be used after this.
+
+    .. versionadded:: 1.1.0
+
+    """
+    __slots__ = ("_bytes_likes", "_anchors")
+
+    def __init__(self, *bytes_likes):
+        self._bytes_likes = bytes_likes
+        self._anchors = ()
+
+    def __enter__(self):
+        # This is an inlined version of PointerType.__new__() except that the
+        # anchors are kept here rather than on each pointer so that they can
+        # be released in one go.
+        pointers = []
+        anchors = self._anchors = []
+        try:
+            for bytes_like in self._bytes_likes:
+                view = memoryview(bytes_like)
+                if not view.readonly and view.c_contiguous and view.nbytes:
+                    anchor = _from_buffer(view)
+                    pointer = int.__new__(PointerType, _addressof(anchor))
+                else:
+                    anchor = pointer = ptr(bytes_like)
+                anchors.append(anchor)
+                pointers.append(pointer)
+        except BaseException:
+            self.__exit__()
+            raise
+        return tuple(pointers)
+
+    def __exit__(self, *exc_info):
+        for anchor in self._anchors:
+            if type(anchor) is _PyBufferPointer:
+                anchor._release()
+        self._anchors = ()
+
+
+# Map struct module style format characters to the kind of number they
+# represent. Combined with the itemsize, this uniquely identifies a numeric type
+# irrespective of which of the several C names (e.g. long vs long long) it
+# goes by.
+_FORMAT_KINDS = {
+    **dict.fromkeys("bhilqn", "signed integer"),
+    **dict.fromkeys("BHILQN", "unsigned integer"),
+    **dict.fromkeys("efd", "floating point"),
+    "?": "bool",
+}
+
+# Byte order prefixes which still mean native byte order.
+_NATIVE_PREFIXES = "@=" + ("<" if sys.byteorder == "little" else ">")
+
+# Anything which ctypes natively knows how to convert to a pointer.
+_CTYPES_POINTERS = (ctypes._SimpleCData, ctypes._Pointer, ctypes.Array,
+                    type(ctypes.byref(ctypes.c_int())))
+
+
+@functools.lru_cache(maxsize=None)
+def typed_pointer(ctype):
+    """Create a pointer type suitable for use as an argtype which accepts
+    anything supporting the buffer protocol.
+
+    Args:
+        ctype (type):
+            A numeric `ctypes` type such as `ctypes.c_double`.
+    Returns:
+        type: A subclass of `ctypes.c_void_p`.
+
+    Buffers must be C-contiguous and their items must be of the same kind
+    (signed/unsigned integer, floating point or bool) and size as **ctype**
+    except that pointers to either signed or unsigned 1-byte integers accept
+    buffers of any 1-byte integers or characters (e.g. `bytearray`).
+    Integers (including the output of `ptr()`), `None`, `bytes`, `str` and
+    `ctypes` objects are passed through as they would be for a
+    `ctypes.c_void_p`.
+
+    """
+    kind = _FORMAT_KINDS[ctype._type_]
+    size = ctypes.sizeof(ctype)
+    name = ctype.__name__
+    # Whichever signedness :c:`char *` style parameters are declared with, they
+    # are usually meant for raw bytes.
+    bytes_like = size == 1 and kind.endswith("integer")
+
+    @classmethod
+    def from_param(cls, obj):
+        if obj is None or isinstance(obj, (int, bytes, str, _CTYPES_POINTERS)):
+            return ctypes.c_void_p.from_param(obj)
+        try:
+            view = memoryview(obj)
+        except TypeError:
+            return ctypes.c_void_p.from_param(obj)
+
+        format = view.format
+        if format[:1] in _NATIVE_PREFIXES:
+            format = format[1:]
+        if bytes_like and format in ("b", "B", "c") and view.itemsize == 1:
+            pass
+        elif _FORMAT_KINDS.get(format) != kind or view.itemsize != size:
+            raise TypeError(
+                "A buffer with format '{}' and itemsize {} can't be used as a "
+                "{} array.".format(view.format, view.itemsize, name))
+        if not view.c_contiguous:
+            raise ValueError(
+                "{} is not C-contiguous. See the bottom of `help(cslug.ptr)` "
+                "for how to resolve this.".format(type(obj).__name__))
+
+        # ctypes holds onto whatever this returns until the function call is
+        # complete, after which the buffer is released.
+        if not view.readonly:
+            return (ctypes.c_char * view.nbytes).from_buffer(view)
+        pointer = PointerType(view, 0)
+        out = ctypes.c_void_p(pointer)
+        out._pointer = pointer
+        return out
+
+    return type(
+        name + "_p", (ctypes.c_void_p,), {
+            "from_param": from_param,
+            "_item_type": ctype,
+            "__doc__": "A pointer to an array of {}.".format(name),
+        })
+
+
+def _buffer_length(buffer):
+    """Count the items in a (possibly multidimensional) buffer."""
+    view = memoryview(buffer)
+    return view.nbytes // view.itemsize
+
+
+def _as_typed_buffer(arg, code):
+    """Normalise **arg** to a C-contiguous buffer of items of type code
+    **code**, copying only if necessary. Returns None if **arg** is a scalar.
+    """
+    try:
+        view = memoryview(arg)
+    except TypeError:
+        try:
+            return array.array(code, arg)
+        except TypeError:
+            if isinstance(arg, (str, bytes)) or not hasattr(arg, "__iter__"):
+                return None
+            raise
+    if view.ndim == 0:
+        return None
+    format = view.format
+    if format[:1] in _NATIVE_PREFIXES:
+        format = format[1:]
+    if _FORMAT_KINDS.get(format) == _FORMAT_KINDS[code] \
+            and view.itemsize == array.array(code).itemsize \
+            and view.c_contiguous:
+        return arg
+    return array.array(code, _flatten(view.tolist()))
+
+
+def adopt(pointer, length, typecode="B", free=None, numpy=False):
+    """Take ownership of an array allocated in C without copying it.
+
+    Args:
+        pointer (int or ctypes.c_void_p or ctypes.POINTER):
+            The address of the array's first item.
+        length (int):
+            The number of items in the array.
+        typecode (str or type):
+            The item type as either an `array` type code or a numeric `ctypes`
+            type.
+        free (callable):
+            The function to deallocate the array with. Defaults to
+            :ref:`cslug.stdlib.free <stdlib-free>`.
+        numpy (bool):
+            Return a `numpy.ndarray` instead of a `memoryview`.
+    Returns:
+        memoryview or numpy.ndarray: A flat, writable view of the array.
+
+    C functions which return arrays of sizes which can't be known in advance
+    have to :c:`malloc()` them. Rather than copying such an array into Python
+    then freeing the original, hand ownership of it to Python::
+
+        length = ctypes.c_size_t()
+        pointer = slug.dll.primes_below(1000, ctypes.byref(length))
+        primes = adopt(pointer, length.value, "i")
+
+    The output reads and writes directly to the C array and **free** is called
+    on it when the last reference to the output (or to anything made from it
+    such as a slice or a `ptr()`) is deleted. The array must not be freed or
+    used by C afterwards.
+
+    If the array was allocated by a library linked to a different C runtime to
+    `cslug.stdlib` (a possibility on Windows) then pass a **free** function
+    from the slug itself which just calls :c:`free()`.
+
+    .. versionadded:: 1.1.0
+
+    """
+    if isinstance(typecode, type):
+        typecode = typecode._type_
+    itemsize = array.array(typecode).itemsize
+    if not isinstance(pointer, int):
+        pointer = ctypes.cast(pointer, ctypes.c_void_p).value
+    if not pointer:
+        if length:
+            raise ValueError("Can't adopt a NULL pointer.")
+        pointer = 0
+    if free is None:
+        from cslug.stdlib import free
+
+    owner = (ctypes.c_ubyte * (length * itemsize)).from_address(pointer)
+    if pointer:
+        finalizer = weakref.finalize(owner, free, pointer)
+        # Freeing at exit is pointless and may be unsafe if the library
+        # containing **free** has already been closed.
+        finalizer.atexit = False
+    view = memoryview(owner).cast("B").cast(typecode)
+    if numpy:
+        import numpy
+        return numpy.frombuffer(view, typecode)
+    return view
@@ -0,0 +1,202 @@
+r"""
+Run C source code through the C compiler's preprocessor (``$CC -E``) so that
+`cslug.Types` can see declarations generated by macros, hidden behind
+:c:`#ifdef`\ s or living in :c:`#include`\ d headers.
+
+Preprocessing is slow relative to the scanning that follows it so its output is
+cached, keyed by the compiler, the flags and the source file, and invalidated
+whenever the source or any file in its include set changes.
+
+"""
+
+import os
+import re
+import json
+import hashlib
+from pathlib import Path
+from subprocess import run, PIPE
+
+from cslug import misc, exceptions
+from cslug.c_parse import split_line_markers, filter as filter_code, TokenType
+from cslug._cc import cc, cc_version, env_flags, INCLUDE_DIR
+
+
+def preprocess(source, flags=(), cache=None):
+    """Preprocess a C source file, keeping only code which originated from
+    non-system files.
+
+    Args:
+        source (pathlib.Path or io.TextIOBase):
+            The C source file or pseudo file to preprocess.
+        flags (list[str]):
+            Additional flags (typically ``-I`` and ``-D`` options) to pass to
+            the compiler.
+        cache (PreprocessCache):
+            An optional cache to read from and store into.
+    Returns:
+        str: The preprocessed code, with line markers pointing back to the
+        original files.
+    Raises:
+        exceptions.BuildError:
+            If the preprocessor fails.
+
+    Compilers other than gcc and clang have no equivalent to ``-dD`` to keep
+    :c:`#define`\\ s in their output. For those, the :c:`#define` lines of the
+    source itself are appended to the output instead. These are taken
+    regardless of any :c:`#if` they sit inside and any in headers are lost.
+
+    """
+    _cc = cc()
+    # Put <cslug.h> on the include path, as CSlug.compile_command() does.
+    flags = [str(i) for i in flags] + env_flags() + ["-I", str(INCLUDE_DIR)]
+    code, path = misc.read(source)
+    # Real files are keyed by their filename so that editing a file replaces
+    # its cache entry rather than adding a new one. Pseudo files have no name so
+    # must be keyed by their contents.
+    key = _hash(_cc, *flags, str(path) if path else code)
+    code_hash = _hash(code)
+
+    if cache is not None:
+        out = cache.get(key, code_hash)
+        if out is not None:
+            return out
+
+    command = [_cc, "-E"]
+    keeps_defines = cc_version(_cc)[0] in ("gcc", "clang")
+    if keeps_defines:
+        # Keep #define directives in the output so that constants can be found.
+        command.append("-dD")
+    command += flags
+    if path is None:
+        command += ["-x", "c", "-"]
+    else:
+        command.append(str(path))
+    p = run(command, input=code if path is None else None, stdout=PIPE,
+            stderr=PIPE, encoding="utf-8")
+    if p.returncode:
+        raise exceptions.BuildError(command, p.stderr)
+
+    out, includes = _strip_system_code(p.stdout)
+    if not keeps_defines:
+        out += _raw_defines(code)
+    if cache is not None:
+        cache.set(key, code_hash, out, includes)
+    return out
+
+
+def _strip_system_code(text):
+    """Filter preprocessed code down to that of the main source and its
+    non-system headers.
+
+    Returns:
+        (str, list[str]):
+            The filtered code and the names of every file included.
+    """
+    chunks = split_line_markers(text)
+    # The first line marker always refers to the main source file. For pseudo
+    # files piped via stdin it'll be something like "<stdin>" so it can't be
+    # identified by the usual "<built-in>" style naming.
+    main = next((name for (name, *_) in chunks if name), "")
+
+    out = []
+    includes = set()
+    for (name, line, flags, code) in chunks:
+        if name != main and name[:1] == "<":
+            # Pseudo files such as "<built-in>" or "<command-line>".
+            continue
+        if name != main:
+            includes.add(name)
+        if 3 in flags or not code.strip():
+            # System header or just whitespace.
+            continue
+        if _is_cslug_header(name):
+            # <cslug.h>'s types and inline helpers belong to cslug, not the
+            # library being scanned.
+            continue
+        out.append('# {} "{}"\n'.format(line, name.replace("\\", "\\\\")))
+        out.append(code)
+        out.append("\n")
+    return "".join(out), sorted(includes)
+
+
+_define_re = re.compile(r"[ \t]*#[ \t]*define\b.*")
+
+
+def _raw_defines(code):
+    """Extract the :c:`#define` lines from unpreprocessed source code."""
+    lines = filter_code(code, TokenType.CODE).split("\n")
+    return "".join(i + "\n" for i in lines if _define_re.fullmatch(i))
+
+
+def _is_cslug_header(name):
+    """Test if a filename from a line marker is in |cslug|'s include folder."""
+    folder = os.path.dirname(os.path.abspath(name))
+    return os.path.normcase(folder) == os.path.normcase(str(INCLUDE_DIR))
+
+
+def _hash(*parts):
+    hash = hashlib.sha256()
+    for part in parts:
+        hash.update(part.encode("utf-8", "surrogateescape"))
+        hash.update(b"\0")
+    return hash.hexdigest()
+
+
+def _fingerprint(includes):
+    """Summarise the state of every file in an include set.
+
+    Files which can no longer be found are fingerprinted as ``None`` which will
+    never match a file that does exist.
+    """
+    out = {}
+    for include in includes:
+        try:
+            stat = os.stat(include)
+            out[include] = [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            out[include] = None
+    return out
+
+
+class PreprocessCache(object):
+    """Store preprocessed code alongside the fingerprint of the files it
+    depends on.
+
+    Entries are kept in memory and, if **path** is a real file path, persisted
+    there as json so that they survive between Python sessions.
+    """
+    def __init__(self, path=None):
+        self.path = path if isinstance(path, Path) else None
+        self._entries = None
+
+    @property
+    def entries(self) -> dict:
+        if self._entries is None:
+            self._entries = {}
+            if self.path is not None and self.path.exists():
+                try:
+                    self._entries = json.loads(misc.read(self.path)[0])
+                except ValueError:  # pragma: no cover
+                    # A corrupt cache is just an empty cache.
+                    pass
+        return self._entries
+
+    def get(self, key, source_hash):
+        """Get the cached output for **key** or None if there isn't any or it
+        is stale."""
+        entry = self.entries.get(key)
+        if entry is None or entry["source"] != source_hash:
+            return None
+        if _fingerprint(entry["includes"]) != entry["includes"]:
+            return None
+        return entry["code"]
+
+    def set(self, key, source_hash, code, includes):
+        """Add or replace a cache entry and write the cache."""
+        self.entries[key] = {
+            "source": source_hash,
+            "includes": _fingerprint(includes),
+            "code": code,
+        }
+        if self.path is not None:
+            misc.write(self.path, json.dumps(self.entries))
@@ -0,0 +1,623 @@
+"""
+Run a slug's functions in worker processes, passing buffers via shared memory.
+"""
+
+import os
+import array
+import ctypes
+import pickle
+import queue
+import bisect
+import threading
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import Future
+
+from cslug import exceptions
+from cslug._pointers import ptr, PointerType, _NATIVE_PREFIXES
+
+# How a buffer argument is described to a worker: which shared memory block it
+# lives in, where inside that block, how to reinterpret those bytes and, for
+# structs, the name of the struct.
+_Shared = collections.namedtuple(
+    "_Shared", "name offset nbytes format shape readonly struct")
+
+# A ptr() into a shared memory block.
+_Pointer = collections.namedtuple("_Pointer", "name offset")
+
+# A struct returned by value.
+_StructValue = collections.namedtuple("_StructValue", "name data")
+
+# A buffer which isn't in shared memory and must be copied into a worker's
+# scratch block before the call.
+_Pending = collections.namedtuple("_Pending", "view struct")
+
+# Buffers copied into a scratch block are spaced at least this far apart so
+# that each starts suitably aligned for any C type.
+_ALIGNMENT = 64
+
+
+class ProcessPool(object):
+    """Call a slug's functions in a pool of worker processes.
+
+    Threads (see `cslug.parallel`) are the cheapest way to run C code
+    concurrently but they require that the C code be thread safe. Code which
+    uses global variables, such as the :ref:`globals demo <Accessing Global
+    Variables>`, or code which may crash is better run in separate processes
+    where each worker has its own copy of every global and a segmentation fault
+    only kills the worker.
+
+    .. code-block:: python
+
+        with ProcessPool(slug) as pool:
+            values = pool.array("d", range(1000))
+            total = pool.dll.sum(values, len(values))
+
+    Functions are accessed via `dll` or referred to by name using `call` or
+    `submit`. Python wrappers around functions are available using a dotted
+    name such as ``"scale.vectorized"``.
+
+    Buffer arguments are never pickled. Buffers allocated with `array` (or
+    anything else pointing into them such as a slice or a `numpy.frombuffer`
+    view) live in shared memory so that the worker's `ptr()` points at the very
+    same physical memory - nothing is copied in either direction and anything
+    the C function writes is immediately visible to the parent. Any other
+    buffer is copied into a scratch shared memory block, reused by each call,
+    then, if writable, copied back after the call. A `ptr()` may only be passed
+    if it points into an `array`. Structs are treated as buffers, passed by
+    value or by pointer according to the C function's parameter types, and
+    structs returned by value are copied back into the parent's struct class.
+    Other arguments and return values are pickled.
+
+    If a worker dies mid-call (e.g. from a segmentation fault) then that call
+    raises a `cslug.exceptions.WorkerCrashedError` and the worker is replaced
+    immediately. The parent and any other calls are unaffected.
+
+    Workers load the already compiled library - they never compile anything.
+
+    Each call costs a round trip to another process which is orders of
+    magnitude slower than calling C in-process (run ``python -m cslug.bench
+    isolation`` to measure it on your machine) so reserve isolation for
+    functions which do enough work to drown that out, or which can't be
+    trusted not to crash.
+
+    .. versionadded:: 1.1.0
+
+    """
+    def __init__(self, slug, processes=None):
+        """
+
+        Args:
+            slug (cslug.CSlug):
+                The slug whose functions should be callable.
+            processes (int):
+                How many worker processes to start. Defaults to the number of
+                CPUs.
+
+        """
+        # Ensure that the library and types json exist before any worker needs
+        # them.
+        slug.dll
+        self.slug = slug
+        self.processes = processes or os.cpu_count() or 1
+        self._context = multiprocessing.get_context("spawn")
+        self._worker_args = (os.path.abspath(slug.name), slug.hold_gil)
+        self._blocks = {}
+        self._bases = []
+        self._jobs = queue.SimpleQueue()
+        self._closed = False
+        # Workers are started lazily, up to self.processes of them, and handed
+        # out to whichever thread needs one.
+        self._workers = []
+        self._idle = queue.SimpleQueue()
+        self._workers_lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._dispatch, daemon=True,
+                             name=f"cslug-process-pool-{i}")
+            for i in range(self.processes)
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.dll = _RemoteDll(self)
+
+    dll: object
+    """A proxy for `CSlug.dll` whose functions run in the worker processes.
+
+    Structs, enums and constants are the parent process's own.
+    """
+
+    def array(self, typecode, initializer=0):
+        """Allocate an array in memory shared with the worker processes.
+
+        Args:
+            typecode (str or type):
+                An `array` type code such as ``"d"`` for :c:`double` or a
+                `ctypes` type such as a struct class from `CSlug.dll`. Use
+                `cslug.misc.array_typecode` to get the type code for a C type
+                name.
+            initializer (int or iterable):
+                Either the number of (zeroed) items or the items themselves.
+        Returns:
+            memoryview or ctypes.Array:
+            A one dimensional, writable view of the array or, if **typecode**
+            is a `ctypes` type, a `ctypes` array.
+
+        The memory is freed when the pool is closed, although existing views
+        will remain valid until they are deleted.
+
+        """
+        if not isinstance(typecode, str):
+            return self._ctypes_array(typecode, initializer)
+        if isinstance(initializer, int):
+            items = None
+            nbytes = initializer * array.array(typecode).itemsize
+        else:
+            items = array.array(typecode, initializer)
+            nbytes = len(items) * items.itemsize
+        block = self._allocate(nbytes)
+        view = block.buf[:nbytes].cast(typecode)
+        if items is not None:
+            view[:] = items
+        return view
+
+    def _ctypes_array(self, type, initializer):
+        """Implement `array` for a `ctypes` item type."""
+        if isinstance(initializer, int):
+            items = None
+            length = initializer
+        else:
+            items = list(initializer)
+            length = len(items)
+        block = self._allocate(ctypes.sizeof(type) * length)
+        out = (type * length).from_buffer(block.buf)
+        for (i, item) in enumerate(items or ()):
+            out[i] = item if isinstance(item, type) else type(*item)
+        return out
+
+    def _allocate(self, nbytes):
+        """Create a shared memory block and register its address range."""
+        block = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        pointer = ptr(block.buf)
+        base = int(pointer)
+        pointer._release()
+        self._blocks[base] = block
+        bisect.insort(self._bases, base)
+        return block
+
+    def _find(self, address, nbytes):
+        """Find the block containing the **nbytes** bytes at **address**."""
+        i = bisect.bisect_right(self._bases, address) - 1
+        if i < 0:
+            return None
+        base = self._bases[i]
+        block = self._blocks[base]
+        if address + nbytes > base + block.size:
+            return None
+        return base, block
+
+    def submit(self, func, *args):
+        """Schedule :py:`func(*args)` to run in a worker process.
+
+        Args:
+            func (str):
+                The name of a function in `CSlug.dll`.
+            *args:
+                Arguments for **func**.
+        Returns:
+            concurrent.futures.Future: A future for the return value.
+
+        """
+        args = self._prepare(func, args)
+        future = Future()
+        self._jobs.put((future, func, args))
+        return future
+
+    def call(self, func, *args):
+        """Call :py:`func(*args)` in a worker process and wait for the result.
+        """
+        args = self._prepare(func, args)
+        # Skip the hand over to a dispatcher thread used by submit(). Being a
+        # thread switch, it would double the latency of short calls.
+        worker = self._checkout()
+        try:
+            ok, result = self._run(worker, func, args)
+        finally:
+            self._idle.put(worker)
+        if ok:
+            return result
+        raise result
+
+    def map(self, func, *iterables):
+        """Like `map` but run each call in whichever worker process is free.
+        """
+        futures = [self.submit(func, *args) for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def _prepare(self, func, args):
+        """Check a call is possible and describe its arguments."""
+        if self._closed:
+            raise RuntimeError("This ProcessPool has been closed.")
+        if not isinstance(func, str):
+            raise TypeError(f"Functions must be referred to by name, not by "
+                            f"a {type(func).__name__}.")
+        return [self._share(arg) for arg in args]
+
+    def _share(self, arg):
+        """Describe a buffer argument by where it is in shared memory or mark
+        it as needing to be copied into shared memory."""
+        if isinstance(arg, (bytes, str)):
+            # Bytes are much more likely to be strings than arrays.
+            return arg
+        if isinstance(arg, PointerType):
+            found = self._find(int(arg), 0)
+            if found is None:
+                raise ValueError(
+                    "A ptr() can only be passed to a worker process if it "
+                    "points into an array allocated with ProcessPool.array(). "
+                    "Pass the buffer itself instead so that it can be copied.")
+            base, block = found
+            return _Pointer(block.name, int(arg) - base)
+        try:
+            view = memoryview(arg)
+        except TypeError:
+            return arg
+        struct = type(arg).__name__ \
+            if isinstance(arg, ctypes.Structure) else None
+        if view.ndim == 0 and struct is None:
+            return arg
+        if not view.c_contiguous:
+            raise ValueError("Buffers passed to worker processes must be "
+                             "C-contiguous.")
+        pointer = ptr(view)
+        address = int(pointer)
+        pointer._release()
+        found = self._find(address, view.nbytes)
+        if found is not None:
+            base, block = found
+            return _Shared(block.name, address - base, view.nbytes, view.format,
+                           view.shape, view.readonly, struct)
+        return _Pending(view, struct)
+
+    def _checkout(self):
+        """Get an idle worker, starting a new one if the pool isn't full."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._workers_lock:
+            if len(self._workers) < self.processes:
+                worker = _Worker(self._context, self._worker_args)
+                self._workers.append(worker)
+                return worker
+        return self._idle.get()
+
+    def _run(self, worker, func, args):
+        """Run a call on **worker**, copying buffers in and out of its scratch
+        block as needed.
+
+        Returns:
+            (bool, object): Whether the call succeeded and its return value or
+            exception.
+
+        """
+        pending = [(i, arg) for (i, arg) in enumerate(args)
+                   if isinstance(arg, _Pending)]
+        offsets = []
+        if pending:
+            args = list(args)
+            nbytes = 0
+            for (i, arg) in pending:
+                offsets.append(nbytes)
+                nbytes += -(-arg.view.nbytes // _ALIGNMENT) * _ALIGNMENT
+            scratch = worker.scratch(nbytes)
+            for ((i, arg), offset) in zip(pending, offsets):
+                view = arg.view
+                scratch.buf[offset:offset + view.nbytes] = view.cast("B")
+                args[i] = _Shared(scratch.name, offset, view.nbytes,
+                                  view.format, view.shape, view.readonly,
+                                  arg.struct)
+        try:
+            ok, result = worker.run(func, args)
+        except BaseException as ex:
+            # Including a WorkerCrashedError.
+            ok, result = False, ex
+        # Copy back even after a crash so that the parent sees whatever the C
+        # function wrote before it died.
+        for ((i, arg), offset) in zip(pending, offsets):
+            if not arg.view.readonly:
+                arg.view.cast("B")[:] = \
+                    scratch.buf[offset:offset + arg.view.nbytes]
+        if ok and isinstance(result, _StructValue):
+            result = getattr(self.slug.dll, result.name) \
+                .from_buffer_copy(result.data)
+        return ok, result
+
+    def _dispatch(self):
+        """Feed jobs from `submit` to workers."""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            (future, func, args) = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            worker = self._checkout()
+            try:
+                # Outputs must be in place before anyone waiting on the future
+                # is woken, so _run() copies back first.
+                ok, result = self._run(worker, func, args)
+            finally:
+                self._idle.put(worker)
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def close(self):
+        """Stop all worker processes and free all shared memory.
+
+        Calls already submitted are completed first.
+
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for thread in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        for worker in self._workers:
+            worker.stop()
+        self._workers.clear()
+        for block in self._blocks.values():
+            block.unlink()
+            _close(block)
+        self._blocks.clear()
+        self._bases.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f"<ProcessPool {self.slug.name.name} with {self.processes} " \
+               f"processes>"
+
+
+class _Worker(object):
+    """A single worker process, a pipe to talk to it and a scratch block of
+    shared memory for it to receive copies of buffers in."""
+    def __init__(self, context, args):
+        self._context = context
+        self._args = args
+        self._scratch = None
+        # Names of old scratch blocks the worker should stop using.
+        self._forget = []
+        self._start()
+
+    def _start(self):
+        self.connection, child = self._context.Pipe()
+        self.process = self._context.Process(
+            target=_worker, args=(child,) + self._args, daemon=True)
+        self.process.start()
+        # Close our copy of the child's end so that a dead worker raises an
+        # EOFError instead of blocking forever.
+        child.close()
+
+    def scratch(self, nbytes):
+        """Get a scratch block at least **nbytes** long."""
+        if self._scratch is None or self._scratch.size < nbytes:
+            if self._scratch is not None:
+                self._forget.append(self._scratch.name)
+                self._scratch.unlink()
+                _close(self._scratch)
+            # Over-allocate to avoid growing again for slightly larger buffers.
+            self._scratch = shared_memory.SharedMemory(
+                create=True, size=max(nbytes * 2, 1 << 16))
+        return self._scratch
+
+    def run(self, func, args):
+        # Messages are pickled directly rather than through Connection.send()
+        # which goes through the slower, customisable ForkingPickler.
+        message = pickle.dumps((func, args, self._forget), _PROTOCOL)
+        self._forget = []
+        try:
+            self.connection.send_bytes(message)
+            return pickle.loads(self.connection.recv_bytes())
+        except (EOFError, OSError):
+            self.process.join()
+            self.connection.close()
+            exitcode = self.process.exitcode
+            # Replace the worker now rather than on the next call.
+            self._start()
+            raise exceptions.WorkerCrashedError(func, exitcode)
+
+    def stop(self):
+        try:
+            self.connection.send_bytes(b"")
+        except OSError:  # pragma: no cover
+            pass
+        self.process.join()
+        self.connection.close()
+        if self._scratch is not None:
+            self._scratch.unlink()
+            _close(self._scratch)
+
+
+_PROTOCOL = pickle.HIGHEST_PROTOCOL
+
+
+def _worker(connection, path, hold_gil):
+    """The main loop run inside each worker process."""
+    from cslug import CSlug
+    dll = CSlug(path, hold_gil=hold_gil).dll
+    blocks = {}
+    while True:
+        message = connection.recv_bytes()
+        if not message:
+            break
+        (name, args, forget) = pickle.loads(message)
+        for block in forget:
+            if block in blocks:
+                _close(blocks.pop(block))
+        views = []
+        try:
+            function = dll
+            for attribute in name.split("."):
+                function = getattr(function, attribute)
+            args = [
+                _attach(dll, function, i, arg, blocks, views)
+                for (i, arg) in enumerate(args)
+            ]
+            result = function(*args)
+            if isinstance(result, ctypes.Structure):
+                result = _StructValue(type(result).__name__, bytes(result))
+            reply = (True, result)
+        except BaseException as ex:
+            # Drop the traceback. It can't be pickled anyway and its frames
+            # would otherwise keep the buffer views below alive.
+            reply = (False, ex.with_traceback(None))
+        finally:
+            args = function = result = None
+            _detach(views)
+        try:
+            reply = pickle.dumps(reply, _PROTOCOL)
+        except Exception as ex:
+            reply = pickle.dumps((
+                False,
+                TypeError(
+                    f"The result of {name}() couldn't be sent back to the parent "
+                    f"process: {ex}")), _PROTOCOL)
+        connection.send_bytes(reply)
+    for block in blocks.values():
+        _close(block)
+
+
+def _block(name, blocks):
+    """Open (or reuse the already opened) shared memory block **name**."""
+    block = blocks.get(name)
+    if block is None:
+        block = blocks[name] = shared_memory.SharedMemory(name)
+    return block
+
+
+def _attach(dll, function, i, arg, blocks, views):
+    """Reconstruct a buffer, struct or pointer argument from its shared memory
+    description."""
+    if isinstance(arg, _Pointer):
+        view = _block(arg.name, blocks).buf[arg.offset:]
+        views.append(view)
+        return ptr(view)
+    if not isinstance(arg, _Shared):
+        return arg
+    view = _block(arg.name, blocks).buf[arg.offset:arg.offset + arg.nbytes]
+    views.append(view)
+    argtypes = getattr(function, "argtypes", None)
+    argtype = argtypes[i] if argtypes and i < len(argtypes) else None
+
+    if arg.struct is not None:
+        struct = getattr(dll, arg.struct)
+        struct = struct.from_buffer_copy(view) if arg.readonly \
+            else struct.from_buffer(view)
+        if argtype is None or argtype is type(struct):
+            # Passed by value or to a Python wrapper.
+            return struct
+        return ctypes.addressof(struct)
+
+    format = arg.format
+    if format[:1] in _NATIVE_PREFIXES:
+        format = format[1:]
+    try:
+        view = view.cast("B").cast(format, arg.shape)
+    except (TypeError, ValueError):
+        pass
+    else:
+        views.append(view)
+    if arg.readonly:
+        view = view.toreadonly()
+        views.append(view)
+
+    if hasattr(argtype, "_item_type"):
+        # Typed pointers take buffers directly.
+        return view
+    if argtypes is not None:
+        # Untyped pointers need a ptr().
+        return ptr(view)
+    # Python wrappers.
+    return view
+
+
+def _detach(views):
+    """Release buffer views."""
+    for view in reversed(views):
+        try:
+            view.release()
+        except BufferError:  # pragma: no cover
+            # Something (probably the function's return value) still holds
+            # onto it.
+            pass
+
+
+def _close(block):
+    """Close a shared memory block, even if there are still views into it."""
+    try:
+        block.close()
+    except BufferError:
+        # The views keep the underlying mmap alive. It's unmapped once they're
+        # all deleted. Forget it so that SharedMemory doesn't try (and
+        # noisily fail) to close it again on deletion.
+        block._mmap = None
+        block.close()
+
+
+class _RemoteDll(object):
+    """The `ProcessPool.dll` proxy."""
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _remote(self._pool, getattr(self._pool.slug.dll, name), name)
+
+    def __repr__(self):
+        return f"<Proxy of {self._pool.slug.name.name} in {self._pool!r}>"
+
+
+def _remote(pool, local, name):
+    """Proxy functions but leave anything else (including classes) alone."""
+    if callable(local) and not isinstance(local, type):
+        return RemoteFunction(pool, local, name)
+    return local
+
+
+class RemoteFunction(object):
+    """A function in a `ProcessPool` worker process, called as if it were a
+    local one. Get one from `ProcessPool.dll`.
+
+    .. versionadded:: 1.1.0
+
+    """
+    def __init__(self, pool, local, name):
+        self._pool = pool
+        self._local = local
+        self.__name__ = name
+
+    def __call__(self, *args):
+        return self._pool.call(self.__name__, *args)
+
+    def submit(self, *args):
+        """Like `ProcessPool.submit`."""
+        return self._pool.submit(self.__name__, *args)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _remote(self._pool, getattr(self._local, name),
+                       f"{self.__name__}.{name}")
+
+    def __repr__(self):
+        return f"<RemoteFunction {self.__name__}>"
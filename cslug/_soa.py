@@ -0,0 +1,252 @@
+"""
+Structure-of-arrays companions to structs.
+
+For a struct such as :c:`typedef struct Point { double x; double y; } Point;`,
+the following is generated and compiled into the same library::
+
+    typedef struct PointSoA {
+        double * x;
+        double * y;
+    } PointSoA;
+
+    void cslug_soa_split_Point(const Point * aos, size_t n, PointSoA * soa) {
+        for (size_t i = 0; i < n; i++) soa->x[i] = aos[i].x;
+        for (size_t i = 0; i < n; i++) soa->y[i] = aos[i].y;
+    }
+
+    void cslug_soa_join_Point(const PointSoA * soa, size_t n, Point * aos) {
+        for (size_t i = 0; i < n; i++) aos[i].x = soa->x[i];
+        for (size_t i = 0; i < n; i++) aos[i].y = soa->y[i];
+    }
+
+then exposed in Python as a `StructOfArrays` subclass.
+
+"""
+
+import ctypes
+import array
+
+from cslug._pointers import ptr
+from cslug._vectorize import _C_NAMES
+
+# C and `array` spellings of the type codes of non-numeric fields which may
+# still be transposed.
+_EXTRA_C_NAMES = {"c": "char", "?": "_Bool"}
+_TYPECODES = {"c": "b", "?": "B"}
+
+
+def soa_name(name):
+    """The name of the companion of struct **name**."""
+    return name + "SoA"
+
+
+def split_name(name):
+    """The C symbol name of the array-of-structs to struct-of-arrays function
+    for struct **name**."""
+    return "cslug_soa_split_" + name
+
+
+def join_name(name):
+    """The C symbol name of the struct-of-arrays to array-of-structs function
+    for struct **name**."""
+    return "cslug_soa_join_" + name
+
+
+def _type_code(type_name):
+    """Get the type code of a ctypes type name from a types json or None if it
+    can't be a struct-of-arrays field."""
+    code = getattr(getattr(ctypes, type_name, None), "_type_", None)
+    return code if code in _C_NAMES or code in _EXTRA_C_NAMES else None
+
+
+def _c_name(type_name):
+    code = _type_code(type_name)
+    return _C_NAMES.get(code) or _EXTRA_C_NAMES[code]
+
+
+def check(name, structs):
+    """Raise an error if struct **name** can't have a struct-of-arrays
+    companion.
+
+    Args:
+        name (str):
+            The name of a struct.
+        structs (dict):
+            All structs, in the format of `cslug.Types.structs`.
+
+    Raises:
+        ValueError:
+            If **name** either isn't in **structs**, has no fields or has any
+            bit-fields or fields which aren't numbers, :c:`char`\\ s or
+            :c:`_Bool`\\ s.
+
+    """
+    if name not in structs:
+        raise ValueError(f"Can't generate a struct-of-arrays layout for "
+                         f"'{name}' because no struct of that name was found.")
+    fields = structs[name]
+    if not fields or any(
+            len(field) != 2 or not _type_code(field[1]) for field in fields):
+        raise ValueError(
+            f"Can't generate a struct-of-arrays layout for struct '{name}' "
+            f"with fields {fields}. Only structs whose fields are all numbers "
+            f"without bit-field sizes are supported.")
+
+
+def c_source(structs, names):
+    """Generate C code for struct-of-arrays companions of structs.
+
+    Args:
+        structs (dict):
+            All structs, in the format of `cslug.Types.structs`.
+        names (list[str]):
+            The names of structs to generate companions for.
+    Returns:
+        str: C source code.
+
+    """
+    lines = [
+        "// Struct-of-arrays layouts generated automatically by cslug.\n",
+        "#include <stddef.h>\n"
+    ]
+    for name in names:
+        fields = [(field, _c_name(type)) for (field, type) in structs[name]]
+        soa = soa_name(name)
+
+        # Redefine the struct. The field types may be spelt differently to the
+        # original but are equivalent so the layout is identical.
+        lines += ["\ntypedef struct {} {{\n".format(name)]
+        lines += [
+            "    {} {};\n".format(type, field) for (field, type) in fields
+        ]
+        lines += ["}} {};\n\n".format(name)]
+
+        lines += ["typedef struct {} {{\n".format(soa)]
+        lines += [
+            "    {} * {};\n".format(type, field) for (field, type) in fields
+        ]
+        lines += ["}} {};\n\n".format(soa)]
+
+        lines += [
+            "void {}(const {} * aos, size_t n, {} * soa) {{\n".format(
+                split_name(name), name, soa)
+        ]
+        loop = "    for (size_t i = 0; i < n; i++) soa->{0}[i] = aos[i].{0};\n"
+        lines += [loop.format(field) for (field, type) in fields]
+        lines += ["}\n\n"]
+
+        lines += [
+            "void {}(const {} * soa, size_t n, {} * aos) {{\n".format(
+                join_name(name), soa, name)
+        ]
+        loop = "    for (size_t i = 0; i < n; i++) aos[i].{0} = soa->{0}[i];\n"
+        lines += [loop.format(field) for (field, type) in fields]
+        lines += ["}\n"]
+    return "".join(lines)
+
+
+class StructOfArrays(object):
+    """A struct-of-arrays version of a struct: one `array.array` per field.
+
+    Create a struct-of-arrays companion for a struct by listing it in the
+    **soa** argument to `CSlug`. It is then available as the ``SoA``
+    attribute of the struct::
+
+        >>> points = slug.dll.Point.array_from_tuples([(1, 2), (3, 4)])
+        >>> soa = slug.dll.Point.SoA.from_aos(points)
+        >>> soa.x
+        array('d', [1.0, 3.0])
+        >>> soa.y
+        array('d', [2.0, 4.0])
+        >>> soa.to_aos()[1]
+        Point(x=3.0, y=4.0)
+
+    Converting in either direction is done in C. To pass a struct-of-arrays to
+    a C function, declare its C counterpart in your C source code::
+
+        typedef struct PointSoA {
+            double * x;
+            double * y;
+        } PointSoA;
+
+        void normalize(PointSoA * points, size_t length) { ... }
+
+    and pass the `StructOfArrays` object (which holds the arrays) itself::
+
+        >>> slug.dll.normalize(soa, len(soa))
+
+    Each field's array may be replaced or resized but every array must be at
+    least `len` items long when passed to C.
+
+    """
+    struct = None
+    """The array-of-structs class this is the companion of."""
+
+    _fields = ()
+    _split = None
+    _join = None
+    _pointers = None
+
+    def __init__(self, length=0):
+        """Create a struct-of-arrays with **length** zeroed items."""
+        for (name, typecode) in self._fields:
+            itemsize = array.array(typecode).itemsize
+            setattr(self, name, array.array(typecode, bytes(length * itemsize)))
+
+    def __len__(self):
+        return min(len(getattr(self, name)) for (name, _) in self._fields)
+
+    @classmethod
+    def from_aos(cls, structs):
+        """Transpose a `ctypes` array (or any other buffer) of structs."""
+        view = memoryview(structs)
+        length = view.nbytes // ctypes.sizeof(cls.struct)
+        self = cls(length)
+        cls._split(ptr(view), length, self)
+        return self
+
+    def to_aos(self):
+        """Transpose back into a `ctypes` array of structs."""
+        length = len(self)
+        out = (self.struct * length)()
+        self._join(self, length, out)
+        return out
+
+    @property
+    def _as_parameter_(self):
+        pointers = self._pointers(*(
+            getattr(self, name).buffer_info()[0] for (name, _) in self._fields))
+        return ctypes.byref(pointers)
+
+    def __repr__(self):
+        fields = ", ".join(
+            f"{name}={getattr(self, name)!r}" for (name, _) in self._fields)
+        return f"{type(self).__name__}({fields})"
+
+
+def make_soa(struct, split, join):
+    """Create the `StructOfArrays` subclass for the struct class **struct**
+    using compiled functions **split** and **join**."""
+    fields = [(name, _TYPECODES.get(type._type_, type._type_))
+              for (name, type) in struct._fields_]
+    pointers = type(
+        soa_name(struct.__name__) + "Pointers", (ctypes.Structure,),
+        {"_fields_": [(name, ctypes.c_void_p) for (name, _) in fields]})
+    for function in (split, join):
+        function.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+        function.restype = None
+    return type(
+        soa_name(struct.__name__), (StructOfArrays,), {
+            "struct":
+                struct,
+            "_fields":
+                fields,
+            "_split":
+                split,
+            "_join":
+                join,
+            "_pointers":
+                pointers,
+            "__doc__":
+                "A struct-of-arrays companion to `{}`.".format(struct.__name__),
+        })
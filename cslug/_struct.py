@@ -1,16 +1,151 @@
 import ctypes
+import struct
+import itertools
+import weakref
 from textwrap import TextWrapper
 
 
 def make_struct(name, fields):
+    helpers = {
+        "dtype": _DType(),
+        "numpy_view": classmethod(numpy_view),
+        "numpy_zeros": classmethod(numpy_zeros),
+        "array_from_tuples": classmethod(array_from_tuples),
+        "array_from_columns": classmethod(array_from_columns),
+        "to_tuples": classmethod(to_tuples),
+        "to_columns": classmethod(to_columns),
+    }
+    # A field would silently replace a helper of the same name so leave such
+    # helpers out. They remain usable as functions (e.g. cslug.dtype()).
+    for field in fields:
+        helpers.pop(field[0], None)
     return type(
         name, (ctypes.Structure,), {
             "_fields_": fields,
             "__repr__": struct_repr,
-            "_ptr": property(ctypes.addressof)
+            "_ptr": property(ctypes.addressof),
+            **helpers,
         })
 
 
+# numpy type strings for each ctypes type code, written as kind + size so as to
+# be unambiguous on every platform. Pointers (including strings) are stored as
+# unsigned integers of the same size.
+_NUMPY_KINDS = {
+    **dict.fromkeys("bhilq", "i"),
+    **dict.fromkeys("BHILQPzZ", "u"),
+    **dict.fromkeys("fdg", "f"),
+    "?": "b",
+    "u": "u",
+}
+
+# Caches of dtype() and packer() outputs. These can't be stored as attributes of
+# the struct classes themselves without risking a clash with a field name.
+_dtypes = weakref.WeakKeyDictionary()
+_packers = weakref.WeakKeyDictionary()
+
+
+def dtype_spec(cls):
+    """Describe a struct's layout in the form accepted by `numpy.dtype`.
+
+    Returns:
+        dict: With keys ``"names"``, ``"formats"``, ``"offsets"`` and
+        ``"itemsize"``.
+    Raises:
+        TypeError: If the struct has a bit-field or a field which can't be
+            represented by numpy.
+
+    Fields which are themselves structs (or unions) become nested dtypes and
+    fixed size arrays become subarrays.
+
+    """
+    names, formats, offsets = [], [], []
+    for (name, type, *bits) in cls._fields_:
+        if bits:
+            raise TypeError(f"Struct {cls.__name__} can't be converted to a "
+                            f"numpy dtype because numpy doesn't support "
+                            f"bit-fields such as '{name}'.")
+        format = _numpy_format(type)
+        if format is None:
+            raise TypeError(f"Field '{name}' of struct {cls.__name__} has "
+                            f"type {type.__name__} which has no numpy "
+                            f"equivalent.")
+        names.append(name)
+        formats.append(format)
+        offsets.append(getattr(cls, name).offset)
+    return {
+        "names": names,
+        "formats": formats,
+        "offsets": offsets,
+        "itemsize": ctypes.sizeof(cls),
+    }
+
+
+def _numpy_format(type):
+    """Get the `dtype_spec` format for a field type or None if it has no numpy
+    equivalent."""
+    if issubclass(type, (ctypes.Structure, ctypes.Union)):
+        return dtype_spec(type)
+    if issubclass(type, ctypes.Array):
+        format = _numpy_format(type._type_)
+        return None if format is None else (format, (type._length_,))
+    code = getattr(type, "_type_", None)
+    if code == "c":
+        return "S1"
+    if code in _NUMPY_KINDS:
+        return _NUMPY_KINDS[code] + str(ctypes.sizeof(type))
+    return None
+
+
+def dtype(cls):
+    """Get the `numpy.dtype` equivalent of a struct class. Requires numpy.
+
+    Field offsets, padding and total size all match the C struct's so that an
+    array of this dtype is byte for byte an array of the struct. This is also
+    available as ``Struct.dtype`` unless the struct has a field called
+    ``dtype``.
+
+    .. versionadded:: 1.1.0
+
+    """
+    out = _dtypes.get(cls)
+    if out is None:
+        import numpy
+        out = _dtypes[cls] = numpy.dtype(dtype_spec(cls))
+    return out
+
+
+class _DType(object):
+    """The `numpy.dtype` equivalent of a struct, accessible as
+    ``Struct.dtype``. See `dtype`."""
+    def __get__(self, instance, cls):
+        return dtype(cls)
+
+
+def numpy_view(cls, buffer):
+    """View a buffer of structs as a numpy structured array without copying.
+
+    Args:
+        buffer:
+            Anything supporting the buffer protocol whose size is a multiple of
+            the struct's size.
+    Returns:
+        numpy.ndarray: A 1D array with `dtype` ``Struct.dtype``.
+
+    Writes to the output modify **buffer**. Pass either to C as an array of
+    structs using `ptr()`.
+
+    """
+    import numpy
+    return numpy.frombuffer(buffer, dtype(cls))
+
+
+def numpy_zeros(cls, length):
+    """Allocate a zeroed numpy structured array of **length** structs."""
+    import numpy
+    return numpy.zeros(length, dtype(cls))
+
+
 def struct_repr(self):
     """
 
@@ -38,3 +173,113 @@ def struct_repr(self):
     if len(lines) > 1:
         return "\n".join(lines) + "\n"
     return lines[0]
+
+
+# ctypes type codes which the struct module can pack using the same code.
+_PACKABLE = set("bBhHiIlLqQfd?c")
+
+
+def packer(cls):
+    """Get a `struct.Struct` whose packed layout matches that of a struct class
+    exactly, including padding.
+
+    Raises:
+        TypeError: If the struct has a bit-field or a string field.
+
+    """
+    packer = _packers.get(cls)
+    if packer is not None:
+        return packer
+    format = "@"
+    end = 0
+    for (name, type, *bits) in cls._fields_:
+        code = getattr(type, "_type_", None)
+        if bits or code not in _PACKABLE:
+            raise TypeError(f"Field '{name}' of struct {cls.__name__} can't be "
+                            f"packed in bulk. Only numeric and char fields "
+                            f"are supported.")
+        offset = getattr(cls, name).offset
+        format += "{}x{}".format(offset - end, code)
+        end = offset + ctypes.sizeof(type)
+    format += "{}x".format(ctypes.sizeof(cls) - end)
+    packer = struct.Struct(format)
+    if packer.size != ctypes.sizeof(cls):  # pragma: no cover
+        # Would only happen if ctypes and struct disagree on alignment.
+        raise TypeError(f"Struct {cls.__name__} can't be packed in bulk "
+                        f"because its layout ({ctypes.sizeof(cls)} bytes) "
+                        f"can't be reproduced using the struct module "
+                        f"(format '{format}' gives {packer.size} bytes).")
+    _packers[cls] = packer
+    return packer
+
+
+def array_from_tuples(cls, tuples):
+    """Create a `ctypes` array of structs from an iterable of tuples of field
+    values.
+
+    Equivalent to but much faster than ``(Struct * n)(*(Struct(*i) for i in
+    tuples))`` because no intermediate struct objects are created::
+
+        cards = Card.array_from_tuples([(1, 0), (2, 0), (3, 1)])
+
+    """
+    packer_ = packer(cls)
+    data = b"".join(itertools.starmap(packer_.pack, tuples))
+    return (cls * (len(data) // packer_.size)).from_buffer_copy(data)
+
+
+def array_from_columns(cls, **columns):
+    """Create a `ctypes` array of structs from one iterable per field::
+
+        cards = Card.array_from_columns(face=[1, 2, 3], suit=[0, 0, 1])
+
+    Omitted fields are zeroed.
+
+    """
+    fields = [i[0] for i in cls._fields_]
+    for name in columns:
+        if name not in fields:
+            raise TypeError(f"{cls.__name__} has no field '{name}'.")
+    columns = {name: list(column) for (name, column) in columns.items()}
+    lengths = set(map(len, columns.values()))
+    if len(lengths) > 1:
+        raise ValueError(f"Columns have mismatched lengths {sorted(lengths)}.")
+    length = lengths.pop() if lengths else 0
+    zeros = {"c": b"\x00", "?": False}
+    for (name, type, *_) in cls._fields_:
+        if name not in columns:
+            code = getattr(type, "_type_", None)
+            if code not in _PACKABLE:
+                raise TypeError(f"Field '{name}' of struct {cls.__name__} "
+                                f"can't be packed in bulk. Only numeric and "
+                                f"char fields are supported.")
+            columns[name] = itertools.repeat(zeros.get(code, 0), length)
+    return array_from_tuples(cls, zip(*(columns[i] for i in fields)))
+
+
+def to_tuples(cls, structs):
+    """Extract the field values from an array of structs.
+
+    Args:
+        structs:
+            A `ctypes` array of structs or any other buffer of them.
+    Returns:
+        list[tuple]: One tuple of field values per struct.
+
+    """
+    return list(packer(cls).iter_unpack(memoryview(structs).cast("B")))
+
+
+def to_columns(cls, structs):
+    """Extract the field values from an array of structs, grouped by field.
+
+    Args:
+        structs:
+            A `ctypes` array of structs or any other buffer of them.
+    Returns:
+        dict[str, list]: A list of values for each field.
+
+    """
+    tuples = to_tuples(cls, structs)
+    columns = zip(*tuples) if tuples else ([] for i in cls._fields_)
+    return {i[0]: list(column) for (i, column) in zip(cls._fields_, columns)}
@@ -0,0 +1,231 @@
+import re
+import ctypes
+from pathlib import Path
+
+from cslug import misc, c_parse
+from cslug._pointers import _FORMAT_KINDS, _NATIVE_PREFIXES
+
+
+class Template(object):
+    """A C source file to be compiled once for each of several types.
+
+    Write a source file using a placeholder (:c:`T` by default) instead of a
+    concrete type:
+
+    .. code-block:: C
+
+        #include <stddef.h>
+
+        double sum(T * values, size_t length) {
+            double out = 0;
+            for (size_t i = 0; i < length; i++) out += values[i];
+            return out;
+        }
+
+    Then pass it to `CSlug` via its **templates** argument::
+
+        slug = CSlug("slug", templates=Template("sum.c", ["float", "double"]))
+
+    The source is compiled once per type with the placeholder :c:`#define`\\ d
+    to that type and every function defined in it renamed to avoid name
+    collisions. Above,
+    that gives functions ``sum__float`` and ``sum__double``. Calling the
+    unmangled name ``slug.dll.sum`` selects the specialization whose
+    placeholder pointer parameters match the type of the buffers given, so
+    no conversion is ever needed::
+
+        >>> slug.dll.sum(array.array("f", [1, 2, 3]), 3)  # Calls sum__float().
+        6.0
+        >>> slug.dll.sum(array.array("d", [1, 2, 3]), 3)  # Calls sum__double().
+        6.0
+
+    Because the source is compiled several times, it must not define
+    non-:c:`static` global variables. :c:`<stdint.h>` and :c:`<stddef.h>` are
+    always included so exact width types may be used freely.
+
+    Only functions are taken from a template. Structs, enums and constants
+    defined in it are not scanned so won't be available from Python. Put any
+    that are needed in a regular source or header file and :c:`#include` it.
+
+    .. versionadded:: 1.1.0
+
+    """
+    def __init__(self, source, types, placeholder="T"):
+        """
+
+        Args:
+            source (str or os.PathLike or io.TextIOBase):
+                The templated C source code.
+            types (str or list[str]):
+                C type names to instantiate the template for.
+            placeholder (str):
+                The placeholder type name.
+
+        """
+        self.source = misc.as_path_or_readable_buffer(source)
+        self.types = misc.flatten(types)
+        if not self.types:
+            raise ValueError("A Template requires at least one type.")
+        self.placeholder = placeholder
+        self._placeholder_re = re.compile(r"\b{}\b".format(
+            re.escape(placeholder)))
+
+    def read(self):
+        """Read the raw template source code."""
+        return misc.read(self.source)[0]
+
+    def instantiate(self, text, type):
+        """Replace the placeholder in **text** with **type**."""
+        return self._placeholder_re.sub(type, text)
+
+    def is_templated(self, parameter):
+        """Test if a function **parameter** is a pointer to the placeholder."""
+        return bool(self._placeholder_re.search(parameter)) \
+               and bool(re.search(r"[*[]", parameter))
+
+    def function_names(self):
+        """The names of every function defined in the template."""
+        return [
+            c_parse._parse_parameter(c_parse.split_function(i)[0])[2]
+            for i in c_parse.search_functions(self.read())
+        ]
+
+    @staticmethod
+    def mangle(name, type):
+        """The name of function **name** specialized for **type**."""
+        return name + "__" + re.sub(r"\W+", "_", type.strip())
+
+    def c_source(self, type, names):
+        """Generate C source code instantiating this template for **type**.
+
+        Args:
+            type (str):
+                The C type to substitute for the placeholder.
+            names (list[str]):
+                The names of all functions defined by the template.
+        Returns:
+            str: C source code.
+
+        """
+        text = self.read()
+        if isinstance(self.source, Path):
+            path = self.source.resolve()
+            # The output won't live next to the template so relative includes
+            # must be made absolute.
+            text = _include_re.sub(lambda m: _absolute_include(m, path.parent),
+                                   text)
+            filename = path.as_posix()
+        else:
+            filename = "<template>"
+
+        # Rename functions in the template's own code but not in anything it
+        # includes, which renaming via #define would also hit.
+        renames = {name: self.mangle(name, type) for name in names}
+        if renames:
+            name_re = re.compile(r"\b(?:{})\b".format("|".join(
+                map(re.escape, renames))))
+            chunks = []
+            for (start, end, group) in c_parse.lex(text):
+                chunk = text[start:end]
+                if group is c_parse.TokenType.CODE:
+                    chunk = re.sub(
+                        r"(?m)^(?![ \t]*#[ \t]*include\b).*",
+                        lambda m: name_re.sub(lambda n: renames[n[0]], m[0]),
+                        chunk)
+                chunks.append(chunk)
+            text = "".join(chunks)
+
+        return "".join([
+            "// Template instantiation generated automatically by cslug.\n",
+            "#include <stdint.h>\n",
+            "#include <stddef.h>\n",
+            "#define {} {}\n".format(self.placeholder, type),
+            '#line 1 "{}"\n'.format(filename),
+            text,
+            "\n",
+        ])
+
+
+_include_re = re.compile(r'^([ \t]*#[ \t]*include[ \t]*)"([^"]*)"', re.M)
+
+
+def _absolute_include(match, folder):
+    """Rewrite a :c:`#include "file"` to use an absolute path if **file** is
+    relative to **folder**."""
+    path = folder / match[2]
+    if not path.exists():
+        return match[0]
+    return '{}"{}"'.format(match[1], path.resolve().as_posix())
+
+
+class TemplateFunction(object):
+    """Call whichever specialization of a template function suits its array
+    arguments. See `Template`.
+
+    A specific specialization may also be chosen by indexing using a
+    `struct`/`array` format character or a `ctypes` type::
+
+        slug.dll.sum["d"]
+        slug.dll.sum[ctypes.c_float]
+
+    """
+    def __init__(self, name, arguments, specializations):
+        self.__name__ = name
+        self.specializations = specializations
+        self._arguments = arguments
+        self._dispatch = {}
+        for function in specializations:
+            for i in arguments:
+                item_type = getattr(function.argtypes[i], "_item_type", None)
+                if item_type is not None:
+                    self._dispatch[_ctype_key(item_type)] = function
+                    break
+
+    def __call__(self, *args):
+        for i in self._arguments:
+            if i >= len(args):
+                break
+            try:
+                view = memoryview(args[i])
+            except TypeError:
+                continue
+            format = view.format
+            if format[:1] in _NATIVE_PREFIXES:
+                format = format[1:]
+            function = self._dispatch.get(
+                (_FORMAT_KINDS.get(format), view.itemsize))
+            if function is None:
+                raise TypeError(
+                    f"{self.__name__}() has no specialization for buffers "
+                    f"with format '{view.format}' and itemsize "
+                    f"{view.itemsize}.")
+            return function(*args)
+        raise TypeError(
+            f"Can't choose a specialization of {self.__name__}() without a "
+            f"buffer argument. Use {self.__name__}[type](...) to choose one "
+            f"explicitly.")
+
+    def __getitem__(self, type):
+        if isinstance(type, str):
+            if len(type) > 1:
+                type = misc.array_typecode(type)
+            type = _ctype_from_format(type)
+        return self._dispatch[_ctype_key(type)]
+
+    def __repr__(self):
+        return f"<TemplateFunction {self.__name__}>"
+
+
+def _ctype_key(ctype):
+    """Identify a numeric ctypes type by its kind and size."""
+    return _FORMAT_KINDS[ctype._type_], ctypes.sizeof(ctype)
+
+
+def _ctype_from_format(format):
+    """Find a ctypes type with type code **format**."""
+    for name in ("c_byte", "c_ubyte", "c_short", "c_ushort", "c_int", "c_uint",
+                 "c_long", "c_ulong", "c_longlong", "c_ulonglong", "c_float",
+                 "c_double", "c_bool"):
+        if getattr(ctypes, name)._type_ == format:
+            return getattr(ctypes, name)
+    raise KeyError(format)
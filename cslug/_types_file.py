@@ -4,11 +4,21 @@
 import json
 import ctypes
 import itertools
+import enum
 from typing import Union
 
-from cslug.c_parse import parse_functions, parse_structs
+from cslug.c_parse import (parse_functions, parse_structs, parse_enums,
+                           parse_defines, parse_globals, parse_array_functions,
+                           parse_callbacks, search_functions, split_function,
+                           parse_function, _parse_parameter)
 from cslug import misc
 from cslug._struct import make_struct
+from cslug._callbacks import make_callback
+from cslug._pointers import typed_pointer
+from cslug import _vectorize, _soa
+from cslug._array_args import ArrayFunction
+from cslug._template import TemplateFunction
+from cslug._preprocess import preprocess as _preprocess, PreprocessCache
 
 
 class Types(object):
@@ -18,12 +28,18 @@ class Types(object):
 
       - The name, argument and return types of each function.
       - The name, field names, types and bit-field sizes of structures.
+      - The names and values of enumerations and of numeric :c:`#define`\\ s.
+      - The names, types and array sizes of global variables.
+      - The return and parameter types of function pointer types.
+      - Which function parameters are array lengths or outputs.
 
     * Stores the above in a portable and quickly deserializable json file.
     * Sets the types for the contents of a `ctypes.CDLL`.
 
     """
-    def __init__(self, path, *sources, headers=(), compact=True):
+    def __init__(self, path, *sources, headers=(), compact=True,
+                 preprocess=False, flags=(), vectorize=(), templates=(),
+                 soa=()):
         """
 
         Args:
@@ -36,6 +52,21 @@ def __init__(self, path, *sources, headers=(), compact=True):
             compact (bool):
                 If true, serialise minimising file size. Otherwise, pretty
                 format for human readability.
+            preprocess (bool):
+                Run each source through the C compiler's preprocessor before
+                scanning it.
+            flags (list[str]):
+                Compiler flags (e.g. ``-I`` or ``-D`` options) to pass to the
+                preprocessor. Ignored unless **preprocess** is true.
+            vectorize (str or list[str]):
+                Names of scalar functions to also expose element-wise versions
+                of. See `CSlug` for details.
+            templates (Template or list[Template]):
+                Templated C sources to extract the functions of each
+                specialization from.
+            soa (str or list[str]):
+                Names of structs to also expose struct-of-arrays versions of.
+                See `CSlug` for details.
 
         Note the distinction between **sources** and **headers**.
         A function prototype such as :c:`int foo();` will be ignored if
@@ -43,15 +74,39 @@ def __init__(self, path, *sources, headers=(), compact=True):
         A true function definition such as :c:`int foo() {}`, as well as
         structure definitions would be collected in either case.
 
+        By default, source code is scanned as is, meaning that anything declared
+        using macros, hidden inside :c:`#ifdef` blocks or defined in other
+        :c:`#include`\\ d files is either misread or missed entirely. Setting
+        **preprocess** to true makes |cslug| scan the output of ``$CC -E``
+        instead. Anything originating from system headers is discarded. The
+        preprocessor's output is cached in a ``.i-cache`` file next to
+        **path** (if **path** is a true path) and reused until either the
+        source file or any of the files it :c:`#include`\\ s are modified.
+
+        .. versionchanged:: 1.1.0
+
+            Add the **preprocess**, **flags**, **vectorize**, **templates**
+            and **soa** parameters.
+
         """
         self.sources = [misc.as_path_or_buffer(i) for i in sources]
         self.headers = list(map(misc.as_path_or_buffer, misc.flatten(headers)))
         self.json_path = misc.as_path_or_buffer(path)
         self.compact = compact
+        self.preprocess = preprocess
+        self.flags = flags
+        self.vectorize = misc.flatten(vectorize)
+        self.template_sources = misc.flatten(templates)
+        self.soa = misc.flatten(soa)
+        if isinstance(self.json_path, Path):
+            cache_path = self.json_path.with_suffix(".i-cache")
+        else:
+            cache_path = None
+        self._preprocess_cache = PreprocessCache(cache_path)
 
     types: dict
-    """All type information collected. This is broken out into `functions` and
-    `structs`.
+    """All type information collected. This is broken out into `functions`,
+    `structs`, `enums`, `constants` and `globals`.
 
     Note that this attribute is not set automatically. You must explicitly call
     either `init_from_source` or `init_from_json` before accessing.
@@ -74,19 +129,88 @@ def _types_from_source(self):
         :rtype: dict
         """
         functions = {}
+        arrays = {}
         structs = {}
-        for source in itertools.chain(self.sources, self.headers):
-            structs.update(parse_structs(misc.read(source)[0]))
+        globals = {}
+        sources = [self._read(i) for i in self.sources]
+        headers = [self._read(i) for i in self.headers]
 
-        for source in self.sources:
-            functions.update(
-                parse_functions(misc.read(source)[0], typedefs=structs))
-        for source in self.headers:
-            functions.update(
-                parse_functions(
-                    misc.read(source)[0], typedefs=structs, prototypes=True))
+        for source in itertools.chain(sources, headers):
+            structs.update(parse_structs(source))
 
-        return {"functions": functions, "structs": structs}
+        # Constants may refer to each other across files so evaluate them all
+        # in a shared namespace.
+        constants = {}
+        enums = {}
+        namespace = {}
+        for source in itertools.chain(sources, headers):
+            defines = parse_defines(source, namespace)
+            constants.update(defines)
+            namespace.update(defines)
+        for source in itertools.chain(sources, headers):
+            for (name, members) in parse_enums(source, namespace):
+                namespace.update(members)
+                if name is None:
+                    constants.update(members)
+                else:
+                    enums[name] = members
+
+        callbacks = {}
+        for source in itertools.chain(sources, headers):
+            callbacks.update(parse_callbacks(source, {**structs, **enums}))
+
+        typedefs = {**structs, **enums, **callbacks}
+        for source in sources:
+            functions.update(parse_functions(source, typedefs=typedefs))
+            arrays.update(parse_array_functions(source, typedefs))
+            for (name, type, shape) in parse_globals(source, typedefs,
+                                                     namespace):
+                globals[name] = [type, *shape]
+        for source in headers:
+            functions.update(
+                parse_functions(source, typedefs=typedefs, prototypes=True))
+            arrays.update(
+                parse_array_functions(source, typedefs, prototypes=True))
+        templates = {}
+        for template in self.template_sources:
+            for declaration in search_functions(template.read()):
+                head, parameters = split_function(declaration)
+                function_name = _parse_parameter(head)[2]
+                arguments = [
+                    i for (i, arg) in enumerate(parameters)
+                    if template.is_templated(arg)
+                ]
+                specializations = []
+                for type in template.types:
+                    name, *types = parse_function(
+                        template.instantiate(declaration, type), typedefs)
+                    functions[template.mangle(name, type)] = types
+                    specializations.append(template.mangle(name, type))
+                templates[function_name] = [arguments, specializations]
+
+        for name in self.vectorize:
+            _vectorize.check(name, functions)
+        for name in self.soa:
+            _soa.check(name, structs)
+
+        return {
+            "functions": functions,
+            "structs": structs,
+            "enums": enums,
+            "constants": constants,
+            "globals": globals,
+            "vectorized": self.vectorize,
+            "arrays": arrays,
+            "templates": templates,
+            "soa": self.soa,
+            "callbacks": callbacks,
+        }
+
+    def _read(self, source):
+        """Read a source file, preprocessing it if requested."""
+        if self.preprocess:
+            return _preprocess(source, self.flags, self._preprocess_cache)
+        return misc.read(source)[0]
 
     def _types_from_json(self):
         return json.loads(misc.read(self.json_path)[0])
@@ -125,8 +249,10 @@ def functions(self) -> dict:
 
             function_name: [return_type, [arg_type, arg_type, ...]]
 
-        All types are strings - either names of structures or attribute names of
-        `ctypes`.
+        All types are strings - either names of structures or function pointer
+        types or attribute names of `ctypes` - except for function pointer
+        parameters declared without a :c:`typedef` which are written in full as
+        :py:`[return_type, [arg_type, ...]]`.
 
         """
         return self.types["functions"]
@@ -146,7 +272,108 @@ def structs(self) -> dict:
         """
         return self.types["structs"]
 
-    def apply(self, dll, strict=False):
+    @property
+    def enums(self) -> dict:
+        """All named enumerations, defined using either
+        :c:`typedef enum {...} name;` or :c:`enum name {...};`.
+
+        The format is::
+
+            name: [(member_name, value), ...]
+
+        """
+        return self.types.get("enums", {})
+
+    @property
+    def constants(self) -> dict:
+        """All numeric constants defined using :c:`#define` or found in
+        anonymous enumerations.
+
+        The format is::
+
+            name: value
+
+        """
+        return self.types.get("constants", {})
+
+    @property
+    def globals(self) -> dict:
+        """All non-:c:`static` global variables.
+
+        The format is::
+
+            name: [type, *array_dimensions]
+
+        Where **type** is either the name of a structure or an attribute name of
+        `ctypes`. **array_dimensions** is empty for anything that isn't an
+        array.
+
+        """
+        return self.types.get("globals", {})
+
+    @property
+    def vectorized(self) -> list:
+        """The names of all functions which have element-wise versions.
+
+        The format is::
+
+            [function_name, ...]
+
+        """
+        return self.types.get("vectorized", [])
+
+    @property
+    def arrays(self) -> dict:
+        """All functions with parameters which are array lengths or outputs.
+        These are identified only by their names (``len_x``, ``x_len``,
+        ``out`` or ``out_*``). See `cslug.c_parse.parse_array_parameters`.
+
+        The format is::
+
+            function_name: [[[length_index, array_index], ...], output_indices]
+
+        """
+        return self.types.get("arrays", {})
+
+    @property
+    def templates(self) -> dict:
+        """All functions defined in a `Template`.
+
+        The format is::
+
+            function_name: [templated_argument_indices, specialization_names]
+
+        Where **templated_argument_indices** are the positions of parameters
+        which are pointers to the template's placeholder type and
+        **specialization_names** are the mangled names of each specialization.
+
+        """
+        return self.types.get("templates", {})
+
+    @property
+    def soa_layouts(self) -> list:
+        """The names of all structs which have struct-of-arrays companions.
+
+        The format is::
+
+            [struct_name, ...]
+
+        """
+        return self.types.get("soa", [])
+
+    @property
+    def callbacks(self) -> dict:
+        """All function pointer types defined using
+        :c:`typedef return_type (*name)(...);`.
+
+        The format is the same as `functions`::
+
+            name: [return_type, [arg_type, arg_type, ...]]
+
+        """
+        return self.types.get("callbacks", {})
+
+    def apply(self, dll, strict=False, hold_gil=()):
         """Set the type information for the contents of **dll**.
 
         Args:
@@ -154,11 +381,26 @@ def apply(self, dll, strict=False):
                 The opened |../shared library| to apply type information to.
             strict (bool):
                 Raise an `AttributeError` if a symbol wasn't found.
+            hold_gil (set[str]):
+                Names of functions to load using `ctypes.PyDLL` so that they
+                don't release the GIL. Their ``vectorized``, ``wrapped`` and
+                template wrappers are built around these instead.
 
         For every structure in ``self.structs``, turn it into a
         `ctypes.Structure` and set it as an attribute of **dll**. For every
         function in ``self.functions``, get it from **dll** then set its
-        ``argtypes`` and ``restype`` attributes.
+        ``argtypes`` and ``restype`` attributes. Every enumeration in
+        ``self.enums`` is turned into an `enum.IntEnum` and set, along with its
+        members, as attributes of **dll**. Likewise, ``self.constants`` are set
+        as plain `int` or `float` attributes. Reading any of these involves no
+        calls into C. Each global variable in ``self.globals`` is bound, using
+        ``ctype.in_dll()``, to an instance of its `ctypes` type which shares
+        its memory with the C variable. Each function in ``self.vectorized``
+        gets a ``vectorized`` attribute holding its element-wise version.
+        Each function in ``self.arrays`` gets a ``wrapped`` attribute which
+        passes array lengths and allocates and returns outputs automatically.
+        Each function pointer type in ``self.callbacks`` is turned into a
+        `cslug.Callback` and set as an attribute of **dll**.
 
         .. note::
 
@@ -166,10 +408,12 @@ def apply(self, dll, strict=False):
             them in there for simplicity.
 
         """
-        dll.__dict__.update(self._merge_apply(dll, strict=strict))
+        dll.__dict__.update(
+            self._merge_apply(dll, strict=strict, hold_gil=hold_gil))
 
-    def _merge_apply(self, *dlls, strict=False):
+    def _merge_apply(self, *dlls, strict=False, hold_gil=()):
         structs = {}
+        py_dlls = {}
         if strict:
             errors = []
 
@@ -178,7 +422,16 @@ def _merge_apply(self, *dlls, strict=False):
                       for (name, type, *bits) in params]
             structs[name] = make_struct(name, fields)
 
-        namespace = {}
+        # Function pointer types are looked up and exported alongside structs.
+        for (name, (return_type, arg_types)) in self.callbacks.items():
+            structs[name] = self._callback(name, return_type, arg_types,
+                                           structs)
+
+        namespace = dict(self.constants)
+        for (name, members) in self.enums.items():
+            enum_ = enum.IntEnum(name, [tuple(i) for i in members])
+            namespace.update(enum_.__members__)
+            namespace[name] = enum_
 
         for (name, (return_type, arg_types)) in self.functions.items():
             for dll in dlls:
@@ -202,19 +455,77 @@ def _merge_apply(self, *dlls, strict=False):
                     pass
                 continue  # pragma: no cover
 
+            if name in hold_gil:
+                func = getattr(_py_dll(dll, py_dlls), name)
+
             # Set function return type. Default to no return value.
-            func.restype = structs.get(return_type) \
-                           or getattr(ctypes, return_type, None)
+            func.restype = self._ctype(return_type, structs, None)
 
             # Set argument types. Default to int. If this is wrong however this
             # will almost certainly cause strange incorrect behaviour.
             func.argtypes = [
-                structs.get(i) or getattr(ctypes, i, ctypes.c_int)
-                for i in arg_types
+                self._ctype(i, structs, ctypes.c_int) for i in arg_types
             ]
 
             namespace[name] = func
 
+        for (name, (arguments, names)) in self.templates.items():
+            specializations = [namespace[i] for i in names if i in namespace]
+            if specializations:
+                namespace[name] = \
+                    TemplateFunction(name, arguments, specializations)
+
+        for (name, (lengths, outputs)) in self.arrays.items():
+            if name in namespace:
+                namespace[name].wrapped = \
+                    ArrayFunction(namespace[name], lengths, outputs)
+
+        for name in self.vectorized:
+            if name not in namespace:
+                continue
+            wrapper_name = _vectorize.wrapper_name(name)
+            for dll in dlls:
+                wrapper = getattr(dll, wrapper_name, None)
+                if wrapper is not None:
+                    if name in hold_gil:
+                        wrapper = getattr(_py_dll(dll, py_dlls), wrapper_name)
+                    namespace[name].vectorized = \
+                        _vectorize.Vectorized(namespace[name], wrapper)
+                    break
+            else:
+                if strict:
+                    errors.append(wrapper_name)
+
+        for name in self.soa_layouts:
+            if name not in structs:
+                continue
+            functions = []
+            for symbol in (_soa.split_name(name), _soa.join_name(name)):
+                for dll in dlls:
+                    function = getattr(dll, symbol, None)
+                    if function is not None:
+                        functions.append(function)
+                        break
+                else:
+                    if strict:
+                        errors.append(symbol)
+            if len(functions) == 2:
+                structs[name].SoA = _soa.make_soa(structs[name], *functions)
+
+        for (name, (type, *shape)) in self.globals.items():
+            ctype = self._ctype(type, structs, None)
+            for size in reversed(shape):
+                ctype = ctype * size
+            for dll in dlls:
+                try:
+                    namespace[name] = ctype.in_dll(dll, name)
+                    break
+                except ValueError:
+                    pass
+            else:
+                if strict:
+                    errors.append(name)
+
         if strict and len(errors):
             dll = " ".join(map(repr, dlls))
             raise AttributeError(f"Symbols {errors} not found in {dll}.")
@@ -222,6 +533,34 @@ def _merge_apply(self, *dlls, strict=False):
         namespace.update(structs)
         return namespace
 
+    def _ctype(self, name, structs, default):
+        """Convert a type name from the json to a `ctypes` type."""
+        if isinstance(name, (list, tuple)):
+            # An anonymous function pointer type.
+            return self._callback("CFunctionType", *name, structs)
+        if name in structs:
+            return structs[name]
+        if name in self.enums:
+            # Enums are always ints.
+            return ctypes.c_int
+        if name.endswith("*"):
+            return typed_pointer(getattr(ctypes, name[:-1]))
+        return getattr(ctypes, name, default)
+
+    def _callback(self, name, return_type, arg_types, structs):
+        """Convert a function pointer type from the json to a
+        `cslug.Callback`."""
+        return make_callback(
+            name, self._ctype(return_type, structs, None),
+            [self._ctype(i, structs, ctypes.c_int) for i in arg_types])
+
+
+def _py_dll(dll, cache):
+    """Get a `ctypes.PyDLL` sharing **dll**'s already open library handle."""
+    if dll._name not in cache:
+        cache[dll._name] = ctypes.PyDLL(dll._name, handle=dll._handle)
+    return cache[dll._name]
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,188 @@
+"""
+Element-wise wrappers for scalar C functions.
+
+For a function such as :c:`double f(double x, int y)`, a loop of the form::
+
+    void cslug_vectorized_f(size_t n, double * out,
+                            const double * a0, size_t s0,
+                            const int * a1, size_t s1) {
+        for (size_t i = 0; i < n; i++)
+            out[i] = f(a0[i * s0], a1[i * s1]);
+    }
+
+is generated, compiled into the same library, then exposed in Python by
+`Vectorized`. A step of 0 broadcasts a scalar argument.
+
+"""
+
+import ctypes
+import array
+
+from cslug._pointers import typed_pointer, _as_typed_buffer, _buffer_length
+
+# C spellings of each numeric ctypes type, keyed by their shared `array`,
+# `struct` and ctypes type code. Aliases such as int64_t are spelled as whatever
+# type ctypes says they really are - which is equivalent at the ABI level.
+_C_NAMES = {
+    "b": "signed char",
+    "B": "unsigned char",
+    "h": "short",
+    "H": "unsigned short",
+    "i": "int",
+    "I": "unsigned int",
+    "l": "long",
+    "L": "unsigned long",
+    "q": "long long",
+    "Q": "unsigned long long",
+    "f": "float",
+    "d": "double",
+}
+
+
+def wrapper_name(name):
+    """The C symbol name of the vectorized version of function **name**."""
+    return "cslug_vectorized_" + name
+
+
+def _type_code(type_name):
+    """Get the type code of a ctypes type name from a types json or None if it
+    isn't a vectorizable numeric type."""
+    type = getattr(ctypes, type_name, None)
+    code = getattr(type, "_type_", None)
+    return code if code in _C_NAMES else None
+
+
+def check(name, functions):
+    """Raise an error if **name** isn't a function which can be vectorized.
+
+    Args:
+        name (str):
+            The name of a C function.
+        functions (dict):
+            All functions, in the format of `cslug.Types.functions`.
+
+    Raises:
+        ValueError:
+            If **name** either isn't in **functions** or doesn't take one or
+            more numeric arguments and return a number.
+
+    """
+    if name not in functions:
+        raise ValueError(f"Can't vectorize function '{name}' because no "
+                         f"definition of it was found.")
+    (return_type, arg_types) = functions[name]
+    if not arg_types or not all(map(_type_code, [return_type] + arg_types)):
+        raise ValueError(
+            f"Can't vectorize function '{name}' with argument types "
+            f"{arg_types} and return type {return_type}. Only functions "
+            f"taking one or more numbers and returning a number are supported.")
+
+
+def c_source(functions, names):
+    """Generate C code for vectorized versions of functions.
+
+    Args:
+        functions (dict):
+            All functions, in the format of `cslug.Types.functions`.
+        names (list[str]):
+            The names of functions to vectorize.
+    Returns:
+        str: C source code.
+
+    """
+    lines = [
+        "// Element-wise wrappers generated automatically by cslug.\n",
+        "#include <stddef.h>\n"
+    ]
+    for name in names:
+        (return_type, arg_types) = functions[name]
+        return_type = _C_NAMES[_type_code(return_type)]
+        arg_types = [_C_NAMES[_type_code(i)] for i in arg_types]
+        args = range(len(arg_types))
+
+        prototype = "{} {}({});".format(return_type, name, ", ".join(arg_types))
+        parameters = ["size_t n", return_type + " * out"]
+        for (i, type) in zip(args, arg_types):
+            parameters += [f"const {type} * a{i}", f"size_t s{i}"]
+        values = ", ".join(f"a{i}[i * s{i}]" for i in args)
+
+        lines += [
+            "\n", prototype, "\n\n",
+            "void {}({}) {{\n".format(wrapper_name(name), ", ".join(parameters)),
+            "    for (size_t i = 0; i < n; i++)\n",
+            "        out[i] = {}({});\n".format(name, values),
+            "}\n",
+        ]  # yapf: disable
+    return "".join(lines)
+
+
+class Vectorized(object):
+    """An element-wise, ufunc-like version of a scalar C function.
+
+    Each argument may be either a single number or a buffer (or any other
+    iterable) of numbers. Scalar arguments are broadcast, all others must be of
+    the same length. The result is written to **out** if given or otherwise to
+    a new `array.array` of the function's return type.
+
+    .. code-block:: python
+
+        >>> slug.dll.scale(2.0, 3.0)
+        6.0
+        >>> slug.dll.scale.vectorized(array.array("d", [1, 2, 3]), 3.0)
+        array('d', [3.0, 6.0, 9.0])
+
+    Buffers whose items are of the same kind and size as the corresponding C
+    type and are C-contiguous are passed to C without copying. Anything else is
+    copied into a temporary array of the right type first. Multidimensional
+    buffers are treated as flat.
+
+    If every argument is a scalar then the scalar function is called instead.
+
+    """
+    def __init__(self, function, wrapper):
+        self.function = function
+        self.__name__ = function.__name__
+        self._wrapper = wrapper
+        self._restype = function.restype
+        self._argtypes = list(function.argtypes)
+        wrapper.restype = None
+        argtypes = [ctypes.c_size_t, typed_pointer(self._restype)]
+        for type in self._argtypes:
+            argtypes += [typed_pointer(type), ctypes.c_size_t]
+        wrapper.argtypes = argtypes
+
+    def __call__(self, *args, out=None):
+        if len(args) != len(self._argtypes):
+            raise TypeError(f"{self.__name__}() takes {len(self._argtypes)} "
+                            f"arguments ({len(args)} given)")
+        length = None
+        c_args = []
+        for (arg, type) in zip(args, self._argtypes):
+            buffer = _as_typed_buffer(arg, type._type_)
+            if buffer is None:
+                # Broadcast a scalar by not stepping through it.
+                c_args += [ctypes.byref(type(arg)), 0]
+                continue
+            arg = buffer
+            if length is None:
+                length = _buffer_length(arg)
+            elif _buffer_length(arg) != length:
+                raise ValueError(
+                    f"Arguments to {self.__name__}() have mismatched lengths "
+                    f"{length} and {_buffer_length(arg)}.")
+            c_args += [arg, 1]
+
+        if length is None:
+            return self.function(*args)
+
+        if out is None:
+            size = ctypes.sizeof(self._restype)
+            out = array.array(self._restype._type_, bytes(length * size))
+        elif _buffer_length(out) != length:
+            raise ValueError(f"The output has length {_buffer_length(out)} "
+                             f"but the inputs have length {length}.")
+        self._wrapper(length, out, *c_args)
+        return out
+
+    def __repr__(self):
+        return f"<Vectorized {self.__name__}>"
@@ -0,0 +1,623 @@
+"""
+Measure the overhead |cslug| adds to calling C code.
+
+Run from a shell using::
+
+    python -m cslug.bench --output before.json
+    # Change something...
+    python -m cslug.bench --output after.json --compare before.json
+
+A small but representative |cslug| is built into a temporary directory then
+each benchmark is timed, keeping the best of several repeats to filter out
+noise. Times are reported in nanoseconds per call. Results are written as json
+so that they can be kept and compared across commits.
+
+The C functions involved deliberately do next to nothing so that what is
+measured is the cost of getting in and out of C - argument conversion,
+`ptr()`, struct construction, loading and building - rather than the C code
+itself.
+
+"""
+
+import io
+import array
+import json
+import time
+import inspect
+import platform
+import tempfile
+import argparse
+from pathlib import Path
+
+SOURCE = r"""
+#include <stddef.h>
+#include <wchar.h>
+#include <cslug.h>
+
+typedef struct Point {
+    double x;
+    double y;
+} Point;
+
+void nothing() {}
+
+void nothing_held() {}
+
+int add(int a, int b) { return a + b; }
+
+int add_held(int a, int b) { return a + b; }
+
+double scale(double x, double factor) { return x * factor; }
+
+double sum(double * values, size_t length) {
+    double out = 0;
+    for (size_t i = 0; i < length; i++) out += values[i];
+    return out;
+}
+
+double first(double * values) { return values[0]; }
+
+double first_void(void * values) { return ((double *) values)[0]; }
+
+double first_of_3(double * a, double * b, double * c) {
+    return a[0] + b[0] + c[0];
+}
+
+double point_x(Point point) { return point.x; }
+
+double point_ptr_x(Point * point) { return point->x; }
+
+Point make_point(double x, double y) {
+    Point out = {x, y};
+    return out;
+}
+
+size_t c_strlen(char * text) {
+    size_t i = 0;
+    while (text[i]) i++;
+    return i;
+}
+
+size_t c_wcslen(wchar_t * text) {
+    size_t i = 0;
+    while (text[i]) i++;
+    return i;
+}
+
+void visit_each(double * values, size_t length, void (*visit)(double)) {
+    for (size_t i = 0; i < length; i++) visit(values[i]);
+}
+
+void visit_batched(double * values, size_t length, cslug_batch * batch) {
+    for (size_t i = 0; i < length; i++)
+        *(double *) cslug_batch_next(batch) = values[i];
+    cslug_batch_flush(batch);
+}
+"""
+
+# Registered benchmarks in the order they were defined.
+BENCHMARKS = {}
+
+
+def benchmark(name, number=None):
+    """Register a benchmark.
+
+    The decorated function should take the built `cslug.CSlug` and return a
+    zero argument callable to be timed. **number** overrides how many calls
+    are made per repeat - use ``1`` for anything slow. Benchmarks which need
+    cleaning up after should instead be generators which yield the callable
+    then clean up.
+
+    """
+    def wrapper(setup):
+        BENCHMARKS[name] = (setup, number)
+        return setup
+
+    return wrapper
+
+
+@benchmark("call/no-args")
+def _(slug):
+    return slug.dll.nothing
+
+
+@benchmark("call/int-args")
+def _(slug):
+    add = slug.dll.add
+    return lambda: add(1, 2)
+
+
+@benchmark("call/no-args-hold-gil")
+def _(slug):
+    return slug.dll.nothing_held
+
+
+@benchmark("call/int-args-hold-gil")
+def _(slug):
+    add = slug.dll.add_held
+    return lambda: add(1, 2)
+
+
+@benchmark("call/double-args")
+def _(slug):
+    scale = slug.dll.scale
+    return lambda: scale(1.5, 2.0)
+
+
+@benchmark("ptr/array")
+def _(slug):
+    from cslug import ptr
+    values = array.array("d", range(100))
+    return lambda: ptr(values)
+
+
+@benchmark("ptr/bytes")
+def _(slug):
+    from cslug import ptr
+    values = bytes(800)
+    return lambda: ptr(values)
+
+
+@benchmark("ptr/nc_ptr")
+def _(slug):
+    from cslug import nc_ptr
+    values = array.array("d", range(100))
+    return lambda: nc_ptr(values)
+
+
+@benchmark("array/ptr")
+def _(slug):
+    from cslug import ptr
+    first = slug.dll.first_void
+    values = array.array("d", range(100))
+    return lambda: first(ptr(values))
+
+
+@benchmark("array/typed-pointer")
+def _(slug):
+    first = slug.dll.first
+    values = array.array("d", range(100))
+    return lambda: first(values)
+
+
+@benchmark("array/typed-pointer-readonly")
+def _(slug):
+    first = slug.dll.first
+    values = memoryview(array.array("d", range(100))).toreadonly()
+    return lambda: first(values)
+
+
+@benchmark("array/ptr-x3")
+def _(slug):
+    from cslug import ptr
+    first_of_3 = slug.dll.first_of_3
+    a, b, c = (array.array("d", range(100)) for i in range(3))
+    return lambda: first_of_3(ptr(a), ptr(b), ptr(c))
+
+
+@benchmark("array/ptrs-x3")
+def _(slug):
+    from cslug import ptrs
+    first_of_3 = slug.dll.first_of_3
+    a, b, c = (array.array("d", range(100)) for i in range(3))
+
+    def call():
+        with ptrs(a, b, c) as pointers:
+            first_of_3(*pointers)
+
+    return call
+
+
+@benchmark("output/array-x10000")
+def _(slug):
+    return lambda: array.array("d", bytes(80000))
+
+
+@benchmark("output/arena-x10000")
+def _(slug):
+    from cslug import Arena
+    arena = Arena(1 << 20)
+
+    def allocate():
+        arena.array("d", 10000)
+        arena.reset()
+
+    return allocate
+
+
+@benchmark("struct/construct")
+def _(slug):
+    Point = slug.dll.Point
+    return lambda: Point(1.0, 2.0)
+
+
+@benchmark("struct/construct-x1000", number=20)
+def _(slug):
+    Point = slug.dll.Point
+    values = [(i, -i) for i in range(1000)]
+    return lambda: (Point * 1000)(*(Point(*i) for i in values))
+
+
+@benchmark("struct/array_from_tuples-x1000", number=20)
+def _(slug):
+    Point = slug.dll.Point
+    values = [(i, -i) for i in range(1000)]
+    return lambda: Point.array_from_tuples(values)
+
+
+@benchmark("struct/getattr-x1000", number=20)
+def _(slug):
+    Point = slug.dll.Point
+    points = Point.array_from_tuples((i, -i) for i in range(1000))
+    return lambda: ([i.x for i in points], [i.y for i in points])
+
+
+@benchmark("struct/to_columns-x1000", number=20)
+def _(slug):
+    Point = slug.dll.Point
+    points = Point.array_from_tuples((i, -i) for i in range(1000))
+    return lambda: Point.to_columns(points)
+
+
+@benchmark("struct/soa-x1000", number=100)
+def _(slug):
+    Point = slug.dll.Point
+    points = Point.array_from_tuples((i, -i) for i in range(1000))
+    return lambda: Point.SoA.from_aos(points)
+
+
+@benchmark("struct/aos-x1000", number=100)
+def _(slug):
+    Point = slug.dll.Point
+    points = Point.SoA.from_aos(
+        Point.array_from_tuples((i, -i) for i in range(1000)))
+    return points.to_aos
+
+
+@benchmark("struct/by-value")
+def _(slug):
+    point_x = slug.dll.point_x
+    point = slug.dll.Point(1.0, 2.0)
+    return lambda: point_x(point)
+
+
+@benchmark("struct/by-_ptr")
+def _(slug):
+    point_ptr_x = slug.dll.point_ptr_x
+    point = slug.dll.Point(1.0, 2.0)
+    return lambda: point_ptr_x(point._ptr)
+
+
+@benchmark("struct/return")
+def _(slug):
+    make_point = slug.dll.make_point
+    return lambda: make_point(1.0, 2.0)
+
+
+@benchmark("string/c_char_p")
+def _(slug):
+    c_strlen = slug.dll.c_strlen
+    text = b"hello " * 10
+    return lambda: c_strlen(text)
+
+
+@benchmark("string/c_wchar_p")
+def _(slug):
+    c_wcslen = slug.dll.c_wcslen
+    text = "hello " * 10
+    return lambda: c_wcslen(text)
+
+
+@benchmark("vectorized/loop-x1000", number=20)
+def _(slug):
+    scale = slug.dll.scale
+    values = array.array("d", range(1000))
+    return lambda: [scale(i, 2.0) for i in values]
+
+
+@benchmark("vectorized/x1000", number=100)
+def _(slug):
+    scale = slug.dll.scale.vectorized
+    values = array.array("d", range(1000))
+    out = array.array("d", values)
+    return lambda: scale(values, 2.0, out=out)
+
+
+@benchmark("parallel/x100000", number=100)
+def _(slug):
+    from cslug import CHUNK_LENGTH
+    values = array.array("d", range(100000))
+    return lambda: slug.parallel("sum", values, CHUNK_LENGTH, reduce=sum)
+
+
+@benchmark("callback/per-item-x1000", number=20)
+def _(slug):
+    visit_each = slug.dll.visit_each
+    values = array.array("d", range(1000))
+    out = []
+    return lambda: visit_each(values, len(values), out.append)
+
+
+@benchmark("callback/batched-x1000", number=100)
+def _(slug):
+    from cslug import Batch
+    visit_batched = slug.dll.visit_batched
+    values = array.array("d", range(1000))
+    out = []
+    batch = Batch(out.extend, "d", 256)
+    return lambda: visit_batched(values, len(values), batch)
+
+
+@benchmark("isolation/in-process/sum-x100000", number=100)
+def _(slug):
+    sum = slug.dll.sum
+    values = array.array("d", range(100000))
+    return lambda: sum(values, len(values))
+
+
+@benchmark("isolation/pool/no-args", number=1000)
+def _(slug):
+    from cslug import ProcessPool
+    with ProcessPool(slug, 1) as pool:
+        nothing = pool.dll.nothing
+        nothing()  # Start the worker.
+        yield nothing
+
+
+@benchmark("isolation/pool/int-args", number=1000)
+def _(slug):
+    from cslug import ProcessPool
+    with ProcessPool(slug, 1) as pool:
+        add = pool.dll.add
+        add(1, 2)
+        yield lambda: add(1, 2)
+
+
+@benchmark("isolation/pool/sum-x100000", number=100)
+def _(slug):
+    from cslug import ProcessPool
+    with ProcessPool(slug, 1) as pool:
+        sum = pool.dll.sum
+        values = pool.array("d", range(100000))
+        sum(values, len(values))
+        yield lambda: sum(values, len(values))
+
+
+@benchmark("isolation/pool/sum-copied-x100000", number=100)
+def _(slug):
+    from cslug import ProcessPool
+    with ProcessPool(slug, 1) as pool:
+        sum = pool.dll.sum
+        values = array.array("d", range(100000))
+        sum(values, len(values))
+        yield lambda: sum(values, len(values))
+
+
+@benchmark("isolation/pool/submit-x100", number=10)
+def _(slug):
+    from cslug import ProcessPool
+    with ProcessPool(slug) as pool:
+        add = pool.dll.add
+        add(1, 2)
+
+        def submit():
+            futures = [add.submit(1, i) for i in range(100)]
+            return [future.result() for future in futures]
+
+        yield submit
+
+
+@benchmark("specialize/lookup")
+def _(slug):
+    slug.specialize(N=3)
+    return lambda: slug.specialize(N=3)
+
+
+@benchmark("load", number=1)
+def _(slug):
+    def load():
+        slug.close()
+        slug.dll
+
+    return load
+
+
+@benchmark("make/compile", number=1)
+def _(slug):
+    return slug.compile
+
+
+@benchmark("make/types", number=1)
+def _(slug):
+    return slug.types_map.make
+
+
+@benchmark("make/full", number=1)
+def _(slug):
+    return slug.make
+
+
+def build(directory):
+    """Build the benchmarking |cslug| inside **directory**.
+
+    Returns:
+        cslug.CSlug: The compiled and loaded slug.
+
+    """
+    from cslug import CSlug
+    slug = CSlug(
+        Path(directory) / "bench", io.StringIO(SOURCE), vectorize="scale",
+        hold_gil=["nothing_held", "add_held"], soa="Point")
+    slug.make()
+    slug.dll
+    return slug
+
+
+def time_per_call(function, number, repeat):
+    """Time **function**, returning the best average time per call, in
+    nanoseconds, of **repeat** rounds of **number** calls."""
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter_ns()
+        for j in range(number):
+            function()
+        best = min(best, time.perf_counter_ns() - start)
+    return best / number
+
+
+def run(select=None, number=10000, repeat=7, slow_repeat=None):
+    """Run benchmarks.
+
+    Args:
+        select (list[str]):
+            Only run benchmarks whose name starts with any of these prefixes.
+            Defaults to running everything.
+        number (int):
+            How many calls to make per repeat for fast benchmarks.
+        repeat (int):
+            How many times to repeat each benchmark, keeping the fastest.
+        slow_repeat (int):
+            The number of repeats for slow benchmarks, such as compiling,
+            which only make one call per repeat. Defaults to **repeat**.
+
+    Returns:
+        dict: A json serializable mapping of ``"metadata"`` about the
+        environment the benchmarks were run in and ``"results"`` mapping each
+        benchmark's name to its time per call in nanoseconds.
+
+    """
+    if slow_repeat is None:
+        slow_repeat = repeat
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        slug = build(directory)
+        try:
+            for (name, (setup, _number)) in BENCHMARKS.items():
+                if select and not any(map(name.startswith, select)):
+                    continue
+                function = setup(slug)
+                if inspect.isgenerator(function):
+                    cleanup = function
+                    function = next(cleanup)
+                else:
+                    cleanup = None
+                if _number is None:
+                    function()  # Warm up.
+                    results[name] = time_per_call(function, number, repeat)
+                else:
+                    results[name] = time_per_call(function, _number,
+                                                  slow_repeat)
+                if cleanup is not None:
+                    cleanup.close()
+        finally:
+            # Windows won't delete an open library.
+            slug.close()
+    return {"metadata": metadata(), "results": results}
+
+
+def metadata():
+    """Describe the environment benchmarks are running in."""
+    from cslug import cc, cc_version
+    cc_name, version = cc_version(cc())
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "compiler": "{} {}".format(cc_name, ".".join(map(str, version))),
+        "commit": _git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def _git_commit():
+    """Get the git commit hash of cslug's source, if it's in a repository."""
+    from subprocess import run, PIPE, DEVNULL
+    try:
+        p = run(["git", "rev-parse", "HEAD"], stdout=PIPE, stderr=DEVNULL,
+                cwd=str(Path(__file__).parent), universal_newlines=True)
+    except OSError:  # pragma: no cover
+        return None
+    return p.stdout.strip() if p.returncode == 0 else None
+
+
+def compare(old, new):
+    """Tabulate two sets of results from `run` side by side.
+
+    Returns:
+        str: A table of times and the ratio **new** / **old** for each
+        benchmark.
+
+    """
+    old, new = old["results"], new["results"]
+    names = list(new) + [i for i in old if i not in new]
+    width = max(map(len, names), default=0)
+    lines = [
+        "{:<{}}  {:>12}  {:>12}  {:>6}".format("", width, "old (ns)",
+                                               "new (ns)", "ratio")
+    ]
+    for name in names:
+        _old, _new = old.get(name), new.get(name)
+        ratio = "{:.2f}".format(_new / _old) if _old and _new else ""
+        lines.append("{:<{}}  {:>12}  {:>12}  {:>6}".format(
+            name, width, _format_time(_old), _format_time(_new), ratio))
+    return "\n".join(lines)
+
+
+def tabulate(results):
+    """Format the output of `run` as a human readable table."""
+    results = results["results"]
+    width = max(map(len, results), default=0)
+    return "\n".join("{:<{}}  {:>12}".format(name, width, _format_time(t))
+                     for (name, t) in results.items())
+
+
+def _format_time(ns):
+    if ns is None:
+        return "-"
+    if ns >= 1e6:
+        return "{:,.0f}".format(ns)
+    return "{:.1f}".format(ns)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m cslug.bench",
+        description="Time the overhead of calling C code through cslug.")
+    parser.add_argument(
+        "select", nargs="*",
+        help="Only run benchmarks starting with these names "
+        "e.g. 'ptr' or 'struct/by-value'.")
+    parser.add_argument("-o", "--output",
+                        help="Write the results as json to this file.")
+    parser.add_argument(
+        "-c", "--compare", help="A json file written by a previous run to "
+        "compare against.")
+    parser.add_argument("-n", "--number", type=int, default=10000,
+                        help="Calls per repeat for fast benchmarks.")
+    parser.add_argument("-r", "--repeat", type=int, default=7,
+                        help="Repeats per benchmark. The fastest is kept.")
+    parser.add_argument("-l", "--list", action="store_true",
+                        help="List available benchmarks and exit.")
+    options = parser.parse_args(args)
+
+    if options.list:
+        print(*BENCHMARKS, sep="\n")
+        return
+
+    results = run(options.select, options.number, options.repeat)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if options.compare:
+        with open(options.compare) as f:
+            print(compare(json.load(f), results))
+    else:
+        print(tabulate(results))
+
+
+if __name__ == "__main__":
+    main()
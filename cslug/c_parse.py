@@ -11,9 +11,11 @@
 """
 
 import re as _re
+import ast as _ast
+import operator as _operator
 import ctypes as _ctypes
+from bisect import bisect_left as _bisect_left
 import enum as _enum
-from builtins import filter as _filter
 
 
 class TokenType(_enum.IntFlag):
@@ -63,58 +65,211 @@ def filter(text, token_types):
     return "".join(keep)
 
 
+# Matches a preprocessor line marker such as ``# 12 "file.c" 1 3``. gcc, clang
+# and tcc all use this form in ``-E`` output although other compilers may spell
+# it ``#line 12 "file.c"``.
+_line_marker_re = _re.compile(r'#\s*(?:line\s+)?(\d+)\s+"((?:[^"\\]|\\.)*)"'
+                              r'((?:\s+\d+)*)\s*')
+
+
+def split_line_markers(text):
+    """Split preprocessed source code into chunks by which file each chunk
+    originally came from.
+
+    Args:
+        text (str):
+            The output of a C preprocessor (i.e. ``$CC -E``).
+    Returns:
+        list[tuple[str, int, tuple[int], str]]:
+            A list of ``(filename, line_number, flags, code)`` quadruplets.
+
+    The **line_number** is the line in **filename** on which **code** starts.
+    **flags** are any numeric flags following the filename in the marker. Of
+    these, ``3`` means that the code came from a system header.
+    There is one chunk per line marker, even if the chunk is empty, plus one
+    for any code before the first marker which is attributed to the filename
+    ``''``.
+
+    """
+    chunks = []
+    filename, line, flags = "", 1, ()
+    lines = []
+    for row in text.split("\n"):
+        match = _line_marker_re.fullmatch(row) if row[:1] == "#" else None
+        if match is None:
+            lines.append(row)
+            continue
+        if filename or lines:
+            chunks.append((filename, line, flags, "\n".join(lines)))
+        lines = []
+        line = int(match.group(1))
+        filename = _re.sub(r"\\(.)", r"\1", match.group(2))
+        flags = tuple(map(int, match.group(3).split()))
+    chunks.append((filename, line, flags, "\n".join(lines)))
+    return chunks
+
+
 RESERVED = {
     "if", "else", "switch", "case", "default", "break", "for", "while", "do",
     "goto", "return", "continue", "enum"
 }
 
-# Matches a function declaration such as ``void foo(int x)``
-_function_re = _re.compile(r"""
-# Return type:
-(\w+) # initial type word.
-(?=[ *]) # Non-consuming space or a * to split 1st type from whatever's next
-[\w* ]+ # more type words or * symbols (or at least a space)
-# Function name:
-\w+
-# Possible whitespace:
-\s*
-# Parameters. Lazily, just look for brackets. Detailed subparsing happens later.
-\([^=;+{]*\)
-# Either a ; for a prototype or a { for a true definition.
-(?=\s*([;{]))
-""", flags=_re.MULTILINE | _re.VERBOSE) # yapf: disable
+# Single character class patterns used by the scanners below. Being a single
+# quantified character class, none of these can backtrack so they always run in
+# time proportional to the length of whatever they match.
+_whitespace_re = _re.compile(r"\s*")
+_word_re = _re.compile(r"\w*")
+_stop_re = _re.compile(r"[=;+{]")
+
+
+def _is_word(character):
+    """Equivalent to ``re.fullmatch(r"\\w", character)``."""
+    return character.isalnum() or character == "_"
+
+
+def _scan_functions(text):
+    """Find function declarations such as ``void foo(int x)``.
+
+    Yields:
+        (str, str, str):
+            The declaration (minus the trailing ``;`` or ``{``), the first word
+            of its return type and whichever of ``;`` (a prototype) or ``{`` (a
+            true definition) follows it.
+
+    A declaration is a return type and a name (words or ``*``\\ s separated by
+    spaces on a single line), optional whitespace, then a parenthesised
+    parameter list which contains none of ``=;+{`` and is followed by
+    whitespace then either a ``;`` or a ``{``. Parameters are not inspected
+    here - that is left to `parse_function`.
+
+    This scanner is guaranteed to run in time linear to the length of
+    **text**. Every ``(`` is visited once. From each ``(``, the scanner reads
+    backwards over the return type and name, which consist only of
+    characters that can't contain another ``(``, so no character is read
+    backwards more than once. Reading forwards to the end of the parameters
+    stops at the next of ``=;+{``, the position of which is remembered and
+    reused by any other ``(`` found before it.
+    """
+    # The position of the next ``=;+{`` and of the ``)`` (if any) preceding it
+    # with only whitespace in between.
+    stop = close = -1
+    position = 0
+    while True:
+        bracket = text.find("(", position)
+        if bracket == -1:
+            return
+        position = bracket + 1
+
+        # Skip backwards over whitespace to the end of the function name.
+        name_end = bracket
+        while name_end and text[name_end - 1].isspace():
+            name_end -= 1
+        if not name_end or not _is_word(text[name_end - 1]):
+            continue
+
+        # Skip backwards over words, spaces and *s (but not newlines or tabs).
+        start = name_end
+        while start and (_is_word(text[start - 1]) or text[start - 1] in " *"):
+            start -= 1
+        # The declaration starts at the first word.
+        while not _is_word(text[start]):
+            start += 1
+        # Which must be followed by a space or a * to separate it from the name.
+        first_word_end = _word_re.match(text, start).end()
+        if first_word_end >= name_end or text[first_word_end] not in " *":
+            continue
+
+        # Find the first ``=;+{`` after the ``(``.
+        if stop < bracket:
+            match = _stop_re.search(text, bracket)
+            if match is None:
+                # No more declarations can possibly be terminated.
+                return
+            stop = match.start()
+            close = stop
+            while close > bracket and text[close - 1].isspace():
+                close -= 1
+            close -= 1
+        if text[stop] not in ";{" or close <= bracket or text[close] != ")":
+            continue
+
+        position = close + 1
+        yield text[start:position], text[start:first_word_end], text[stop]
+
+
+def strip_directives(text):
+    """Blank out preprocessor directives such as :c:`#define X(a) (a)`,
+    including any which continue onto the next line(s) using a trailing ``\\``.
+
+    Line numbering is preserved.
+    """
+    lines = text.split("\n")
+    continued = False
+    for (i, line) in enumerate(lines):
+        if continued or line.lstrip()[:1] == "#":
+            continued = line.endswith("\\")
+            lines[i] = ""
+    return "\n".join(lines)
 
 
 def search_functions(text, definitions=True, prototypes=False):
-    text = filter(text, TokenType.CODE)
-    for match in _function_re.finditer(text):
+    text = strip_directives(filter(text, TokenType.CODE))
+    for (declaration, first_word, terminator) in _scan_functions(text):
 
-        if match.group(1) in RESERVED:
+        if first_word in RESERVED:
             continue
 
-        if definitions and match.group(2) == "{":
-            yield match.group()
-        if prototypes and match.group(2) == ";":
-            yield match.group()
+        if definitions and terminator == "{":
+            yield declaration
+        if prototypes and terminator == ";":
+            yield declaration
 
 
-# Matches the same as ``_function_re`` but splits a prototype into a return
-# type/name and a separate type/name for each parameter.
-_parameter_re = _re.compile(r"([^(]*)\(([^)]*)\)\s*")
+# Splits a declaration found by ``_scan_functions()`` into a return type/name
+# and its parameters. Parameters may contain brackets if they are function
+# pointers.
+_parameter_re = _re.compile(r"([^(]*)\((.*)\)\s*", _re.DOTALL)
 
 
-def parse_function(string, typedefs=None):
-    """Parse a function declaration into its name, its return type and its
-    arguments."""
+def split_function(string):
+    """Split a function declaration into its return type and name and a list
+    of its parameters.
+
+    ::
+
+        >>> split_function("int foo(float * x, void * y)")
+        ('int foo', ['float * x', 'void * y'])
+
+    """
     try:
         res, args = _parameter_re.fullmatch(string).groups()
     except AttributeError:
         raise ValueError("Function '{}' not understood.".format(string))
-    args = list(_filter(None, _re.split(r"\s*,\s*", args)))
-    args = [i for i in args if not _re.fullmatch(r"\s*void\s*", i)]
+    if args.count("(") != args.count(")"):
+        raise ValueError("Function '{}' not understood.".format(string))
+    return res, _split_parameters(args)
+
+
+def _split_parameters(string):
+    """Split a comma separated parameter list, ignoring commas inside any
+    function pointer parameters' own parameter lists."""
+    args = [
+        string[start:end].strip()
+        for (start, end) in _split_top_level(string, 0, len(string))
+    ]
+    return [i for i in args if i and not _re.fullmatch(r"void", i)]
+
+
+def parse_function(string, typedefs=None):
+    """Parse a function declaration into its name, its return type and its
+    arguments."""
+    res, args = split_function(string)
     a, b, name = parse_parameter(res, typedefs=typedefs)
     res = _choose_ctype(a, b, name)
-    args = [_choose_ctype(*parse_parameter(i, typedefs=typedefs)) for i in args]
+    args = [
+        _choose_argument_ctype(*parse_parameter(i, typedefs=typedefs))
+        for i in args
+    ]
     return name, res, args
 
 
@@ -125,6 +280,32 @@ def parse_functions(text, typedefs=None, definitions=True, prototypes=False):
         yield name, args
 
 
+# Matches a function pointer typedef statement such as
+# ``typedef int (*comparator)(const void *, const void *)``.
+_callback_typedef_re = _re.compile(
+    r"\s*typedef\s+([^(]*)\(\s*\*\s*(\w+)\s*\)\s*\((.*)\)\s*", _re.DOTALL)
+
+
+def parse_callbacks(text, typedefs=None):
+    """Find function pointer types defined using
+    :c:`typedef return_type (*name)(parameters);`.
+
+    Yields:
+        (str, list): Each type's name and its :py:`[return_type,
+        parameter_types]` as returned by `parse_callback`.
+
+    """
+    code, _ = _blank(text)
+    for (start, end) in _scan_statements(code):
+        match = _callback_typedef_re.fullmatch(code, start, end)
+        if match is None:
+            continue
+        (return_type, name, parameters) = match.groups()
+        if parameters.count("(") != parameters.count(")"):
+            continue
+        yield name, list(parse_callback(return_type, parameters, typedefs))
+
+
 # --- Some weird Windows-only typedefs ---
 
 # On second thought, there are 100s of these. I'm not adding them all...
@@ -157,7 +338,68 @@ def parse_parameter(string, typedefs=None):
     The **pointers** output is a count of how many layers of pointer referencing
     cover the raw value. i.e. How many ``*``\\ s or ``[]``\\ s.
 
+    A function pointer such as ``int (*cmp)(int, int)`` has, in place of a
+    type name, a :py:`(return_type, parameter_types)` tuple as returned by
+    `parse_callback`.
+
+    """
+    type, pointer, name = _parse_parameter(string, typedefs)
+
+    if type is None and not pointer \
+            and "void" not in _re.findall(r"\w+", string):
+        from warnings import warn
+        from cslug.exceptions import TypeParseWarning
+        warn("Unrecognised type '{}'. Type will default to void pointer."
+             .format(string), TypeParseWarning) # yapf: disable
+        type = "c_void_p"
+
+    if type is None:
+        # str None is less ugly to serialise.
+        type = "None"
+
+    return type, pointer, name
+
+
+# Matches a function pointer declaration such as ``int (*cmp)(int, int)``,
+# capturing its return type, name and parameters.
+_function_pointer_re = _re.compile(r"([^(]*)\(\s*\*\s*(\w*)\s*\)\s*\((.*)\)\s*",
+                                   _re.DOTALL)
+
+
+def parse_callback(return_type, parameters, typedefs=None):
+    """Parse the return type and parameters of a function pointer type.
+
+    Args:
+        return_type (str):
+            The return type, such as ``const char *``.
+        parameters (str):
+            The comma separated parameters (without the enclosing brackets).
+        typedefs (dict):
+            Custom type names.
+    Returns:
+        tuple: ``(return_ctype, (parameter_ctype, ...))``
+
+    All types are `ctypes` attribute names or custom type names as in
+    `parse_function` except that pointers are never typed pointers - a C
+    function calling back into Python gives it raw addresses.
+
     """
+    res = _choose_ctype(*parse_parameter(return_type, typedefs))
+    args = tuple(
+        _choose_ctype(*parse_parameter(i, typedefs))
+        for i in _split_parameters(parameters))
+    return res, args
+
+
+def _parse_parameter(string, typedefs=None):
+    """The guts of `parse_parameter` without the defaulting of unrecognised
+    types. An unrecognised type is returned as None."""
+    match = _function_pointer_re.fullmatch(string)
+    if match:
+        (return_type, name, parameters) = match.groups()
+        return parse_callback(return_type, parameters, typedefs), 0, \
+            name or None
+
     pointer = 0
     type_words = []
     name = None
@@ -228,17 +470,6 @@ def parse_parameter(string, typedefs=None):
     else:
         type = None
 
-    if type is None and not pointer and "void" not in type_words:
-        from warnings import warn
-        from cslug.exceptions import TypeParseWarning
-        warn("Unrecognised type '{}'. Type will default to void pointer."
-             .format(string), TypeParseWarning) # yapf: disable
-        type = "c_void_p"
-
-    if type is None:
-        # str None is less ugly to serialise.
-        type = "None"
-
     return type, pointer, name
 
 
@@ -272,8 +503,163 @@ def _choose_ctype(type, pointer, word):
     return type if type is not None else "None"
 
 
-_struct_re = _re.compile(r"\s*typedef\s+struct(?:\s+\w+)?\s*"
-                         r"{([^}]*)}\s*(\w+)\s*;")
+# ctypes types which a typed pointer may point to. These are all the numeric
+# types, excluding long double which has no buffer protocol equivalent.
+_TYPED_POINTER_TYPES = {
+    name for (name, type) in vars(_ctypes).items() if name.startswith("c_")
+    and getattr(type, "_type_", None) in tuple("bBhHiIlLqQfd?")
+}  # yapf: disable
+
+
+def _choose_argument_ctype(type, pointer, word):
+    """
+    Select a ctypes type to assign a function parameter.
+
+    This is the same as `_choose_ctype()` except that pointers to numeric types
+    become a typed pointer, written as the name of its item type followed by a
+    ``*`` e.g. ``c_double*``.
+
+    """
+    if pointer == 1 and type in _TYPED_POINTER_TYPES:
+        return type + "*"
+    return _choose_ctype(type, pointer, word)
+
+
+# Parameter names which mark a parameter as either the length of another or as
+# an output. See `parse_array_parameters()`.
+_length_name_re = _re.compile(r"len_(\w+)|(\w+)_len")
+_output_name_re = _re.compile(r"out(?:_\w+)?")
+
+# Integer types which may be used for an array length.
+_LENGTH_TYPES = {
+    name for name in _TYPED_POINTER_TYPES
+    if getattr(_ctypes, name)._type_ in "bBhHiIlLqQ"
+}  # yapf: disable
+
+
+def parse_array_parameters(string, typedefs=None):
+    """Find array lengths and output parameters in a function declaration.
+
+    Args:
+        string (str):
+            A function declaration such as those found by `search_functions`.
+        typedefs (dict):
+            Custom type names.
+    Returns:
+        (str, list, list):
+            The function's name; a list of ``[length, array]`` pairs of the
+            indices of each length parameter and the array it is the length of;
+            and a list of the indices of output parameters.
+
+    A length is an integer parameter named ``len_x`` or ``x_len`` where ``x``
+    is the name of a pointer to a number parameter. An output is a
+    non-:c:`const` pointer to a number whose name is ``out`` or starts with
+    ``out_``. For example, for::
+
+        void range_of(double * values, int len_values, double * out_min,
+                      double * out_max)
+
+    this returns :py:`("range_of", [[1, 0]], [2, 3])`.
+
+    """
+    res, args = split_function(string)
+    name = _parse_parameter(res, typedefs)[2]
+
+    parameters = [_parse_parameter(i, typedefs) for i in args]
+    arrays = {
+        arg_name: i
+        for (i, (type, pointer, arg_name)) in enumerate(parameters)
+        if pointer == 1 and type in _TYPED_POINTER_TYPES
+    }  # yapf: disable
+
+    lengths = []
+    outputs = []
+    for (i, (type, pointer, arg_name)) in enumerate(parameters):
+        if arg_name is None:
+            continue
+        match = _length_name_re.fullmatch(arg_name)
+        if match and not pointer and type in _LENGTH_TYPES:
+            array = match.group(1) or match.group(2)
+            if array in arrays:
+                lengths.append([i, arrays[array]])
+                continue
+        if _output_name_re.fullmatch(arg_name) and arrays.get(arg_name) == i \
+                and "const" not in _re.findall(r"\w+", args[i]):
+            outputs.append(i)
+
+    # An array with a length is an input, not an output.
+    outputs = [i for i in outputs if i not in {j for (_, j) in lengths}]
+    return name, lengths, outputs
+
+
+def parse_array_functions(text, typedefs=None, definitions=True,
+                          prototypes=False):
+    """Apply `parse_array_parameters` to every function in **text**, yielding
+    only those with any array lengths or outputs."""
+    for func in search_functions(text, definitions=definitions,
+                                 prototypes=prototypes):
+        name, lengths, outputs = parse_array_parameters(func, typedefs)
+        if lengths or outputs:
+            yield name, [lengths, outputs]
+
+
+def _scan_structs(text):
+    """Find structure definitions of the form
+    ``typedef struct [tag] {fields} name;``.
+
+    Yields:
+        (str, str): The body (the text between the ``{}``) and name of each
+        structure.
+
+    Like `_scan_functions`, this is guaranteed to run in linear time. Each
+    ``typedef`` is visited once and reads forwards only over the whitespace and
+    words before the ``{``, which can't overlap with those of the next
+    ``typedef``. The matching ``}`` and whatever follows it are looked up only
+    once each and shared between any ``typedef``\\ s within the same pair of
+    ``{}``\\ s.
+    """
+    # Parsed ``} name;`` suffixes, keyed by the position of the ``}``.
+    suffixes = {}
+    closing = -1
+    position = 0
+    while True:
+        start = text.find("typedef", position)
+        if start == -1:
+            return
+        position = start + 1
+
+        # typedef<whitespace>struct
+        i = start + len("typedef")
+        j = _whitespace_re.match(text, i).end()
+        if j == i or not text.startswith("struct", j):
+            continue
+        # An optional tag name.
+        i = j + len("struct")
+        j = _whitespace_re.match(text, i).end()
+        if j > i:
+            j = _whitespace_re.match(text, _word_re.match(text, j).end()).end()
+        if text[j:j + 1] != "{":
+            continue
+
+        # Find the closing }. Structures containing structures aren't supported.
+        if closing <= j:
+            closing = text.find("}", j)
+            if closing == -1:
+                return
+        # And the name and ; after it.
+        if closing not in suffixes:
+            i = _whitespace_re.match(text, closing + 1).end()
+            k = _word_re.match(text, i).end()
+            end = _whitespace_re.match(text, k).end()
+            if k > i and text[end:end + 1] == ";":
+                suffixes[closing] = text[i:k], end + 1
+            else:
+                suffixes[closing] = None
+        if suffixes[closing] is None:
+            continue
+
+        name, position = suffixes[closing]
+        yield text[j + 1:closing], name
 
 
 def parse_struct(text):
@@ -282,7 +668,14 @@ def parse_struct(text):
     :param text:
     :return:
     """
-    params_str, name = _struct_re.match(text).groups()
+    try:
+        return _parse_struct_body(*next(_scan_structs(text)))
+    except StopIteration:
+        raise ValueError("Structure '{}' not understood.".format(text)) \
+            from None
+
+
+def _parse_struct_body(params_str, name):
     params = []
     param: str
     for param in params_str.split(";"):
@@ -313,4 +706,537 @@ def parse_structs(text):
     :return: Iterable of (name, parameters) pairs as given by ``parse_struct``.
 
     """
-    return (parse_struct(i.group(0)) for i in _struct_re.finditer(text))
+    return (_parse_struct_body(*i) for i in _scan_structs(text))
+
+
+def _scan_enums(text):
+    """Find enumeration definitions.
+
+    Yields:
+        (str, str):
+            The body (the text between the ``{}``) and name of each
+            enumeration. For :c:`typedef enum tag {...} name;` the name is
+            ``name``. For :c:`enum tag {...};` it is ``tag``. Anonymous enums
+            have a name of None.
+
+    Runs in linear time for the same reasons as `_scan_structs`.
+    """
+    closing = -1
+    position = 0
+    while True:
+        start = text.find("enum", position)
+        if start == -1:
+            return
+        position = start + 1
+        i = start + len("enum")
+        if start and _is_word(text[start - 1]) or _is_word(text[i:i + 1]):
+            # Part of a longer word.
+            continue
+
+        # An optional tag name.
+        j = _whitespace_re.match(text, i).end()
+        k = _word_re.match(text, j).end()
+        tag = text[j:k] or None
+        if tag and j == i:
+            continue
+        j = _whitespace_re.match(text, k).end()
+        if text[j:j + 1] != "{":
+            continue
+
+        if closing <= j:
+            closing = text.find("}", j)
+            if closing == -1:
+                return
+        body = text[j + 1:closing]
+
+        # Either a typedef-ed name or a variable name then a ;.
+        i = _whitespace_re.match(text, closing + 1).end()
+        k = _word_re.match(text, i).end()
+        end = _whitespace_re.match(text, k).end()
+        if text[end:end + 1] != ";":
+            continue
+        position = end + 1
+
+        # Look back for a typedef keyword without copying everything before.
+        before = start
+        while before and text[before - 1].isspace():
+            before -= 1
+        if before >= 7 and text[before - 7:before] == "typedef" \
+                and not (before > 7 and _is_word(text[before - 8])):
+            yield body, text[i:k] or tag
+        else:
+            yield body, tag
+
+
+def parse_enums(text, constants=None):
+    """Search for and evaluate C enumerations in a block of text.
+
+    Args:
+        text (str):
+            C source code.
+        constants (dict):
+            Previously parsed constants which enum values may refer to.
+    Yields:
+        (str or None, list[tuple[str, int]]):
+            The name (None for anonymous enums) and ``(member, value)`` pairs
+            of each enumeration.
+
+    Enumerations whose values can't be evaluated by `evaluate` are skipped.
+
+    """
+    namespace = dict(constants or {})
+    for (body, name) in _scan_enums(filter(text, TokenType.CODE)):
+        members = []
+        value = -1
+        for member in body.split(","):
+            key, equals, expression = member.partition("=")
+            key = key.strip()
+            if not key:
+                continue
+            if equals:
+                value = evaluate(expression, namespace)
+                if not isinstance(value, int):
+                    break
+            else:
+                value += 1
+            namespace[key] = value
+            members.append((key, value))
+        else:
+            yield name, members
+
+
+_define_re = _re.compile(r"[ \t]*#[ \t]*define[ \t]+(\w+)[ \t]+(.*)")
+
+
+def parse_defines(text, constants=None):
+    """Search for and evaluate :c:`#define`\\ s of numeric constants.
+
+    Args:
+        text (str):
+            C source code.
+        constants (dict):
+            Previously parsed constants which definitions may refer to.
+    Returns:
+        dict[str, int or float]:
+
+    Only object-like macros whose values are numeric expressions (see
+    `evaluate`) are included. Function-like macros, macros spread over multiple
+    lines and anything else are ignored.
+
+    """
+    namespace = dict(constants or {})
+    out = {}
+    for line in filter(text, TokenType.CODE).split("\n"):
+        match = _define_re.fullmatch(line)
+        if match is None or match.group(2).rstrip().endswith("\\"):
+            continue
+        value = evaluate(match.group(2), namespace)
+        if value is not None:
+            namespace[match.group(1)] = out[match.group(1)] = value
+    return out
+
+
+def _blank(text):
+    """Blank out comments, literals and preprocessor directives, replacing them
+    with spaces so that positions in the output still match those in **text**.
+
+    Returns:
+        (str, list[tuple[int, int]]):
+            The blanked code and the ``(start, end)`` of each literal.
+    """
+    out = []
+    literals = []
+    for (start, end, group) in lex(text):
+        chunk = text[start:end]
+        if group is TokenType.CODE:
+            out.append(chunk)
+            continue
+        if group is TokenType.LITERAL:
+            literals.append((start, end))
+        out.append(_re.sub(r"[^\n]", " ", chunk))
+
+    lines = "".join(out).split("\n")
+    continued = False
+    for (i, line) in enumerate(lines):
+        if continued or line.lstrip()[:1] == "#":
+            continued = line.endswith("\\")
+            lines[i] = " " * len(line)
+    return "\n".join(lines), literals
+
+
+_statement_re = _re.compile(r"[{};]")
+_extern_block_re = _re.compile(r"\s*extern\s*")
+
+
+def _scan_statements(code):
+    """Split blanked code into file scope statements, skipping over function
+    bodies.
+
+    Yields:
+        (int, int):
+            The start and end (the position of the terminating ``;``) of each
+            statement.
+
+    Braces belonging to anything other than a function body (initializers,
+    :c:`struct` definitions) are included in their statements.
+    An :c:`extern "C" {` block's braces are ignored.
+    """
+    depth = 0
+    start = 0
+    # Whether the current statement's first top level {} is a function body.
+    function = None
+    for match in _statement_re.finditer(code):
+        i = match.start()
+        character = code[i]
+        if character == "{":
+            if depth == 0 and function is None:
+                if _extern_block_re.fullmatch(code, start, i):
+                    start = i + 1
+                    continue
+                head = code[start:i]
+                function = "(" in head and "=" not in head
+            depth += 1
+        elif character == "}":
+            if depth == 0:
+                # The end of an extern "C" block.
+                start = i + 1
+                continue
+            depth -= 1
+            if depth == 0 and function:
+                start = i + 1
+                function = None
+        elif depth == 0:
+            yield start, i
+            start = i + 1
+            function = None
+
+
+_bracket_or_comma_re = _re.compile(r"[][(){},]")
+
+
+def _split_top_level(code, start, end):
+    """Split ``code[start:end]`` on any commas not inside brackets.
+
+    Returns:
+        list[tuple[int, int]]: The start and end of each part.
+    """
+    out = []
+    depth = 0
+    for match in _bracket_or_comma_re.finditer(code, start, end):
+        character = match.group()
+        if character in "([{":
+            depth += 1
+        elif character in ")]}":
+            depth -= 1
+        elif depth == 0:
+            out.append((start, match.start()))
+            start = match.end()
+    out.append((start, end))
+    return out
+
+
+# Any of these keywords mean that a declaration either doesn't define a new
+# variable or defines one which isn't accessible from outside the library.
+_NOT_GLOBAL = {
+    "typedef", "extern", "static", "_Thread_local", "thread_local", "__thread",
+    "inline"
+}
+
+_escape_re = _re.compile(
+    r"\\(?:u([0-9a-fA-F]{4})|U([0-9a-fA-F]{8})"
+    r"|[0-7]{1,3}|x[0-9a-fA-F]+|.)", _re.DOTALL)
+
+
+def _string_length(literal, width):
+    """Count the characters in a C string literal (including its quotes), in
+    units of a **width** byte character type, excluding the NULL terminator."""
+    def _unescape(match):
+        code_point = match.group(1) or match.group(2)
+        if code_point:
+            return chr(int(code_point, 16))
+        # Any other escape sequence is a single byte/unit.
+        return "\0"
+
+    string = _escape_re.sub(_unescape, literal[1:-1])
+    if width == 1:
+        return len(string.encode("utf-8", "surrogatepass"))
+    if width == 2:
+        return len(string.encode("utf-16-le", "surrogatepass")) // 2
+    return len(string)
+
+
+def parse_globals(text, typedefs=None, constants=None):
+    """Search for global variable definitions.
+
+    Args:
+        text (str):
+            C source code.
+        typedefs (dict):
+            Names of user defined types (i.e. structs and enums).
+        constants (dict):
+            Previously parsed constants which array sizes may refer to.
+    Yields:
+        (str, str, list[int]):
+            The name, type and array dimensions (empty if not an array) of each
+            global variable.
+
+    Variables which are :c:`static`, :c:`extern` or of a type which can't be
+    represented by `ctypes` are skipped. Unsized arrays such as
+    :c:`int x[] = {1, 2, 3};` or :c:`char x[] = "hello";` have their lengths
+    inferred from their initializers.
+
+    """
+    code, literals = _blank(text)
+    literal_starts = [start for (start, end) in literals]
+
+    for (start, end) in _scan_statements(code):
+        declarators = _split_top_level(code, start, end)
+        base = None
+        for (i, j) in declarators:
+            declaration, equals, _ = code[i:j].partition("=")
+            initializer = i + len(declaration) + 1
+            if "(" in declaration or "{" in declaration:
+                # Function prototypes, function pointers and struct/enum
+                # definitions.
+                break
+            words = _re.findall(r"\w+", declaration)
+            if not words or _NOT_GLOBAL.intersection(words):
+                break
+            if base is None:
+                # Subsequent declarators in ``int a, *b, c[3];`` inherit the
+                # type from the first.
+                base = " ".join(words[:-1]) + " "
+            else:
+                declaration = base + declaration
+
+            dimensions = _re.findall(r"\[([^]]*)]", declaration)
+            declaration = _re.sub(r"\[[^]]*]", " ", declaration)
+            type, pointer, name = _parse_parameter(declaration, typedefs)
+            if name is None:
+                continue
+            if pointer:
+                type = _choose_ctype(type, pointer, name)
+            elif type is None:
+                continue
+
+            shape = []
+            for dimension in dimensions:
+                if dimension.strip():
+                    size = evaluate(dimension, constants)
+                elif not shape and equals:
+                    size = _initializer_length(code, initializer, j, text,
+                                               literals, literal_starts, type,
+                                               constants, dimensions)
+                else:
+                    size = None
+                if not isinstance(size, int) or size <= 0:
+                    break
+                shape.append(size)
+            else:
+                yield name, type, shape
+
+
+def _initializer_length(code, start, end, text, literals, literal_starts, type,
+                        constants, dimensions):
+    """Infer the length of an unsized array from its initializer
+    ``code[start:end]``."""
+    body = code[start:end].strip()
+
+    if body[:1] == "{" and body[-1:] == "}":
+        inner_start = code.index("{", start) + 1
+        inner_end = code.rindex("}", start, end)
+        elements = []
+        for (i, j) in _split_top_level(code, inner_start, inner_end):
+            element = code[i:j].strip()
+            index = _bisect_left(literal_starts, i)
+            if not element and index < len(literals) and literals[index][0] < j:
+                # A string or character literal.
+                element = text[literals[index][0]]
+            elements.append(element)
+        if elements and not elements[-1]:
+            # A trailing comma.
+            elements.pop()
+        if any(i[:1] in "[." or not i for i in elements):
+            # Designated initializers.
+            return None
+        count = len(elements)
+        if len(dimensions) > 1 and not all(i[:1] == "{" for i in elements):
+            # Brace elision i.e. ``int x[][2] = {1, 2, 3, 4};``.
+            inner = 1
+            for dimension in dimensions[1:]:
+                inner *= evaluate(dimension, constants) or 0
+            if not inner:
+                return None
+            count = -(-count // inner)
+        return count
+
+    # String literal(s), possibly with an encoding prefix.
+    if not _re.fullmatch(r"[\sLuU8]*", body):
+        return None
+    width = _ctypes.sizeof(getattr(_ctypes, type, _ctypes.c_char))
+    length = None
+    for index in range(_bisect_left(literal_starts, start), len(literals)):
+        (i, j) = literals[index]
+        if i >= end:
+            break
+        if text[i] != '"':
+            return None
+        length = (length or 0) + _string_length(text[i:j], width)
+    # Add one for the NULL terminator.
+    return None if length is None else length + 1
+
+
+_expression_token_re = _re.compile(r"""\s*(?:
+(0[xX][0-9a-fA-F]+|0[bB][01]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)([uUlLfF]*)
+|([A-Za-z_]\w*)
+|(<<|>>|[-+*/%&|^~()])
+)""", _re.VERBOSE)  # yapf: disable
+
+
+def evaluate(expression, constants=None):
+    """Evaluate a simple C constant expression such as ``(1 << 4) | 0x0Fu``.
+
+    Args:
+        expression (str):
+            The C expression.
+        constants (dict):
+            Values for any names used in **expression**.
+    Returns:
+        int or float or None:
+            The value or None if **expression** isn't a simple numeric
+            expression.
+
+    Supported are numeric literals (including hexadecimal, binary and octal
+    integers and any ``uUlLfF`` suffixes), names in **constants**, parentheses,
+    unary ``+-~`` and binary ``+-*/%<<>>&|^``. Integer division and remainders
+    follow C's round-towards-zero rules. Unsigned arithmetic wraps around to
+    the width of its type so that, for example, ``~0u`` is ``0xFFFFFFFF``.
+
+    """
+    constants = constants or {}
+
+    # Convert to the Python equivalent.
+    python = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _expression_token_re.match(expression, position)
+        if match is None:
+            return
+        position = match.end()
+        number, suffix, name, operator = match.groups()
+        if number is not None:
+            try:
+                if _re.fullmatch(r"0[xXbB].*|\d+", number):
+                    value = int(
+                        number, 0 if number[1:2].isalpha() else
+                        8 if number[0] == "0" else 10)
+                    bits = _unsigned_bits(value, suffix.lower(),
+                                          number[0] != "0" or value == 0)
+                    # Mark unsigned literals as a call to be picked up by
+                    # _evaluate().
+                    python.append(f"_u{bits}({value})" if bits else repr(value))
+                else:
+                    python.append(repr(float(number)))
+            except ValueError:
+                # E.g. 08 - not a valid octal integer.
+                return
+        elif name is not None:
+            if name not in constants:
+                return
+            python.append(repr(constants[name]))
+        else:
+            python.append(operator)
+    if not python:
+        return
+
+    try:
+        tree = _ast.parse(" ".join(python), mode="eval").body
+        return _evaluate(tree)[0]
+    except (SyntaxError, ArithmeticError, ValueError, TypeError, MemoryError):
+        return
+
+
+def _unsigned_bits(value, suffix, decimal):
+    """Get the width of the unsigned type C gives an integer literal or None if
+    the literal is signed.
+
+    Like C, the first of ``int``, ``long`` and ``long long`` (starting from
+    the one given by the ``l`` suffixes) which can hold the value is used.
+    Hexadecimal and octal literals may also be unsigned without a ``u``.
+
+    """
+    unsigned = "u" in suffix
+    sizes = [_ctypes.c_int, _ctypes.c_long, _ctypes.c_longlong]
+    for type in sizes[suffix.count("l"):]:
+        bits = 8 * _ctypes.sizeof(type)
+        if not unsigned and value < 1 << (bits - 1):
+            return None
+        if (unsigned or not decimal) and value < 1 << bits:
+            return bits
+    return None
+
+
+# Refuse to evaluate shifts by this many bits or more.
+_MAX_SHIFT = 1024
+
+
+def _evaluate(node):
+    """Evaluate a parsed expression, returning its value and, for unsigned
+    integers, the width of its type in bits."""
+    if isinstance(node, _ast.Constant) and type(node.value) in (int, float):
+        return node.value, None
+    if isinstance(node, _ast.Call) and isinstance(node.func, _ast.Name):
+        # An unsigned literal written as _u32(value).
+        return node.args[0].value, int(node.func.id[2:])
+    if isinstance(node, _ast.UnaryOp):
+        operand, bits = _evaluate(node.operand)
+        return _wrap({
+            _ast.USub: _operator.neg,
+            _ast.UAdd: _operator.pos,
+            _ast.Invert: _operator.invert,
+        }[type(node.op)](operand), bits), bits
+    if isinstance(node, _ast.BinOp):
+        (left, left_bits) = _evaluate(node.left)
+        (right, right_bits) = _evaluate(node.right)
+        integers = isinstance(left, int) and isinstance(right, int)
+        if not integers:
+            bits = None
+        elif isinstance(node.op, (_ast.LShift, _ast.RShift)):
+            # Shifts take the type of their left operand.
+            bits = left_bits
+            if right >= _MAX_SHIFT:
+                # Undefined behaviour in C anyway. Don't let Python attempt to
+                # allocate an enormous integer.
+                raise OverflowError(f"Shift by {right} bits.")
+        else:
+            # Otherwise, mixing signed and unsigned gives unsigned.
+            bits = max(left_bits or 0, right_bits or 0) or None
+            right = _wrap(right, bits)
+        left = _wrap(left, bits)
+        if isinstance(node.op, (_ast.Div, _ast.Mod)) and integers:
+            # C rounds towards zero whereas Python rounds down.
+            quotient = abs(left) // abs(right)
+            if (left < 0) != (right < 0):
+                quotient = -quotient
+            if isinstance(node.op, _ast.Div):
+                return quotient, bits
+            return left - right * quotient, bits
+        return _wrap({
+            _ast.Add: _operator.add,
+            _ast.Sub: _operator.sub,
+            _ast.Mult: _operator.mul,
+            _ast.Div: _operator.truediv,
+            _ast.Mod: _operator.mod,
+            _ast.LShift: _operator.lshift,
+            _ast.RShift: _operator.rshift,
+            _ast.BitAnd: _operator.and_,
+            _ast.BitOr: _operator.or_,
+            _ast.BitXor: _operator.xor,
+        }[type(node.op)](left, right), bits), bits
+    raise ValueError(node)
+
+
+def _wrap(value, bits):
+    """Apply unsigned integer wrap around if **bits** isn't None."""
+    return value if bits is None else value & ((1 << bits) - 1)
@@ -102,6 +102,19 @@ def __str__(self):
                f"Python. Are you running cslug in another Python console?"
 
 
+class WorkerCrashedError(Exception):
+    """A `cslug.ProcessPool` worker process died whilst running a function."""
+    def __str__(self):
+        import signal
+        name, exitcode = self.args
+        try:
+            reason = signal.Signals(-exitcode).name
+        except ValueError:
+            reason = f"exit code {exitcode}"
+        return f"A worker process died ({reason}) whilst running {name}(). " \
+               f"It has been replaced with a new worker."
+
+
 class BuildWarning(Warning):
     """Compiler issued a build warning."""
     pass
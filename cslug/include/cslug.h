@@ -0,0 +1,71 @@
+// Helpers for C code compiled by cslug.
+// This directory is automatically added to the include path so just use:
+//
+//     #include <cslug.h>
+
+#ifndef CSLUG_H
+#define CSLUG_H
+
+#include <stddef.h>
+#include <string.h>
+
+// A (possibly non-contiguous) multidimensional array. Get one in Python using
+// cslug.strided_ptr(). Shape and strides are arrays of length ndim. Strides
+// are in bytes and may be negative.
+typedef struct cslug_strided {
+  void * data;
+  ptrdiff_t ndim;
+  ptrdiff_t itemsize;
+  ptrdiff_t * shape;
+  ptrdiff_t * strides;
+} cslug_strided;
+
+// Get the address of the item at `index`, an array of ndim indices.
+static inline void * cslug_strided_at(const cslug_strided * array,
+                                      const ptrdiff_t * index) {
+  char * out = (char *) array->data;
+  for (ptrdiff_t i = 0; i < array->ndim; i++)
+    out += index[i] * array->strides[i];
+  return out;
+}
+
+// Get the total number of items.
+static inline ptrdiff_t cslug_strided_size(const cslug_strided * array) {
+  ptrdiff_t out = 1;
+  for (ptrdiff_t i = 0; i < array->ndim; i++) out *= array->shape[i];
+  return out;
+}
+
+// A buffer which C fills with items one at a time and which hands them to a
+// Python callback a whole block at a time. Get one in Python using
+// cslug.Batch(). Always call cslug_batch_flush() once finished to deliver the
+// last, partially filled, block.
+typedef struct cslug_batch {
+  void (*callback)(void * items, ptrdiff_t count);
+  void * items;
+  ptrdiff_t itemsize;
+  ptrdiff_t capacity;
+  ptrdiff_t count;
+} cslug_batch;
+
+// Pass all items so far to the callback and empty the buffer.
+static inline void cslug_batch_flush(cslug_batch * batch) {
+  if (batch->count) {
+    batch->callback(batch->items, batch->count);
+    batch->count = 0;
+  }
+}
+
+// Reserve space for the next item, flushing first if the buffer is full.
+// Write the item to the returned address.
+static inline void * cslug_batch_next(cslug_batch * batch) {
+  if (batch->count == batch->capacity) cslug_batch_flush(batch);
+  return (char *) batch->items + batch->itemsize * batch->count++;
+}
+
+// Copy an item of size itemsize into the buffer.
+static inline void cslug_batch_push(cslug_batch * batch, const void * item) {
+  memcpy(cslug_batch_next(batch), item, batch->itemsize);
+}
+
+#endif
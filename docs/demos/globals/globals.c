@@ -12,6 +12,8 @@ wchar_t a_string[] = L"Сәлам. Минем исемем Нед.";
 char contains_null[] = "This sentence has a \00 in the middle of it.";
 int len_contains_null = sizeof(contains_null) / sizeof(char);
 
+double an_array[2][3] = {{1, 2, 3}, {4, 5, 6}};
+
 int get_an_int() {
   return an_int;
 }
@@ -15,25 +15,22 @@
 slug.make()
 # yapf: disable
 
-an_int = ctypes.cast(slug.dll.an_int, ctypes.POINTER(ctypes.c_int)).contents
+an_int = slug.dll.an_int
 assert an_int.value == 42
 an_int.value += 5
 assert slug.dll.get_an_int() == an_int.value
 
-a_float = ctypes.cast(slug.dll.a_float, ctypes.POINTER(ctypes.c_float)).contents
-a_double = ctypes.cast(slug.dll.a_double, ctypes.POINTER(ctypes.c_double)).contents
-an_8_bit_int = ctypes.cast(slug.dll.an_8_bit_int, ctypes.POINTER(ctypes.c_int8)).contents
+assert isinstance(an_int, ctypes.c_int)
+assert isinstance(slug.dll.a_float, ctypes.c_float)
+assert isinstance(slug.dll.an_8_bit_int, ctypes.c_int8)
 
-assert abs(a_float.value - 1 / 3) < 1e-5
-assert abs(a_double.value - 1 / 3) < 1e-12
-assert an_8_bit_int.value == 43
-
-a_bytes_array = ctypes.cast(slug.dll.a_bytes_array, ctypes.c_char_p)
-a_string = ctypes.cast(slug.dll.a_string, ctypes.c_wchar_p)
+assert abs(slug.dll.a_float.value - 1 / 3) < 1e-5
+assert abs(slug.dll.a_double.value - 1 / 3) < 1e-12
+assert slug.dll.an_8_bit_int.value == 43
 
 from cslug import _cc
-assert a_bytes_array.value == b"Hello, my name is Ned."
-if a_string.value != "Сәлам. Минем исемем Нед.":
+assert slug.dll.a_bytes_array.value == b"Hello, my name is Ned."
+if slug.dll.a_string.value != "Сәлам. Минем исемем Нед.":
     cc_name, cc_version = _cc.cc_version()
     if cc_name in ("tcc", "pcc", "pgcc"):
         pass
@@ -41,22 +38,23 @@
         pass
     else:
         raise AssertionError(
-            f"{repr(a_string.value)} != \"Сәлам. Минем исемем Нед.\"")
-
+            f"{repr(slug.dll.a_string.value)} != \"Сәлам. Минем исемем Нед.\"")
 
-contains_null = ctypes.cast(slug.dll.contains_null, ctypes.c_char_p)
+contains_null = slug.dll.contains_null
 
 assert contains_null.value == b"This sentence has a "
+assert contains_null.raw == b"This sentence has a \x00 in the middle of it.\x00"
+assert len(contains_null) == slug.dll.len_contains_null.value
 
-# Extract the length (just a regular int).
-length = ctypes.cast(slug.dll.len_contains_null, ctypes.POINTER(ctypes.c_int)).contents.value
-
-# Get a raw void (untyped) pointer to our string.
-address = ctypes.cast(slug.dll.contains_null, ctypes.c_void_p).value
-
-# Interpret the pointer as an array of the correct length.
-contains_null = (ctypes.c_char * length).from_address(address)
+an_array = slug.dll.an_array
+assert an_array[1][2] == 6
+an_array[1][2] = 10
+view = memoryview(an_array).cast("B").cast("d", (2, 3))
+assert view.tolist() == [[1, 2, 3], [4, 5, 10]]
 
-assert contains_null.raw == b"This sentence has a \x00 in the middle of it.\x00"
+a_const_int = slug.dll.a_const_int
+assert a_const_int.value == 3
 
-a_const_int = ctypes.cast(slug.dll.a_const_int, ctypes.POINTER(ctypes.c_int)).contents
+# Bindings are recreated whenever the library is reloaded.
+slug.make()
+assert slug.dll.an_int.value == 42
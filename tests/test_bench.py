@@ -0,0 +1,42 @@
+import json
+
+from cslug import bench
+
+
+def test_run():
+    """Run every benchmark, just enough to check that none are broken."""
+    results = bench.run(number=2, repeat=1)
+    assert list(results["results"]) == list(bench.BENCHMARKS)
+    assert all(i > 0 for i in results["results"].values())
+    assert json.loads(json.dumps(results)) == results
+
+    table = bench.tabulate(results)
+    assert len(table.splitlines()) == len(bench.BENCHMARKS)
+
+
+def test_select():
+    results = bench.run(["call/", "struct/by"], number=2, repeat=1)
+    assert sorted(results["results"]) == \
+           ["call/double-args", "call/int-args", "call/int-args-hold-gil",
+            "call/no-args", "call/no-args-hold-gil", "struct/by-_ptr",
+            "struct/by-value"]
+
+
+def test_main(tmp_path, capsys):
+    old = tmp_path / "old.json"
+    bench.main(["call/double", "-n", "2", "-r", "1", "-o", str(old)])
+    assert "call/double-args" in capsys.readouterr().out
+    results = json.loads(old.read_text())
+    assert list(results["results"]) == ["call/double-args"]
+
+    bench.main(["call/", "-n", "2", "-r", "1", "--compare", str(old)])
+    lines = capsys.readouterr().out.splitlines()
+    assert "ratio" in lines[0]
+    assert lines[1].startswith("call/no-args")
+    # Benchmarks with no old result have no ratio.
+    assert lines[1].split()[1] == "-"
+    assert lines[5].startswith("call/double-args")
+    assert lines[5].split()[1] != "-"
+
+    bench.main(["--list"])
+    assert capsys.readouterr().out.split() == list(bench.BENCHMARKS)
@@ -1,4 +1,5 @@
 import re
+import time
 
 import pytest
 
@@ -102,3 +103,98 @@ def test_gobbledegook():
     function = "int incomprehensible(;, float x);"
     with pytest.raises(ValueError, match=re.escape(function)):
         cslug.c_parse.parse_function(function)
+
+
+@pytest.mark.parametrize("declaration, lengths, outputs", [
+    ("void range_of(double * values, int len_values, double * out_min, "
+     "double * out_max)", [[1, 0]], [2, 3]),
+    ("double dot(const float * a, size_t a_len, float * b, size_t len_b)",
+     [[1, 0], [3, 2]], []),
+    ("int divmod(int a, int b, int * out)", [], [2]),
+    # Lengths must be integers and must match an array parameter.
+    ("void f(double * x, double len_x, int * y, int len_z)", [], []),
+    # Outputs must be writable pointers to numbers.
+    ("void f(const int * out, int ** out_x, void * out_y)", [], []),
+    # An output with a length is an input array.
+    ("void f(int * out_x, int len_out_x, int * out_y)", [[1, 0]], [2]),
+    ("void f(void)", [], []),
+])
+def test_parse_array_parameters(declaration, lengths, outputs):
+    name, *parsed = cslug.c_parse.parse_array_parameters(declaration)
+    assert name == re.search(r"(\w+)\(", declaration).group(1)
+    assert parsed == [lengths, outputs]
+
+
+def test_parse_callbacks():
+    source = """
+        typedef int (*comparator)(const void *, const void * b);
+        // typedef int (*commented_out)(int);
+        typedef void (* visitor) (double x, int (*inner)(int));
+        typedef void (*no_args)(void);
+        typedef struct { int x; } not_a_callback;
+    """
+    assert dict(cslug.c_parse.parse_callbacks(source)) == {
+        "comparator": ["c_int", ("c_void_p", "c_void_p")],
+        "visitor": ["None", ("c_double", ("c_int", ("c_int",)))],
+        "no_args": ["None", ()],
+    }
+
+    typedefs = {"comparator": None}
+    source = """
+        void sort(int * x, int n, int (*cmp)(const void * a, const void * b)) {}
+        double apply(comparator f, comparator * fs) { return 0; }
+        void unnamed(char * (*)(float, double), int) {}
+    """
+    assert dict(cslug.c_parse.parse_functions(source, typedefs)) == {
+        "sort": ["None", ["c_int*", "c_int", ("c_int", ("c_void_p",) * 2)]],
+        "apply": ["c_double", ["comparator", "c_void_p"]],
+        "unnamed": ["None", [("c_char_p", ("c_float", "c_double")), "c_int"]],
+    }
+
+
+# Inputs which caused the old regex based parsers to backtrack quadratically.
+PATHOLOGICAL_SOURCES = {
+    "long line of words": lambda n: "int " + "word " * n + "\n",
+    "unterminated parameters": lambda n: "int foo(" * n,
+    "long whitespace": lambda n: " " * n,
+    "unclosed structs": lambda n: "typedef struct {" * n,
+    "unnamed structs": lambda n: "typedef struct {" * n + "}" + " " * n,
+    "initializer table": lambda n: "int table[] = {" + "0x10, " * n + "};",
+    "macro soup": lambda n: "#define X(a) (a) * (a) " * n,
+    "many declarators": lambda n: "int " + "a[] = {1, 2}, " * n + "b;",
+    "unterminated callbacks": lambda n: "typedef int (*f)(" * n,
+    "nested callbacks": lambda n: "typedef int (*f)(" + "int (*)(" * n + ";",
+    "many enums": lambda n: "typedef enum { A } a;\n" * n,
+}
+
+
+def _time(function, n, repeats=3):
+    best = float("inf")
+    for i in range(repeats):
+        start = time.perf_counter()
+        function(n)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@pytest.mark.parametrize("source", PATHOLOGICAL_SOURCES.values(),
+                         ids=list(PATHOLOGICAL_SOURCES))
+def test_linear_time(source):
+    """Parsing time should scale linearly with input size, no matter how
+    unpleasant the input."""
+    def parse(n):
+        text = source(n)
+        list(cslug.c_parse.search_functions(text, prototypes=True))
+        list(cslug.c_parse.parse_structs(text))
+        list(cslug.c_parse.parse_globals(text))
+        list(cslug.c_parse.parse_callbacks(text))
+        list(cslug.c_parse.parse_enums(text))
+
+    n = 2000
+    parse(n)  # Warm up.
+    small = _time(parse, n)
+    large = _time(parse, 8 * n)
+    # A linear parser should take 8x longer for 8x the input. Allow plenty of
+    # slack for timing noise - a quadratic one would take 64x longer. The
+    # absolute tolerance is for inputs which are too fast to time reliably.
+    assert large < 8 * 3 * small + 0.01
@@ -3,9 +3,14 @@
 import array
 import weakref
 
+import ctypes
+
 import pytest
 
-from cslug import ptr, nc_ptr
+from cslug import ptr, nc_ptr, PointerType, MappedFile, Arena
+from cslug.misc import array_typecode
+
+from tests import DUMP
 
 
 @pytest.mark.parametrize("ptr", [ptr, nc_ptr])
@@ -113,3 +118,211 @@ def test_inc_reffing():
     assert buffer_() is not None
     del p
     assert buffer_() is None
+
+
+def test_typed_pointer():
+    from cslug._pointers import typed_pointer
+
+    pointer = typed_pointer(ctypes.c_int32)
+    assert typed_pointer(ctypes.c_int32) is pointer
+    assert issubclass(pointer, ctypes.c_void_p)
+
+    def address(param):
+        if isinstance(param, ctypes.Array):
+            return ctypes.addressof(param)
+        return param.value
+
+    int32 = array.array(array_typecode("int32_t"), range(10))
+    assert address(pointer.from_param(int32)) == int32.buffer_info()[0]
+    assert address(pointer.from_param(memoryview(int32)[:0])) \
+           == int32.buffer_info()[0]
+    readonly = memoryview(bytes(int32)).cast(int32.typecode)
+    assert readonly.readonly
+    assert address(pointer.from_param(readonly)) == ptr(readonly)
+    assert pointer.from_param(None) is None
+    assert repr(pointer.from_param(10)) == "<cparam 'P' (0xa)>"
+
+    with pytest.raises(TypeError, match="format 'd'"):
+        pointer.from_param(array.array("d", [1]))
+    with pytest.raises(TypeError, match="format 'B' and itemsize 1"):
+        pointer.from_param(bytearray(4))
+    with pytest.raises(ValueError, match="C-contiguous"):
+        pointer.from_param(memoryview(int32)[::2])
+    with pytest.raises(TypeError):
+        pointer.from_param(1.0)
+
+    # ctypes arrays have explicit byte order prefixes in their formats.
+    # Native ones are fine. Non-native ones are not.
+    native = (ctypes.c_int32 * 2)()
+    assert address(pointer.from_param(memoryview(native))) \
+           == ctypes.addressof(native)
+    swapped = ctypes.c_int32.__ctype_be__
+    if swapped is ctypes.c_int32:  # pragma: no cover
+        swapped = ctypes.c_int32.__ctype_le__
+    with pytest.raises(TypeError):
+        pointer.from_param(memoryview((swapped * 2)()))
+
+    # bytes are passed through as they were for c_void_p.
+    assert pointer.from_param(b"abcd")._obj == b"abcd"
+
+    # Pointers to either signed or unsigned 1-byte integers accept any
+    # 1-byte integer or character buffers.
+    for ctype in (ctypes.c_int8, ctypes.c_uint8):
+        for buffer in (bytearray(b"abc"), array.array("b", [1, -1]),
+                       memoryview(b"xyz").cast("c")):
+            assert address(typed_pointer(ctype).from_param(buffer)) \
+                   == ptr(buffer)
+    with pytest.raises(TypeError, match="format 'H'"):
+        typed_pointer(ctypes.c_int8).from_param(array.array("H", [1]))
+    with pytest.raises(TypeError, match="format 'B'"):
+        typed_pointer(ctypes.c_bool).from_param(bytearray(1))
+
+
+def test_ptrs():
+    from cslug import ptrs
+    from cslug._pointers import _free_py_buffers
+
+    a = array.array("i", range(10))
+    b = bytearray(b"abc")
+    c = b"read only"
+    d = bytearray()
+
+    with ptrs(a, b, c, d) as pointers:
+        assert pointers == (ptr(a), ptr(b), ptr(c), ptr(d))
+        assert all(isinstance(i, PointerType) for i in pointers)
+        # Buffers are locked whilst in use.
+        with pytest.raises(BufferError):
+            b.append(1)
+        with pytest.raises(BufferError):
+            d.append(1)
+    # And unlocked afterwards, even if the pointers are still referenced.
+    b.append(1)
+    d.append(1)
+
+    # If one buffer is invalid, the others are released.
+    with pytest.raises(TypeError):
+        with ptrs(b, "not bytes-like"):
+            pass  # pragma: no cover
+    b.append(1)
+
+    # Released Py_buffers are recycled.
+    p = ptr(c)
+    _py_buffer = p._py_buffer
+    del p
+    assert _free_py_buffers[-1] is _py_buffer
+    assert ptr(c)._py_buffer is _py_buffer
+
+
+def test_ptr_releases():
+    """Every flavour of pointer should release its buffer when deleted."""
+    b = bytearray(10)
+    for flavour in (ptr, nc_ptr):
+        p = flavour(b)
+        with pytest.raises(BufferError):
+            b.append(1)
+        del p
+        b.append(1)
+
+
+def test_mapped_file():
+    path = DUMP / "mapped.bin"
+    values = array.array("d", range(1000))
+    path.write_bytes(b"header!!" + values.tobytes() + b"tail")
+
+    with MappedFile(path, "d", offset=8) as file:
+        assert len(file) == 1000
+        assert file.view.tolist() == values.tolist()
+        assert file.view.readonly
+        assert repr(file).endswith("of 1000 'd' items>")
+
+        windows = list(file.windows(300, overlap=10))
+        assert [len(i) for i in windows] == [300, 300, 300, 130]
+        assert [i[0] for i in windows] == [0, 290, 580, 870]
+        assert windows[-1][-1] == 999
+        # Every window should be aligned for doubles.
+        assert all(ptr(i) % ctypes.alignment(ctypes.c_double) == 0
+                   for i in windows)
+
+        pointer = file.ptr(5)
+    del windows
+
+    # The pointer should keep the file mapped even after closing.
+    assert ctypes.c_double.from_address(pointer).value == 5
+    del pointer
+
+    # Copy-on-write mappings are writable but don't modify the file.
+    with MappedFile(path, "d", "c", offset=8) as file:
+        file.view[0] = 10
+        assert file.view[0] == 10
+    assert path.read_bytes()[8:16] == bytes(8)
+
+    with pytest.raises(ValueError, match="misalign"):
+        MappedFile(path, "d", offset=4)
+    with pytest.raises(ValueError, match="mode"):
+        MappedFile(path, "d", "w")
+    with pytest.raises(ValueError, match="overlap"):
+        next(MappedFile(path).windows(10, overlap=10))
+
+    path.write_bytes(b"")
+    with MappedFile(path, "i") as file:
+        assert len(file) == 0
+        assert [len(i) for i in file.windows(10)] == [0]
+
+
+def test_arena():
+    arena = Arena(1000, alignment=32)
+    a = arena.array("d", 10, zero=True)
+    assert a.tolist() == [0] * 10
+    assert ptr(a) % 32 == 0
+    assert arena.used == 80
+
+    b = arena.array("b", 3)
+    assert ptr(b) == ptr(a) + 96
+    c = arena.array("i", 2, alignment=8)
+    assert ptr(c) == ptr(b) + 8
+    c[:] = array.array("i", [1, 2])
+
+    with arena:
+        arena.array("d", 50)
+        assert arena.used == 128 + 400
+        with pytest.raises(MemoryError, match="1000 bytes"):
+            arena.array("d", 100)
+    assert arena.used == 112
+    assert arena.high_water == 528
+
+    arena.reset()
+    assert arena.used == 0
+    assert arena.high_water == 528
+
+    # Resetting inside a with block frees everything, including whatever was
+    # allocated before the block.
+    arena.array("d", 3)
+    with arena:
+        arena.array("d", 3)
+        arena.reset()
+        arena.array("d", 3)
+        assert arena.used == 24
+    assert arena.used == 0
+    assert arena.array("i", 2).tolist() == [0, 0]
+    assert repr(arena) == "<Arena 8/1000 bytes used>"
+
+    with pytest.raises(ValueError, match="power of 2"):
+        Arena(100, alignment=24)
+
+    # Alignments greater than the arena's own must apply to the absolute
+    # address, not just the offset into the arena.
+    for _ in range(20):
+        arena = Arena(1000, alignment=16)
+        for typecode in "bdb":
+            out = arena.array(typecode, 3, alignment=64)
+            assert ctypes.addressof(ctypes.c_char.from_buffer(out)) % 64 == 0
+
+    # As must the natural alignment of items larger than the arena's
+    # alignment.
+    arena = Arena(100, alignment=1)
+    arena.array("b", 1)
+    d = arena.array("d", 2, zero=True)
+    assert ptr(d) % 8 == 0
+    assert d.tolist() == [0, 0]
+    with pytest.raises(ValueError, match="power of 2"):
+        arena.array("d", 1, alignment=0)
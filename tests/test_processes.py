@@ -0,0 +1,165 @@
+import io
+import array
+import ctypes
+
+import pytest
+
+from cslug import CSlug, ProcessPool, anchor, exceptions, ptr
+
+from tests import name
+
+SOURCE = """
+#include <stddef.h>
+
+int counter = 0;
+
+int increment() { return ++counter; }
+
+double sum(double * values, size_t len_values) {
+    double out = 0;
+    for (size_t i = 0; i < len_values; i++) out += values[i];
+    return out;
+}
+
+void scale(double * values, size_t length, double factor) {
+    for (size_t i = 0; i < length; i++) values[i] *= factor;
+}
+
+int first_byte(void * bytes) { return ((char *) bytes)[0]; }
+
+double square(double x) { return x * x; }
+
+void crash() { *(volatile int *) 0 = 1; }
+
+typedef struct Point {
+    double x;
+    double y;
+} Point;
+
+double norm_squared(Point point) { return point.x * point.x + point.y * point.y; }
+
+void flip(Point * point) {
+    double x = point->x;
+    point->x = point->y;
+    point->y = x;
+}
+
+Point make_point(double x, double y) {
+    Point out = {x, y};
+    return out;
+}
+
+double sum_x(Point * points, size_t length) {
+    double out = 0;
+    for (size_t i = 0; i < length; i++) out += points[i].x;
+    return out;
+}
+"""
+
+
+@pytest.fixture(scope="module")
+def slug():
+    slug = CSlug(anchor(name()), io.StringIO(SOURCE), vectorize="square")
+    slug.make()
+    return slug
+
+
+def test_shared_memory(slug):
+    with ProcessPool(slug, 2) as pool:
+        values = pool.array("d", range(10))
+        assert pool.call("sum", values, 10) == 45
+
+        # Writes should be visible without copying back, including to slices
+        # at an offset into a block.
+        pool.call("scale", values[2:], 8, 2.0)
+        assert values.tolist() == [0, 1] + list(range(4, 20, 2))
+
+        zeros = pool.array("i", 5)
+        assert zeros.tolist() == [0] * 5
+        assert pool.call("first_byte", pool.array("b", [7, 8])) == 7
+
+        # Anything else is copied in and back out.
+        values = array.array("d", [1, 2, 3])
+        pool.call("scale", values, 3, 10.0)
+        assert values.tolist() == [10, 20, 30]
+        assert pool.call("sum", memoryview(values).toreadonly(), 3) == 60
+        assert pool.call("first_byte", bytearray(b"x")) == ord("x")
+
+        assert pool.call("square.vectorized", values).tolist() \
+               == [100, 400, 900]
+        assert pool.map("sum", [values, values], [1, 2]) == [10, 30]
+
+        with pytest.raises(ctypes.ArgumentError):
+            pool.call("sum", bytearray(16), 2)
+        with pytest.raises(AttributeError):
+            pool.call("not_a_function")
+        with pytest.raises(TypeError, match="by name"):
+            pool.call(slug.dll.sum, values, 3)
+        with pytest.raises(ValueError, match="C-contiguous"):
+            pool.call("sum", memoryview(values)[::2], 2)
+        assert "2 processes" in repr(pool)
+
+    with pytest.raises(RuntimeError, match="closed"):
+        pool.call("increment")
+
+
+def test_globals_are_per_process(slug):
+    with ProcessPool(slug, 1) as pool:
+        assert [pool.call("increment") for i in range(3)] == [1, 2, 3]
+    assert slug.dll.increment() == 1
+
+
+def test_crash(slug):
+    with ProcessPool(slug, 1) as pool:
+        assert pool.call("increment") == 1
+        with pytest.raises(exceptions.WorkerCrashedError,
+                           match=r"crash\(\)"):
+            pool.call("crash")
+        # The worker should have been replaced, resetting its globals.
+        assert pool.call("increment") == 1
+        assert pool.call("sum", array.array("d", [1, 2]), 2) == 3
+
+
+def test_proxies(slug):
+    with ProcessPool(slug, 1) as pool:
+        # Functions are proxied. Everything else is the parent's own.
+        assert pool.dll.sum(array.array("d", [1, 2]), 2) == 3
+        assert pool.dll.square.vectorized(array.array("d", [3])).tolist() \
+               == [9]
+        assert pool.dll.increment.submit().result() == 1
+        assert pool.dll.Point is slug.dll.Point
+        assert repr(pool.dll.sum) == "<RemoteFunction sum>"
+        assert repr(pool.dll.square.vectorized) \
+               == "<RemoteFunction square.vectorized>"
+
+        # Structs are passed by value or by pointer as C expects.
+        point = slug.dll.Point(3, 4)
+        assert pool.dll.norm_squared(point) == 25
+        pool.dll.flip(point)
+        assert (point.x, point.y) == (4, 3)
+        # And returned by value.
+        point = pool.dll.make_point(1, 2)
+        assert isinstance(point, slug.dll.Point)
+        assert (point.x, point.y) == (1, 2)
+
+        # Arrays of structs in shared memory.
+        points = pool.array(slug.dll.Point, [(1, 2), slug.dll.Point(3, 4)])
+        assert pool.dll.sum_x(points, 2) == 4
+        pool.dll.flip(points[1])
+        assert (points[1].x, points[1].y) == (4, 3)
+        assert len(pool.array(slug.dll.Point, 5)) == 5
+
+        # ptr()s may point into shared memory.
+        values = pool.array("d", range(10))
+        assert pool.dll.sum(ptr(values[4:]), 2) == 9
+        with pytest.raises(ValueError, match="ptr()"):
+            pool.dll.sum(ptr(array.array("d", [1])), 1)
+
+        # Copied buffers of assorted sizes share one scratch block, which
+        # grows as needed.
+        for size in [10, 100000, 20]:
+            values = array.array("d", range(size))
+            copy = array.array("d", values)
+            pool.dll.scale(values, size, 2.0)
+            assert pool.dll.sum(values, size) == sum(copy) * 2
+            assert values.tolist() == [i * 2 for i in copy]
@@ -8,11 +8,15 @@
 import random
 import platform
 import contextlib
+import gc
+import weakref
+import time
 from subprocess import run, PIPE
 
 import pytest
-
-from cslug import exceptions, anchor, CSlug, misc, Header, cc_version, _cc
+from cslug import exceptions, anchor, CSlug, misc, Header, cc_version, _cc, \
+    ptr, CHUNK_LENGTH, adopt, strided_ptr, include_dir, Callback, Batch, \
+    AsyncDll
 
 from tests import DUMP, name, DEMOS, RESOURCES, warnings_are_evil
 from tests.test_pointers import leaks
@@ -572,3 +576,906 @@ def test_macos_deployment_target_enforcement(monkeypatch):
         self.make()
     monkeypatch.setenv("MACOS_DEPLOYMENT_TARGET", "10.12")
     self.make()
+
+
+@warnings_are_evil
+def test_preprocess():
+    """Functions declared via macros should be found with preprocess=True."""
+    source = io.StringIO("""\
+        #include <header-in-random-location.h>
+
+        #define TIMES(n) int times_ ## n(int x) { return x * n; }
+        TIMES(2)
+        TIMES(REMOTE_CONSTANT)
+    """)
+    flags = ["-I", RESOURCES / "somewhere-remote"]
+
+    self = CSlug(anchor(name()), source, flags=flags, preprocess=True)
+    assert self.dll.times_2(5) == 10
+    assert self.dll.times_REMOTE_CONSTANT.argtypes == [ctypes.c_int]
+    assert self.dll.times_REMOTE_CONSTANT(2) == 26
+
+
+def test_preprocess_cslug_h():
+    """<cslug.h> should be usable with preprocess=True but its contents
+    shouldn't be mistaken for the slug's own."""
+    from array import array
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <cslug.h>
+
+        #define SIZE_OF(type) ptrdiff_t size_of_ ## type(cslug_strided * a) \
+            { return cslug_strided_size(a); }
+        SIZE_OF(double)
+    """), preprocess=True)  # yapf: disable
+
+    assert self.dll.size_of_double(strided_ptr(array("d", range(5)))) == 5
+    assert list(self.types_map.functions) == ["size_of_double"]
+    assert self.types_map.structs == {}
+
+
+@warnings_are_evil
+def test_constants():
+    self = CSlug(anchor(name()), io.StringIO("""
+        #define LENGTH 10
+        typedef enum { NORTH, EAST = 90, SOUTH = 2 * EAST, WEST = 270 } Heading;
+
+        Heading turn_right(Heading heading) { return (heading + 90) % 360; }
+    """))  # yapf: disable
+
+    assert self.dll.LENGTH == 10
+    assert self.dll.Heading.SOUTH == 180
+    assert self.dll.WEST is self.dll.Heading.WEST
+    assert self.dll.turn_right(self.dll.WEST) == self.dll.NORTH
+    assert self.dll.Heading(self.dll.turn_right(self.dll.EAST)) \
+           is self.dll.SOUTH
+
+
+def test_globals():
+    self = CSlug(anchor(name()), io.StringIO("""
+        #define SIZE 3
+        typedef struct { int x; float y; } Point;
+
+        int counter = 10;
+        double values[SIZE] = {.5, 1.5, 2.5};
+        char message[] = "hello";
+        Point origin = {1, 2};
+        static int hidden = 4;
+
+        int increment() { return ++counter + hidden - 4; }
+        double total() { return values[0] + values[1] + values[2]; }
+    """))  # yapf: disable
+
+    counter = self.dll.counter
+    assert isinstance(counter, ctypes.c_int)
+    assert counter.value == 10
+    assert self.dll.increment() == 11
+    assert counter.value == 11
+    counter.value = 20
+    assert self.dll.increment() == 21
+
+    assert list(self.dll.values) == [.5, 1.5, 2.5]
+    memoryview(self.dll.values).cast("B").cast("d")[2] = 10
+    assert self.dll.total() == 12
+    assert self.dll.message.raw == b"hello\0"
+    assert (self.dll.origin.x, self.dll.origin.y) == (1, 2)
+    assert not hasattr(self.dll, "hidden")
+    # Each access returns the same object rather than creating a new one.
+    assert self.dll.counter is counter
+
+    # Reloading rebinds to the new library.
+    self.make()
+    assert self.dll.counter.value == 10
+
+    self.types_map.types["globals"]["missing"] = ["c_int"]
+    with pytest.raises(AttributeError, match="missing"):
+        self.types_map.apply(self.dll, strict=True)
+
+
+def test_typed_pointers():
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <stdint.h>
+        #include <stddef.h>
+
+        double sum(double * values, size_t length) {
+          double out = 0;
+          for (size_t i = 0; i < length; i++) out += values[i];
+          return out;
+        }
+
+        void cumsum(int32_t * values, int32_t * out, size_t length) {
+          int32_t total = 0;
+          for (size_t i = 0; i < length; i++) out[i] = total += values[i];
+        }
+    """))  # yapf: disable
+
+    from array import array
+
+    values = array("d", [1, 2, 3.5])
+    assert self.dll.sum(values, 3) == 6.5
+    assert self.dll.sum(memoryview(values)[1:], 2) == 5.5
+    assert self.dll.sum(memoryview(bytes(values)).cast("d"), 3) == 6.5
+    assert self.dll.sum(ptr(values), 3) == 6.5
+    assert self.dll.sum(None, 0) == 0
+    c_values = (ctypes.c_double * 2)(4, 5)
+    assert self.dll.sum(c_values, 2) == 9
+    assert self.dll.sum(ctypes.byref(c_values), 2) == 9
+
+    with pytest.raises(ctypes.ArgumentError, match="format 'f'"):
+        self.dll.sum(array("f", [1, 2, 3.5]), 3)
+    with pytest.raises(ctypes.ArgumentError, match="C-contiguous"):
+        self.dll.sum(memoryview(values)[::2], 2)
+
+    int32 = misc.array_typecode("int32_t")
+    values = array(int32, [3, 4, 5])
+    out = bytearray(12)
+    self.dll.cumsum(values, memoryview(out).cast(int32), 3)
+    assert array(int32, out) == array(int32, [3, 7, 12])
+
+    # The buffer should be released after the call and so be resizable again.
+    out = array(int32, [0] * 3)
+    self.dll.cumsum(values, out, 3)
+    out.append(0)
+    assert out == array(int32, [3, 7, 12, 0])
+
+
+def test_vectorize():
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <stdint.h>
+
+        double scale(double x, double factor) { return x * factor; }
+
+        int64_t square(int64_t x) { return x * x; }
+
+        float first(float * x) { return x[0]; }
+    """), vectorize=["scale", "square"])  # yapf: disable
+
+    from array import array
+
+    scale = self.dll.scale.vectorized
+    assert self.types_map.vectorized == ["scale", "square"]
+    assert scale.function is self.dll.scale
+
+    assert scale(array("d", [1, 2, 3]), 3) == array("d", [3, 6, 9])
+    assert scale([1, 2, 3], [1, 2, 3]) == array("d", [1, 4, 9])
+    assert scale(2, array("d", [1, 2])) == array("d", [2, 4])
+    # Wrong types or non-contiguous buffers are copied.
+    assert scale(array("i", [1, 2]), 2) == array("d", [2, 4])
+    assert scale(memoryview(array("d", range(6)))[::2], 1) \
+           == array("d", [0, 2, 4])
+    # Multidimensional buffers are flattened.
+    assert scale(memoryview(bytes(array("d", range(4)))).cast("d", (2, 2)),
+                 1) == array("d", range(4))
+    # All scalars falls back to the scalar function.
+    assert scale(2, 3) == 6.0
+
+    out = array("d", [0] * 3)
+    assert scale(range(3), 2, out=out) is out
+    assert out == array("d", [0, 2, 4])
+
+    with pytest.raises(ValueError, match="mismatched lengths 2 and 3"):
+        scale([1, 2], [1, 2, 3])
+    with pytest.raises(ValueError, match="output has length 1"):
+        scale([1, 2], 1, out=array("d", [0]))
+    with pytest.raises(TypeError, match="takes 2 arguments"):
+        scale([1, 2])
+    with pytest.raises(ctypes.ArgumentError):
+        scale([1, 2], 1, out=array("f", [0, 0]))
+
+    square = self.dll.square.vectorized
+    assert list(square(range(5))) == [0, 1, 4, 9, 16]
+    assert square(range(3)).itemsize == 8
+
+    assert not hasattr(self.dll.first, "vectorized")
+
+    # Inspecting the compile command should neither rescan the source nor
+    # write out the generated code.
+    def blocked():
+        raise AssertionError("compile_command() shouldn't scan the source.")
+
+    self.types_map._types_from_source = blocked
+    command, buffers, temporary_files = self.compile_command()
+    assert temporary_files == []
+    assert not any(i.endswith(".c") for i in command)
+    del self.types_map._types_from_source
+
+
+@pytest.mark.parametrize("function, message", [
+    ("missing", "no definition"),
+    ("first", "Only functions taking one or more numbers"),
+    ("nothing", "Only functions taking one or more numbers"),
+])
+def test_vectorize_invalid(function, message):
+    self = CSlug(anchor(name()), io.StringIO("""
+        float first(float * x) { return x[0]; }
+        int nothing(void) { return 0; }
+    """), vectorize=function)  # yapf: disable
+    with pytest.raises(ValueError, match=message):
+        self.make()
+
+
+def test_array_functions():
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <math.h>
+        #include <stddef.h>
+
+        void range_of(double * values, int len_values, double * out_min,
+                      double * out_max) {
+          *out_min = INFINITY;
+          *out_max = -INFINITY;
+          for (int i = 0; i < len_values; i++) {
+            if (values[i] > *out_max) *out_max = values[i];
+            if (values[i] < *out_min) *out_min = values[i];
+          }
+        }
+
+        double dot(const float * a, size_t a_len, const float * b,
+                   size_t len_b) {
+          double out = 0;
+          for (size_t i = 0; i < a_len && i < len_b; i++) out += a[i] * b[i];
+          return out;
+        }
+
+        int divide(int a, int b, int * out) {
+          *out = a % b;
+          return a / b;
+        }
+
+        void clear(int * values, size_t len_values) {
+          for (size_t i = 0; i < len_values; i++) values[i] = 0;
+        }
+
+        // Here, len_values isn't the length of values but the naming
+        // convention treats it as if it is anyway.
+        void fill(int * values, int len_values) {
+          for (int i = 0; i < 3; i++) values[i] = len_values;
+        }
+    """))  # yapf: disable
+
+    from array import array
+
+    assert self.dll.range_of.wrapped([6, 9, 3, 13.5, 8.7, -4]) == (-4, 13.5)
+    assert self.dll.range_of.wrapped(array("d", [1])) == (1, 1)
+    assert self.dll.range_of.wrapped([]) == (math.inf, -math.inf)
+    assert self.dll.dot.wrapped([1, 2, 3], array("f", [1, 1, 1])) == 6
+    assert self.dll.divide.wrapped(17, 5) == (3, 2)
+    assert self.types_map.arrays["divide"] == [[], [2]]
+
+    # Arrays of the right type are written to in place.
+    values = array("i", [1, 2, 3])
+    assert self.dll.clear.wrapped(values) is None
+    assert values == array("i", [0, 0, 0])
+
+    # Parameters are classified by name only.
+    assert self.types_map.arrays["fill"] == [[[1, 0]], []]
+    with pytest.raises(TypeError, match="takes 1 arguments"):
+        self.dll.fill.wrapped(values, 7)
+    self.dll.fill.wrapped(values)
+    assert values == array("i", [3, 3, 3])
+    self.dll.fill(values, 7)
+    assert values == array("i", [7, 7, 7])
+
+    with pytest.raises(TypeError, match=r"Argument 2 of dot\(\) should be an "
+                       r"array, not 1."):
+        self.dll.dot.wrapped([2], 1)
+    with pytest.raises(TypeError, match="takes 2 arguments"):
+        self.dll.dot.wrapped([2])
+
+
+TEMPLATE = """
+    double sum(T * values, size_t length) {
+        double out = 0;
+        for (size_t i = 0; i < length; i++) out += values[i];
+        return out;
+    }
+
+    static T twice(T x) { return x + x; }
+
+    void double_all(T * values, size_t length) {
+        for (size_t i = 0; i < length; i++) values[i] = twice(values[i]);
+    }
+"""
+
+
+@pytest.mark.parametrize("true_file", [True, False])
+def test_templates(true_file):
+    from array import array
+    from cslug import Template
+
+    if true_file:
+        source = DUMP / (str(name().name) + ".c")
+        source.write_text(TEMPLATE)
+    else:
+        source = io.StringIO(TEMPLATE)
+    template = Template(source, ["float", "double", "int32_t", "uint8_t"],
+                        placeholder="T")
+    self = CSlug(anchor(name()), io.StringIO("int plain() { return 1; }"),
+                 templates=template)
+
+    assert self.dll.plain() == 1
+    assert self.types_map.templates["sum"] == \
+           [[0], ["sum__float", "sum__double", "sum__int32_t", "sum__uint8_t"]]
+    assert self.dll.sum__double.argtypes[0]._item_type is ctypes.c_double
+
+    for typecode in "fdiB":
+        values = array(typecode, [1, 2, 3])
+        assert self.dll.sum(values, 3) == 6
+        self.dll.double_all(values, 3)
+        assert values == array(typecode, [2, 4, 6])
+    assert self.dll.sum(bytes([1, 2]), 2) == 3
+    assert self.dll.sum(memoryview(array("d", [1, 2])).toreadonly(), 2) == 3
+
+    assert self.dll.sum["d"] is self.dll.sum__double
+    assert self.dll.sum["float"] is self.dll.sum__float
+    assert self.dll.sum[ctypes.c_int32] is self.dll.sum__int32_t
+    with pytest.raises(KeyError):
+        self.dll.sum["h"]
+
+    with pytest.raises(TypeError, match="no specialization for buffers with "
+                       "format 'h' and itemsize 2"):
+        self.dll.sum(array("h", [1]), 1)
+    with pytest.raises(TypeError, match="without a buffer argument"):
+        self.dll.sum(None, 0)
+
+    # Static functions aren't exported so shouldn't be available.
+    assert not hasattr(self.dll, "twice")
+
+
+def test_template_renaming():
+    """Only the template's own code should be affected by the renaming of its
+    functions."""
+    from cslug import Template
+
+    # remove() is also declared in <stdio.h>. Renaming that declaration too
+    # would make it conflict with the template's.
+    folder = DUMP / name().name
+    folder.mkdir(exist_ok=True)
+    (folder / "helper.h").write_text("#define REMOVE_ME 1\n")
+    source = folder / "template.c"
+    source.write_text("""
+        #include <stdio.h>
+        #include "helper.h"
+
+        int remove(T * values) {
+            return values ? 0 : (int) sizeof("remove") + REMOVE_ME;
+        }
+    """)
+    self = CSlug(anchor(name()), io.StringIO(""),
+                 templates=Template(source, ["float", "double"]))
+    assert self.dll.remove__float(None) == 8
+    assert self.dll.remove__double(None) == 8
+
+    with pytest.raises(ValueError, match="at least one type"):
+        Template(source, [])
+
+
+def test_specialize():
+    self = CSlug(anchor(name()), io.StringIO("""
+        #ifndef N
+        #define N 1
+        #endif
+
+        int get_n() { return N; }
+
+        double sum(double * values) {
+            double out = 0;
+            for (int i = 0; i < N; i++) out += values[i];
+            return out;
+        }
+    """))  # yapf: disable
+
+    from array import array
+
+    three = self.specialize(N=3)
+    assert self.specialize(N=3) is three
+    assert self.specialize(N="3") is three
+    assert three.macros == {"N": 3}
+    assert three.path != self.path
+    assert three.dll.get_n() == 3
+    assert three.dll.sum(array("d", [1, 2, 3, 4])) == 6
+
+    four = self.specialize(N=4)
+    assert four.dll.sum(array("d", [1, 2, 3, 4])) == 10
+    assert self.dll.get_n() == 1
+    assert self.specialize(N=4, M=1) is not four
+
+    # Remaking the unspecialized slug should invalidate its specializations.
+    self.make()
+    assert not three.path.exists()
+    assert three.dll.get_n() == 3
+
+    # Including specializations built by another process which this one knows
+    # nothing about.
+    assert three.path.exists()
+    three.close()
+    self._specializations.clear()
+    self.make()
+    assert not three.path.exists()
+    assert not three.types_map.json_path.exists()
+
+
+@pytest.mark.parametrize("hold_gil", [True, False, ["add", "scale"], "add"])
+def test_hold_gil(hold_gil):
+    self = CSlug(anchor(name()), io.StringIO("""
+        int add(int a, int b) { return a + b; }
+        double scale(double x, double factor) { return x * factor; }
+        void nothing() {}
+    """), vectorize="scale", hold_gil=hold_gil)  # yapf: disable
+
+    def holds_gil(func):
+        return bool(func._flags_ & ctypes._FUNCFLAG_PYTHONAPI)
+
+    held = ["add", "scale", "nothing"] if hold_gil is True else \
+        misc.flatten(hold_gil or ())
+    for function in ["add", "scale", "nothing"]:
+        assert holds_gil(getattr(self.dll, function)) == (function in held)
+
+    assert self.dll.add(1, 2) == 3
+    assert self.dll.add.argtypes == [ctypes.c_int, ctypes.c_int]
+    assert self.dll.scale(2, 3) == 6
+    assert list(self.dll.scale.vectorized([1, 2], 2)) == [2, 4]
+    # Wrappers should call the GIL holding version.
+    assert self.dll.scale.vectorized.function is self.dll.scale
+    assert holds_gil(self.dll.scale.vectorized._wrapper) == ("scale" in held)
+    assert self.specialize(X=1).hold_gil == self.hold_gil
+
+    # The setting should survive reloading.
+    self.close()
+    assert holds_gil(self.dll.add) == ("add" in held)
+
+
+def test_hold_gil_unknown_function():
+    self = CSlug(anchor(name()), io.StringIO("void nothing() {}"),
+                 hold_gil="missing")
+    with pytest.raises(ValueError, match="'missing'"):
+        self.dll
+
+
+def test_parallel():
+    from array import array
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <stddef.h>
+
+        double sum(double * values, size_t len_values) {
+            double out = 0;
+            for (size_t i = 0; i < len_values; i++) out += values[i];
+            return out;
+        }
+
+        void scale(double * values, size_t length, double factor) {
+            for (size_t i = 0; i < length; i++) values[i] *= factor;
+        }
+
+        double square(double x) { return x * x; }
+    """), vectorize="square")  # yapf: disable
+
+    values = array("d", range(1000))
+    assert self.parallel("sum", values, CHUNK_LENGTH, reduce=sum) == 499500
+    assert self.parallel(self.dll.sum.wrapped, values, reduce=sum) == 499500
+
+    # Without a reduction, each chunk's return value is given. Chunk boundaries
+    # should be aligned to cache lines (8 doubles).
+    chunks = self.parallel("sum", values, CHUNK_LENGTH, chunks=3)
+    assert len(chunks) == 3
+    assert sum(chunks) == 499500
+    assert chunks[0] == sum(range(336))
+
+    self.parallel(self.dll.scale, values, CHUNK_LENGTH, 2.0, chunks=7,
+                  pin=True)
+    assert values.tolist() == list(range(0, 2000, 2))
+
+    squares = self.parallel(self.dll.square.vectorized, values, chunks=4,
+                            reduce=lambda chunks: sum(chunks, array("d")))
+    assert squares.tolist() == [i**2 for i in range(0, 2000, 2)]
+
+    # Buffers of other lengths are passed whole.
+    assert self.parallel("sum", values, 3, chunks=5, length=10) \
+           == [0 + 2 + 4] * 5
+
+    # If a chunk fails, the others should still finish before the buffers are
+    # released.
+    finished = []
+
+    def fail_first(chunk):
+        if chunk[0] == 0:
+            raise KeyError("chunk 0")
+        time.sleep(.05)
+        finished.append(chunk[0])
+
+    with pytest.raises(KeyError, match="chunk 0"):
+        self.parallel(fail_first, array("d", range(32)), chunks=4)
+    assert len(finished) == 3
+
+    # Multidimensional buffers which can't be flattened with their own format
+    # can't be sliced into chunks of items.
+    with pytest.raises(ValueError, match="format '<d'"):
+        self.parallel(len, memoryview((ctypes.c_double * 2 * 8)()), chunks=2)
+
+    # Empty buffers are passed as a single empty chunk.
+    empty = array("d")
+    assert self.parallel("sum", empty, CHUNK_LENGTH) == [0]
+    assert self.parallel(self.dll.sum.wrapped, empty, reduce=sum) == 0
+    assert self.parallel(self.dll.square.vectorized, empty,
+                         reduce=lambda chunks: sum(chunks, array("d"))) \
+           == array("d")
+
+    with pytest.raises(TypeError, match="buffer"):
+        self.parallel("sum", 1, 2)
+
+
+def test_adopt():
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <stdlib.h>
+        #include <stddef.h>
+
+        int frees = 0;
+
+        int * range(int n) {
+            int * out = malloc(n * sizeof(int));
+            for (int i = 0; i < n; i++) out[i] = i;
+            return out;
+        }
+
+        void counting_free(void * x) {
+            frees++;
+            free(x);
+        }
+
+        int sum(int * values, size_t len_values) {
+            int out = 0;
+            for (size_t i = 0; i < len_values; i++) out += values[i];
+            return out;
+        }
+    """))  # yapf: disable
+    frees = ctypes.c_int.in_dll(self.dll, "frees")
+
+    values = adopt(self.dll.range(10), 10, "i", self.dll.counting_free)
+    assert values.tolist() == list(range(10))
+    assert not values.readonly
+    values[0] = 10
+    assert self.dll.sum(values, 10) == 55
+
+    # Anything referencing the array should keep it alive.
+    tail = values[5:]
+    pointer = ptr(values)
+    del values
+    assert frees.value == 0
+    assert tail.tolist() == [5, 6, 7, 8, 9]
+    del tail
+    assert frees.value == 0
+    del pointer
+    assert frees.value == 1
+
+    # The default is to use the standard library's free().
+    values = adopt(ctypes.c_void_p(self.dll.range(3)), 3, ctypes.c_int)
+    assert values.tolist() == [0, 1, 2]
+    del values
+
+    assert adopt(None, 0, "d").tolist() == []
+    with pytest.raises(ValueError, match="NULL"):
+        adopt(0, 3)
+
+
+def test_soa():
+    from array import array
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <stdint.h>
+        #include <stddef.h>
+        #include <stdbool.h>
+
+        typedef struct Particle {
+            char tag;
+            double x;
+            int16_t charge;
+            bool alive;
+        } Particle;
+
+        typedef struct ParticleSoA {
+            char * tag;
+            double * x;
+            int16_t * charge;
+            bool * alive;
+        } ParticleSoA;
+
+        double total_charge(ParticleSoA * particles, size_t length) {
+            double out = 0;
+            for (size_t i = 0; i < length; i++)
+                if (particles->alive[i]) out += particles->charge[i];
+            return out;
+        }
+    """), soa="Particle")  # yapf: disable
+    Particle = self.dll.Particle
+    assert self.types_map.soa_layouts == ["Particle"]
+
+    aos = Particle.array_from_tuples([(b"a", 1.5, 2, True),
+                                      (b"b", -3, 4, False),
+                                      (b"c", 0, -8, True)])
+    soa = Particle.SoA.from_aos(aos)
+    assert soa.struct is Particle
+    assert len(soa) == 3
+    assert soa.tag == array("b", b"abc")
+    assert soa.x == array("d", [1.5, -3, 0])
+    assert soa.charge == array("h", [2, 4, -8])
+    assert soa.alive.tolist() == [1, 0, 1]
+    assert self.dll.total_charge(soa, len(soa)) == -6
+
+    soa.x[1] = 10
+    assert Particle.to_tuples(soa.to_aos()) == [(b"a", 1.5, 2, True),
+                                                (b"b", 10, 4, False),
+                                                (b"c", 0, -8, True)]
+    assert repr(Particle.SoA(1)) == "ParticleSoA(tag=array('b', [0]), " \
+        "x=array('d', [0.0]), charge=array('h', [0]), alive=array('B', [0]))"
+    assert len(Particle.SoA.from_aos(b"")) == 0
+
+
+@pytest.mark.parametrize("struct, message", [
+    ("Missing", "no struct of that name"),
+    ("Bits", "without bit-field"),
+    ("Pointy", "Only structs whose fields are all numbers"),
+])
+def test_soa_invalid(struct, message):
+    self = CSlug(anchor(name()), io.StringIO("""
+        typedef struct Bits { int a: 3; int b: 5; } Bits;
+        typedef struct Pointy { int * a; } Pointy;
+    """), soa=struct)  # yapf: disable
+    with pytest.raises(ValueError, match=message):
+        self.make()
+
+
+def test_strided_ptr():
+    from array import array
+    assert (Path(include_dir()) / "cslug.h").exists()
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <cslug.h>
+
+        // Sum a 1D array or weight each column of a 2D array by its index.
+        double weighted_sum(cslug_strided * a) {
+            double out = 0;
+            ptrdiff_t index[2] = {0, 0};
+            for (index[0] = 0; index[0] < a->shape[0]; index[0]++) {
+                if (a->ndim == 1) {
+                    out += *(double *) cslug_strided_at(a, index);
+                    continue;
+                }
+                for (index[1] = 0; index[1] < a->shape[1]; index[1]++)
+                    out += *(double *) cslug_strided_at(a, index) * index[1];
+            }
+            return out;
+        }
+
+        ptrdiff_t size(cslug_strided * a) { return cslug_strided_size(a); }
+    """))  # yapf: disable
+
+    values = array("d", range(12))
+    assert self.dll.weighted_sum(strided_ptr(values)) == 66
+    assert self.dll.size(strided_ptr(values)) == 12
+
+    reversed_ = strided_ptr(memoryview(values)[::-3])
+    assert reversed_.ndim == 1
+    assert reversed_.itemsize == 8
+    assert reversed_.shape[0] == 4
+    assert reversed_.strides[0] == -24
+    assert reversed_.data == ptr(values) + 88
+    assert self.dll.weighted_sum(reversed_) == 11 + 8 + 5 + 2
+    assert repr(reversed_) == "StridedBuffer(data={}, shape=(4,), " \
+        "strides=(-24,), itemsize=8)".format(ptr(values) + 88)
+
+    matrix = strided_ptr(memoryview(values).cast("B").cast("d", [3, 4]))
+    assert matrix.strides[:2] == [32, 8]
+    assert self.dll.weighted_sum(matrix) == sum(
+        values[4 * i + j] * j for i in range(3) for j in range(4))
+    assert self.dll.size(matrix) == 12
+
+
+def test_callbacks():
+    from array import array
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <stdlib.h>
+
+        typedef double (*unary)(double);
+
+        static unary stored = NULL;
+
+        void sort(int * x, size_t n, int (*cmp)(const void *, const void *)) {
+            qsort(x, n, sizeof(int), cmp);
+        }
+
+        double apply(unary f, double x) { return f(x); }
+        void store(unary f) { stored = f; }
+        double call_stored(double x) { return stored(x); }
+    """))  # yapf: disable
+
+    assert issubclass(self.dll.unary, Callback)
+    assert self.types_map.callbacks == {"unary": ["c_double", ["c_double"]]}
+    assert self.dll.apply.argtypes[0] is self.dll.unary
+    assert issubclass(self.dll.sort.argtypes[2], Callback)
+
+    def compare(a, b):
+        (a, b) = (ctypes.c_int.from_address(i).value for i in (a, b))
+        return (a > b) - (a < b)
+
+    values = array("i", [3, 1, 2])
+    self.dll.sort(values, 3, compare)
+    assert values.tolist() == [1, 2, 3]
+    self.dll.sort(values, 3, lambda a, b: compare(b, a))
+    assert values.tolist() == [3, 2, 1]
+
+    # Any callable or an explicitly wrapped one.
+    assert self.dll.apply(abs, -3) == 3
+    assert self.dll.apply(self.dll.unary(lambda x: x + 1), 1) == 2
+
+    class Scale(object):
+        def __init__(self, factor):
+            self.factor = factor
+
+        def __call__(self, x):
+            return x * self.factor
+
+        def method(self, x):
+            return x * self.factor
+
+    scale = Scale(3)
+    assert self.dll.apply(scale, 2) == 6
+    assert self.dll.apply(scale.method, 2) == 6
+
+    # Wrapping is done once per callable.
+    assert self.dll.unary.wrap(scale) is self.dll.unary.wrap(scale)
+    assert self.dll.unary.wrap(scale.method) \
+        is self.dll.unary.wrap(scale.method)
+    assert self.dll.unary.wrap(scale) is not self.dll.unary.wrap(Scale(3))
+
+    # The C function pointer survives as long as the callable does, even if C
+    # holds onto it after the call.
+    self.dll.store(Scale(5))
+    self.dll.store(scale)
+    gc.collect()
+    assert self.dll.call_stored(4) == 12
+
+    # But not longer.
+    thunk = weakref.ref(self.dll.unary.wrap(scale))
+    del scale
+    gc.collect()
+    assert thunk() is None
+
+
+def test_batch():
+    from array import array
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <cslug.h>
+
+        typedef struct Pair { int index; double value; } Pair;
+
+        void negatives(double * values, size_t length, cslug_batch * out) {
+            for (size_t i = 0; i < length; i++)
+                if (values[i] < 0) *(double *) cslug_batch_next(out) = values[i];
+            cslug_batch_flush(out);
+        }
+
+        void pairs(double * values, size_t length, cslug_batch * out) {
+            for (size_t i = 0; i < length; i++) {
+                Pair pair = {i, values[i]};
+                cslug_batch_push(out, &pair);
+            }
+            // No flush.
+        }
+    """))  # yapf: disable
+
+    values = array("d", [-1, 2, -3, -4, 5, -6, -7, 8, -9])
+    blocks = []
+    batch = Batch(lambda x: blocks.append(x.tolist()), "d", block_size=2)
+    assert repr(batch).startswith("<Batch of 0/2 'd' items for <function")
+    self.dll.negatives(values, len(values), batch)
+    assert blocks == [[-1, -3], [-4, -6], [-7, -9]]
+    batch.flush()
+    assert len(blocks) == 3
+
+    blocks.clear()
+    with Batch(lambda x: blocks.append(x.tolist()), "d", 4) as batch:
+        self.dll.negatives(values, len(values), batch)
+    assert blocks == [[-1, -3, -4, -6], [-7, -9]]
+
+    Pair = self.dll.Pair
+    blocks.clear()
+    with Batch(lambda x: blocks.append(Pair.to_tuples(x)), Pair, 4) as batch:
+        self.dll.pairs(values, 5, batch)
+        # Items not flushed by C...
+        assert batch.count == 1
+    # ...are flushed on exiting the with block.
+    assert blocks == [[(0, -1), (1, 2), (2, -3), (3, -4)], [(4, 5)]]
+
+    def fail(block):
+        blocks.append(block.tolist())
+        raise ZeroDivisionError
+
+    blocks.clear()
+    with pytest.raises(ZeroDivisionError):
+        with Batch(fail, "d", 2) as batch:
+            self.dll.negatives(values, len(values), batch)
+    assert blocks == [[-1, -3]]
+    assert batch.error is None
+
+    with pytest.raises(ValueError):
+        Batch(print, "d", 0)
+
+
+def test_aio():
+    import asyncio
+    import threading
+    from array import array
+
+    self = CSlug(anchor(name()), io.StringIO("""
+        #include <stddef.h>
+
+        double sum(double * values, size_t length, void (*wait)(void)) {
+            wait();
+            double out = 0;
+            for (size_t i = 0; i < length; i++) out += values[i];
+            return out;
+        }
+
+        double first(void * values) { return *(double *) values; }
+    """))  # yapf: disable
+
+    assert self.aio is self.aio
+    assert self.aio.sum.function is self.dll.sum
+    assert repr(self.aio.sum) == "<AsyncFunction sum>"
+
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+    main = threading.get_ident()
+
+    def wait():
+        nonlocal running, peak
+        assert threading.get_ident() != main
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(.05)
+        with lock:
+            running -= 1
+
+    async def ticker(stop):
+        ticks = 0
+        while not stop.done():
+            await asyncio.sleep(.005)
+            ticks += 1
+        return ticks
+
+    async def main_():
+        values = array("d", range(10))
+        stop = asyncio.get_running_loop().create_future()
+        ticks = asyncio.ensure_future(ticker(stop))
+        results = await asyncio.gather(
+            *(self.aio.sum(values, i, wait) for i in range(6)))
+        stop.set_result(None)
+        return results, await ticks
+
+    results, ticks = asyncio.run(main_())
+    assert results == [sum(range(i)) for i in range(6)]
+    # The event loop kept running whilst C was.
+    assert ticks > 2
+
+    # With a concurrency limit.
+    from concurrent.futures import ThreadPoolExecutor
+    executor = ThreadPoolExecutor(4)
+    self.aio = AsyncDll(self, limit=2, executor=executor)
+    peak = 0
+    results, ticks = asyncio.run(main_())
+    assert results == [sum(range(i)) for i in range(6)]
+    assert peak == 2
+
+    # Buffers can't be resized or freed until the call completes.
+    values = array("d", [3, 4])
+
+    def resize():
+        with pytest.raises(BufferError):
+            values.append(5)
+
+    async def buffers():
+        call = self.aio.sum(values, 2, resize)
+        pointer = self.aio.first(ptr(array("d", [7])))
+        return await call, await pointer
+
+    assert asyncio.run(buffers()) == (7, 7)
+    values.append(5)
+    executor.shutdown()
@@ -2,7 +2,10 @@
 import warnings
 import ctypes
 
-from cslug import CSlug, anchor
+import pytest
+
+from cslug import CSlug, anchor, ptr, dtype, _struct
+from cslug._struct import dtype_spec, make_struct
 
 from tests import name
 
@@ -108,3 +111,139 @@ def test_empty():
     thing = slug.dll.Empty()
 
     assert repr(thing) == "Empty()"
+
+
+NUMPY_SOURCE = """
+#include <stdint.h>
+#include <stddef.h>
+
+typedef struct Particle {
+    char tag;
+    double x;
+    int16_t charge;
+    float mass;
+} Particle;
+
+typedef struct Flags {
+    int a: 3;
+    int b: 5;
+} Flags;
+
+double total_mass(Particle * particles, size_t length) {
+    double out = 0;
+    for (size_t i = 0; i < length; i++) out += particles[i].mass;
+    return out;
+}
+
+void shift(Particle * particles, size_t length, double dx) {
+    for (size_t i = 0; i < length; i++) particles[i].x += dx;
+}
+"""
+
+
+def test_dtype_spec():
+    slug = CSlug(anchor(name()), io.StringIO(NUMPY_SOURCE))
+    Particle = slug.dll.Particle
+
+    assert dtype_spec(Particle) == {
+        "names": ["tag", "x", "charge", "mass"],
+        "formats": ["S1", "f8", "i2", "f4"],
+        "offsets": [0, 8, 16, 20],
+        "itemsize": 24,
+    }
+    with pytest.raises(TypeError, match="bit-fields"):
+        dtype_spec(slug.dll.Flags)
+
+    # Nested structs and arrays become nested dtypes and subarrays.
+    Nested = make_struct("Nested", [("a", ctypes.c_int8),
+                                    ("particle", Particle),
+                                    ("xy", ctypes.c_float * 2)])
+    assert dtype_spec(Nested) == {
+        "names": ["a", "particle", "xy"],
+        "formats": ["i1", dtype_spec(Particle), ("f4", (2,))],
+        "offsets": [0, 8, 32],
+        "itemsize": 40,
+    }
+    with pytest.raises(TypeError, match="'p' .* LP_c_int_Array_2"):
+        dtype_spec(make_struct("P", [("p", ctypes.POINTER(ctypes.c_int) * 2)]))
+
+
+def test_helper_name_collisions():
+    """Fields named after struct class helpers should take precedence."""
+    slug = CSlug(anchor(name()), io.StringIO("""
+        typedef struct Awkward { int dtype; double to_tuples; } Awkward;
+    """))
+    Awkward = slug.dll.Awkward
+    assert isinstance(Awkward.dtype, type(Awkward.to_tuples))
+    assert Awkward(3, 1.5).dtype == 3
+
+    # The other helpers should still work.
+    structs = Awkward.array_from_columns(dtype=[1, 2], to_tuples=[3, 4])
+    assert Awkward.to_columns(structs) == {"dtype": [1, 2],
+                                           "to_tuples": [3, 4]}
+    assert dtype_spec(Awkward)["names"] == ["dtype", "to_tuples"]
+    assert dtype is _struct.dtype
+
+
+def test_numpy():
+    numpy = pytest.importorskip("numpy")
+    slug = CSlug(anchor(name()), io.StringIO(NUMPY_SOURCE))
+    Particle = slug.dll.Particle
+
+    assert Particle.dtype.itemsize == ctypes.sizeof(Particle)
+    assert Particle.dtype is Particle.dtype
+
+    particles = Particle.numpy_zeros(1000)
+    particles["mass"] = numpy.arange(1000)
+    particles["x"] = 1
+    assert slug.dll.total_mass(ptr(particles), 1000) == 499500
+    slug.dll.shift(ptr(particles), 1000, 0.5)
+    assert (particles["x"] == 1.5).all()
+
+    # Views should share memory with the original buffer.
+    raw = (Particle * 3)(Particle(b"a", 1, 2, 3), Particle(b"b", 4, 5, 6))
+    view = Particle.numpy_view(raw)
+    assert view["tag"].tolist() == [b"a", b"b", b""]
+    assert view["charge"].tolist() == [2, 5, 0]
+    view["mass"][2] = 7
+    assert raw[2].mass == 7
+
+
+def test_bulk_conversion():
+    slug = CSlug(anchor(name()), io.StringIO(NUMPY_SOURCE))
+    Particle = slug.dll.Particle
+    tuples = [(b"a", 1.5, 3, 10), (b"b", -2, -4, 20), (b"c", 0, 5, 30)]
+
+    particles = Particle.array_from_tuples(tuples)
+    assert isinstance(particles, Particle * 3)
+    assert bytes(particles) == bytes((Particle * 3)(*(Particle(*i)
+                                                       for i in tuples)))
+    assert slug.dll.total_mass(particles, 3) == 60
+    assert Particle.to_tuples(particles) == tuples
+    assert Particle.to_columns(particles) == {
+        "tag": [b"a", b"b", b"c"],
+        "x": [1.5, -2, 0],
+        "charge": [3, -4, 5],
+        "mass": [10, 20, 30],
+    }
+
+    particles = Particle.array_from_columns(charge=range(3), mass=[1, 2, 3])
+    assert Particle.to_tuples(particles) \
+           == [(b"\x00", 0, 0, 1), (b"\x00", 0, 1, 2), (b"\x00", 0, 2, 3)]
+    # Any buffer of structs may be unpacked.
+    assert Particle.to_columns(bytes(particles))["mass"] == [1, 2, 3]
+
+    assert len(Particle.array_from_tuples([])) == 0
+    assert Particle.to_columns(Particle.array_from_columns()) \
+           == {"tag": [], "x": [], "charge": [], "mass": []}
+
+    with pytest.raises(ValueError, match="mismatched lengths"):
+        Particle.array_from_columns(x=[1, 2], mass=[1])
+    with pytest.raises(TypeError, match="no field 'y'"):
+        Particle.array_from_columns(y=[1])
+    with pytest.raises(TypeError, match="bulk"):
+        slug.dll.Flags.array_from_tuples([(1, 2)])
+
+    Nested = make_struct("Nested", [("a", ctypes.c_int), ("p", Particle)])
+    with pytest.raises(TypeError, match="Field 'p' of struct Nested .* bulk"):
+        Nested.array_from_columns(a=[1])
@@ -1,4 +1,5 @@
 import io
+import os
 import json
 import warnings
 import ctypes
@@ -21,7 +22,7 @@
 float bar(int32_t a, int16_t b, uint64_t c) {}
 short whack(unsigned long d, double e, long) {}
 
-// All pointers reduce to just void pointer.
+// Pointers to numbers are typed. All others reduce to just void pointer.
 void * ptrs(float * a, int **, * Custom, *Custom, Custom*, Custom  *  ) {}
 // Except for char arrays which get their own pointer types.
 void char_ptr(char [], char *, wchar_t*) {}
@@ -56,7 +57,7 @@
     'bar': ['c_float', ['c_int32', 'c_int16', 'c_uint64']],
     'whack': ['c_short', ['c_ulong', 'c_double', 'c_long']],
     #
-    'ptrs': ['c_void_p', ['c_void_p'] * 6],
+    'ptrs': ['c_void_p', ['c_float*'] + ['c_void_p'] * 5],
     'char_ptr': ['None', ['c_char_p', 'c_char_p', 'c_wchar_p']],
     'char_ptr_ptr': ['None', ['c_void_p', 'c_void_p', 'c_void_p']],
     #
@@ -203,3 +204,245 @@ class FakeDLL(object):
     assert dll.exists.restype == ctypes.c_float
     assert not hasattr(dll, "doesnt_exist")
     assert not hasattr(dll, "also_doesnt_exist")
+
+
+PREPROCESSED_SOURCE = """
+#include <stdint.h>
+#include "preprocess-me.h"
+
+#define DECLARE(name) int32_t name(int32_t x)
+DECLARE(from_macro) { return x; }
+
+#ifdef ENABLE_OPTIONAL
+float optional(Thing thing) { return thing.b; }
+#else
+double not_optional() { return 0; }
+#endif
+"""
+
+
+def test_preprocess(monkeypatch):
+    from cslug import _preprocess
+    from tests import DUMP, name
+
+    header = DUMP / "preprocess-me.h"
+    header.write_text("typedef struct Thing { int a; float b; } Thing;\n")
+
+    json_path = DUMP / name().with_suffix(".json").name
+    self = cslug.Types(json_path, io.StringIO(PREPROCESSED_SOURCE),
+                       preprocess=True, flags=["-I", DUMP, "-DENABLE_OPTIONAL"])
+    self.init_from_source()
+
+    # Without preprocessing, none of this is visible.
+    assert self.functions == {
+        "from_macro": ["c_int32", ["c_int32"]],
+        "optional": ["c_float", ["Thing"]],
+    }
+    assert self.structs == {"Thing": [("a", "c_int"), ("b", "c_float")]}
+
+    # Nothing from system headers should leak in.
+    assert "int32_t" not in self.structs
+
+    # Running again should reuse the cache, even from a new instance.
+    def blocked(*args, **kwargs):
+        raise AssertionError("The preprocessor should not have been rerun.")
+
+    monkeypatch.setattr(_preprocess, "run", blocked)
+    self = cslug.Types(json_path, io.StringIO(PREPROCESSED_SOURCE),
+                       preprocess=True, flags=["-I", DUMP, "-DENABLE_OPTIONAL"])
+    self.init_from_source()
+    assert "optional" in self.functions
+    assert json_path.with_suffix(".i-cache").exists()
+
+    # Changing the flags should invalidate the cache.
+    self = cslug.Types(json_path, io.StringIO(PREPROCESSED_SOURCE),
+                       preprocess=True, flags=["-I", DUMP])
+    with pytest.raises(AssertionError, match="should not have been rerun"):
+        self.init_from_source()
+    monkeypatch.undo()
+
+    self = cslug.Types(json_path, io.StringIO(PREPROCESSED_SOURCE),
+                       preprocess=True, flags=["-I", DUMP])
+    self.init_from_source()
+    assert self.functions["not_optional"] == ["c_double", []]
+
+    # As should modifying a header.
+    header.write_text("typedef struct Thing { double a; } Thing;\n")
+    os.utime(header, ns=(0, 0))
+    self.init_from_source()
+    assert self.structs["Thing"] == [("a", "c_double")]
+
+
+def test_preprocess_without_dD(monkeypatch):
+    """Compilers lacking ``-dD`` should still see constants in the source."""
+    from cslug import _preprocess
+    monkeypatch.setattr(_preprocess, "cc_version", lambda cc: ("tcc", (0, 9)))
+
+    self = cslug.Types(io.StringIO(), io.StringIO(CONSTANTS_SOURCE),
+                       preprocess=True)
+    self.init_from_source()
+    assert self.constants["BITS"] == 4
+    assert self.constants["MASK"] == 15
+    assert self.enums["Suit"] == [("HEARTS", 2), ("SPADES", 3)]
+
+
+def test_preprocess_error():
+    self = cslug.Types(io.StringIO(), io.StringIO("#include <not-a-header.h>"),
+                       preprocess=True)
+    with pytest.raises(cslug.exceptions.BuildError):
+        self.init_from_source()
+
+
+def test_split_line_markers():
+    chunks = cslug.c_parse.split_line_markers("""\
+orphaned
+# 1 "file.c"
+# 1 "/usr/include/header.h" 1 3 4
+int system_function();
+#line 5 "C:\\\\path\\\\header.h"
+
+int user_function();
+# 3 "file.c" 2
+int main() {}""")
+    assert chunks == [
+        ("", 1, (), "orphaned"),
+        ("file.c", 1, (), ""),
+        ("/usr/include/header.h", 1, (1, 3, 4), "int system_function();"),
+        ("C:\\path\\header.h", 5, (), "\nint user_function();"),
+        ("file.c", 3, (2,), "int main() {}"),
+    ]
+
+
+CONSTANTS_SOURCE = """
+#include <stdint.h>
+#define HEADER_GUARD
+#define BITS 4
+#define MASK ((1 << BITS) - 1)  // Refers to another constant.
+#define SCALE 2.5f
+#define NAME "not a number"
+#define SQUARE(x) ((x) * (x))
+#define NEGATIVE_DIVISION -7 / 2
+
+typedef enum { RED, GREEN = MASK, BLUE } Colour;
+enum Suit { HEARTS = 1 << 1, SPADES = HEARTS | 1, };
+enum { ANONYMOUS = -3, ANONYMOUS_2 };
+enum Unknowable { SIZE = sizeof(int) };
+
+int colour_to_int(Colour colour) { return colour; }
+"""
+
+
+def test_constants():
+    self = cslug.Types(io.StringIO(), io.StringIO(CONSTANTS_SOURCE))
+    self.make()
+
+    assert self.constants == {
+        "BITS": 4,
+        "MASK": 15,
+        "SCALE": 2.5,
+        "NEGATIVE_DIVISION": -3,
+        "ANONYMOUS": -3,
+        "ANONYMOUS_2": -2,
+    }
+    assert self.enums == {
+        "Colour": [("RED", 0), ("GREEN", 15), ("BLUE", 16)],
+        "Suit": [("HEARTS", 2), ("SPADES", 3)],
+    }
+    assert self.functions == {"colour_to_int": ["c_int", ["Colour"]]}
+
+    from_json = cslug.Types(io.StringIO(self.json_path.getvalue()))
+    from_json.init_from_json()
+    assert from_json.constants == self.constants
+    assert from_json.enums["Suit"] == [["HEARTS", 2], ["SPADES", 3]]
+
+    class FakeDLL(object):
+        pass
+
+    dll = FakeDLL()
+    from_json.apply(dll)
+    assert dll.MASK == 15 and type(dll.MASK) is int
+    assert dll.SCALE == 2.5
+    assert dll.Colour.BLUE == 16
+    assert dll.Colour(15) is dll.Colour.GREEN
+    assert dll.Suit.__members__ == {"HEARTS": dll.HEARTS, "SPADES": dll.SPADES}
+    assert dll.ANONYMOUS_2 == -2
+    assert not hasattr(dll, "SQUARE")
+    assert not hasattr(dll, "colour_to_int")
+    assert not hasattr(dll, "Unknowable")
+
+
+def test_old_json():
+    """Type jsons written by older cslug versions lack enums or constants."""
+    self = cslug.Types(io.StringIO('{"functions": {}, "structs": {}}'))
+    self.init_from_json()
+    assert self.enums == {}
+    assert self.constants == {}
+    assert self.globals == {}
+
+
+GLOBALS_SOURCE = r"""
+#include <stddef.h>
+#define N 4
+
+static int hidden = 3;
+extern int elsewhere;
+typedef int integer;
+typedef struct { int x; } Point;
+struct { int y; } anonymous;
+int (*function_pointer)(int);
+void prototype(int x);
+int function(int x) { static int not_a_global = 1; return x; }
+
+Point origin = {1};
+int a, *b, c[3], d[] = {1, 2, /* 3, */ 3,}, e[][2] = {1, 2, 3, 4, 5};
+unsigned long long f[][N] = {{1}, {2}};
+const char * names[] = {"a", "b, c", /* "d", */};
+double grid[N][N * 2];
+int designated[] = {[3] = 1};
+int unknown_size[M];
+char empty[] = "";
+char concatenated[] = "a\n" "b\x41\101é"; // 7 bytes + NULL
+wchar_t wide[] = L"\U0001F600x";
+Widget widget;
+char not_a_string[] = 'a';
+
+extern "C" {
+int in_extern_c_block;
+}
+"""
+
+
+def test_globals():
+    self = cslug.Types(io.StringIO(), io.StringIO(GLOBALS_SOURCE))
+    self.make()
+    assert self.globals == {
+        "origin": ["Point"],
+        "a": ["c_int"],
+        "b": ["c_void_p"],
+        "c": ["c_int", 3],
+        "d": ["c_int", 3],
+        "e": ["c_int", 3, 2],
+        "f": ["c_ulonglong", 2, 4],
+        "names": ["c_char_p", 2],
+        "grid": ["c_double", 4, 8],
+        "empty": ["c_char", 1],
+        "concatenated": ["c_char", 8],
+        "wide": ["c_wchar", 3 if ctypes.sizeof(ctypes.c_wchar) == 4 else 4],
+        "in_extern_c_block": ["c_int"],
+    }
+
+
+@pytest.mark.parametrize(("expression", "value"), [
+    ("0x1F", 31), ("0b101", 5), ("017", 15), ("10UL", 10), ("1.5e3f", 1500.),
+    (".5", .5), ("~0", -1), ("-(3 + 4) * 2", -14), ("7 / -2", -3),
+    ("-7 % 3", -1), ("7.0 / 2", 3.5), ("1 << 4 | 1", 17), ("A ^ 1", 3),
+    ("1 / 0", None), ("B", None), ("(int) 3", None), ("1 ? 2 : 3", None),
+    ("1 ** 2", None), ("'a'", None), ("", None), ("08", None), ("09 + 1", None),
+    ("~0u", 0xFFFFFFFF), ("-1u", 0xFFFFFFFF), ("0u - 1 >> 1", 0x7FFFFFFF),
+    ("~0ull", (1 << 64) - 1), ("0xFFFFFFFF + 1", 0), ("~0xFFFFFFFF", 0),
+    ("4294967295 + 1", 1 << 32), ("-7 / 2u", 0x7FFFFFFC), ("-1 >> 1", -1),
+    ("1u << 32", 0), ("~0u * 1.0", 0xFFFFFFFF), ("1 << 1000", 1 << 1000),
+    ("1 << 100000000000", None), ("1 << (1 << 40)", None),
+])
+def test_evaluate(expression, value):
+    assert cslug.c_parse.evaluate(expression, {"A": 2}) == value